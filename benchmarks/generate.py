@@ -0,0 +1,83 @@
+"""Generates deterministic mint csv exports for benchmarking."""
+import csv
+import random
+import argparse
+import datetime
+from bisect import bisect
+
+HEADER = ['Date', 'Description', 'Original Description', 'Amount',
+          'Transaction Type', 'Category', 'Account Name', 'Labels', 'Notes']
+
+LABELS = ['Reimbursable', 'Tax Related', 'Vacation']
+NOTES = ['split with roommate', 'see receipt, in folder', 'gift']
+
+
+def vendor_name(number):
+    """Returns the name of a vendor, a few of them need csv quoting."""
+    if number % 10 == 3:
+        return 'Vendor {}, Inc.'.format(number)
+    return 'Vendor {}'.format(number)
+
+
+def generate_rows(rows, vendors=250, categories=60, accounts=8,
+                  days=3650, seed=0, end=datetime.date(2017, 12, 31)):
+    """Yields rows of a mint export, newest first like mint sorts them.
+
+    Vendor popularity follows a zipf like curve and every vendor keeps
+    the same category and default account, so the output has the skew
+    of a real export.  The same arguments always give the same rows.
+    """
+    rng = random.Random(seed)
+    weights = list()
+    total = 0.0
+    for rank in range(vendors):
+        total += 1.0 / (rank + 1)
+        weights.append(total)
+    for row in range(rows):
+        date = end - datetime.timedelta(days=row * days // rows)
+        vendor = bisect(weights, rng.random() * total)
+        name = vendor_name(vendor)
+        credit = vendor % 17 == 16
+        account = vendor % accounts
+        if rng.random() < 0.1:
+            account = rng.randrange(accounts)
+        amount = rng.lognormvariate(3, 1.2) * (20 if credit else 1)
+        yield [
+            '{}/{:02d}/{}'.format(date.month, date.day, date.year),
+            name,
+            name.upper(),
+            '{:.2f}'.format(amount),
+            'credit' if credit else 'debit',
+            'Category {}'.format(vendor % categories),
+            'Account {}'.format(account),
+            LABELS[row % 3] if rng.random() < 0.05 else '',
+            NOTES[row % 3] if rng.random() < 0.02 else '',
+        ]
+
+
+def write_csv(path, rows, **kwargs):
+    """Writes a generated export to path."""
+    with open(path, 'w', newline='') as outfile:
+        writer = csv.writer(outfile, quoting=csv.QUOTE_ALL)
+        writer.writerow(HEADER)
+        writer.writerows(generate_rows(rows, **kwargs))
+
+
+def main():
+    """Writes a generated export from the command line."""
+    parser = argparse.ArgumentParser('generate')
+    parser.add_argument('output', help="csv file to write.")
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--vendors', type=int, default=250)
+    parser.add_argument('--categories', type=int, default=60)
+    parser.add_argument('--accounts', type=int, default=8)
+    parser.add_argument('--days', type=int, default=3650)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_csv(args.output, args.rows, vendors=args.vendors,
+              categories=args.categories, accounts=args.accounts,
+              days=args.days, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
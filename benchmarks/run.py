@@ -0,0 +1,333 @@
+"""Times the minflux pipeline stages on a generated mint export.
+
+Run from the repository root:
+
+    python benchmarks/run.py --rows 100000
+
+Results are saved to benchmarks/results/<revision>-<rows>.json, where
+revision is the git commit (with -dirty for uncommitted changes), and
+compared with the results of the nearest earlier commit, if any, or
+with a --baseline results file.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+# pylint: disable=C0413
+import generate  # noqa: E402
+import minflux.util as util  # noqa: E402
+import minflux.reader as reader  # noqa: E402
+import minflux.json as mjson  # noqa: E402
+import minflux.dbwrite as dbwrite  # noqa: E402
+from minflux.lineprotocol import linify  # noqa: E402
+from minflux.fakeinflux import FakeInflux  # noqa: E402
+from minflux.const import __version__  # noqa: E402
+
+# Seconds the fake server waits before answering a write
+SETTINGS = {'latency': 0.005}
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'results')
+
+CONFIG = {
+    'influxdb': {
+        'host': 'localhost',
+        'port': 8086,
+        'dbname': 'mint',
+        'user': 'bench',
+        'password': 'bench'
+    },
+    'mint': {'sum': None},
+    'net_sum': {
+        'exclude': {
+            'vendor': ['glob:Vendor 1?'],
+            'category': ['Category 2'],
+            'account': []
+        }
+    }
+}
+
+
+class NullTransport(object):
+    """Stands in for InfluxDBClient, dropping every write."""
+
+    def write_points(self, points):
+        """Drops json points."""
+        pass
+
+    def request(self, *args, **kwargs):
+        """Drops line protocol posts."""
+        pass
+
+
+def null_client():
+    """Returns an InfluxClient that does not touch the network."""
+    client = dbwrite.InfluxClient(CONFIG)
+    client.client = NullTransport()
+    return client
+
+
+def clear_caches():
+    """Empties the date caches so every run starts cold."""
+    # pylint: disable=W0212
+    util._date_to_iso.cache_clear()
+    util._date_to_epoch.cache_clear()
+    util.period_start.cache_clear()
+
+
+def bench_reader(csvfile):
+    """Reads every transaction."""
+    mint = reader.TransactionReader(csvfile, stream=True)
+    return sum(1 for _ in mint.transactions)
+
+
+def bench_date_to_iso(csvfile):
+    """Converts every date with a cold cache."""
+    mint = reader.TransactionReader(csvfile, stream=True)
+    dates = [entry.date for entry in mint.transactions]
+    clear_caches()
+    start = time.perf_counter()
+    for date in dates:
+        util.date_to_iso(date)
+    return len(dates), time.perf_counter() - start
+
+
+def bench_jsonify(csvfile):
+    """Builds the json body."""
+    return len(mjson.jsonify(CONFIG, csvfile))
+
+
+def bench_linify(csvfile):
+    """Builds line protocol."""
+    return sum(1 for _ in linify(CONFIG, csvfile))
+
+
+def bench_sum(csvfile):
+    """Sums a prebuilt json body."""
+    body = mjson.jsonify(CONFIG, csvfile)
+    start = time.perf_counter()
+    mjson.get_sum_of_entries(body)
+    return len(body), time.perf_counter() - start
+
+
+def bench_write_json(csvfile):
+    """Builds and batches json points into a null transport."""
+    return null_client().write_data(mjson.jsonify(CONFIG, csvfile)).points
+
+
+def bench_write_line(csvfile):
+    """Builds and batches line protocol into a null transport."""
+    return null_client().write_lines(linify(CONFIG, csvfile)).points
+
+
+def bench_write_line_single(csvfile):
+    """Builds and batches single layout line protocol."""
+    config = dict(CONFIG, mint=dict(CONFIG['mint'], layout='single'))
+    return null_client().write_lines(linify(config, csvfile)).points
+
+
+def http_write(csvfile, engine):
+    """Writes line protocol to a fake server with some latency."""
+    with FakeInflux(latency=SETTINGS['latency'], record=False) as server:
+        config = dict(CONFIG)
+        config['influxdb'] = dict(CONFIG['influxdb'], host=server.host,
+                                  port=server.port, engine=engine,
+                                  protocol='line')
+        client = dbwrite.InfluxClient(config)
+        start = time.perf_counter()
+        result = dbwrite.push_points(config, client, csvfile,
+                                     linify(config, csvfile))
+        return result.points, time.perf_counter() - start
+
+
+def bench_http_sync(csvfile):
+    """Writes to a fake server one batch at a time."""
+    return http_write(csvfile, 'sync')
+
+
+def bench_http_async(csvfile):
+    """Writes to a fake server through the async pipeline."""
+    return http_write(csvfile, 'async')
+
+
+def bench_startup(csvfile):
+    """Starts the cli in a new interpreter, up to printing the version."""
+    del csvfile
+    subprocess.check_call([sys.executable, '-m', 'minflux', '--version'],
+                          cwd=ROOT_DIR, stdout=subprocess.DEVNULL)
+    return 1
+
+
+BENCHMARKS = [
+    ('startup', bench_startup),
+    ('reader', bench_reader),
+    ('date_to_iso', bench_date_to_iso),
+    ('jsonify', bench_jsonify),
+    ('linify', bench_linify),
+    ('get_sum_of_entries', bench_sum),
+    ('write_json', bench_write_json),
+    ('write_line', bench_write_line),
+    ('write_line_single', bench_write_line_single),
+    ('http_sync', bench_http_sync),
+    ('http_async', bench_http_async),
+]
+
+
+def timed(func, csvfile):
+    """Runs a benchmark, returning (items, seconds).
+
+    Benchmarks returning a tuple time themselves, the rest are timed as
+    a whole.
+    """
+    clear_caches()
+    start = time.perf_counter()
+    items = func(csvfile)
+    elapsed = time.perf_counter() - start
+    if isinstance(items, tuple):
+        items, elapsed = items
+    return items, elapsed
+
+
+def run(csvfile, repeat=3, only=None):
+    """Runs each benchmark repeat times and keeps the best time."""
+    results = dict()
+    for name, func in BENCHMARKS:
+        if only and name not in only:
+            continue
+        best = None
+        for _ in range(repeat):
+            items, elapsed = timed(func, csvfile)
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = {
+            'items': items,
+            'seconds': round(best, 4),
+            'per_sec': round(items / best) if best else None
+        }
+        print('{:<20} {:>10.3f}s {:>12} items/s'.format(
+            name, best, results[name]['per_sec']))
+    return results
+
+
+def git(*args):
+    """Returns the output of a git command in the repository, or None."""
+    try:
+        return subprocess.check_output(
+            ['git'] + list(args), cwd=ROOT_DIR,
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def current_revision():
+    """Returns the commit the benchmarks run on, or the version."""
+    revision = git('rev-parse', '--short', 'HEAD')
+    if revision is None:
+        return __version__
+    if git('status', '--porcelain', '--untracked-files=no'):
+        revision += '-dirty'
+    return revision
+
+
+def previous_results(rows, revision):
+    """Returns the stored results of the nearest earlier commit, or None.
+
+    Uncommitted changes are compared with the results of HEAD itself.
+    """
+    history = git('rev-list', 'HEAD')
+    if history is None or not os.path.isdir(RESULTS_DIR):
+        return None
+    commits = history.split()
+    if not revision.endswith('-dirty'):
+        commits = commits[1:]
+    for commit in commits:
+        for name in os.listdir(RESULTS_DIR):
+            stored_revision, _, stored_rows = name[:-5].rpartition('-')
+            if name.endswith('.json') and stored_rows == str(rows) and \
+                    stored_revision and commit.startswith(stored_revision):
+                return load_results(os.path.join(RESULTS_DIR, name))
+    return None
+
+
+def load_results(path):
+    """Returns a stored results file."""
+    with open(path) as infile:
+        return json.load(infile)
+
+
+def compare(results, previous):
+    """Prints the change of every benchmark since previous results."""
+    print('compared with {}:'.format(
+        previous.get('revision', previous['version'])))
+    for name, result in sorted(results.items()):
+        old = previous['results'].get(name)
+        if old is None or not old['seconds']:
+            continue
+        print('{:<20} {:>+9.1f}%'.format(
+            name, 100.0 * (result['seconds'] / old['seconds'] - 1)))
+
+
+def main():
+    """Generates an export, runs the benchmarks and stores the results."""
+    parser = argparse.ArgumentParser('benchmarks')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--vendors', type=int, default=250)
+    parser.add_argument('--categories', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=SETTINGS['latency'],
+                        help="Seconds the fake server takes per write.")
+    parser.add_argument('--only', nargs='*',
+                        help="Benchmarks to run, default is all.")
+    parser.add_argument('--no-save', action='store_true',
+                        help="Do not store the results.")
+    parser.add_argument('--baseline',
+                        help="Results file to compare with, default is "
+                             "the nearest earlier commit with results.")
+    args = parser.parse_args()
+    SETTINGS['latency'] = args.latency
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csvfile = os.path.join(tmpdir, 'transactions.csv')
+        generate.write_csv(csvfile, args.rows, vendors=args.vendors,
+                           categories=args.categories, seed=args.seed)
+        results = run(csvfile, repeat=args.repeat, only=args.only)
+
+    revision = current_revision()
+    record = {
+        'revision': revision,
+        'version': __version__,
+        'python': platform.python_version(),
+        'rows': args.rows,
+        'vendors': args.vendors,
+        'categories': args.categories,
+        'seed': args.seed,
+        'latency': args.latency,
+        'results': results
+    }
+    if args.baseline is not None:
+        previous = load_results(args.baseline)
+    else:
+        previous = previous_results(args.rows, revision)
+    if previous is not None:
+        compare(results, previous)
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, '{}-{}.json'.format(revision,
+                                                             args.rows))
+        with open(path, 'w') as outfile:
+            json.dump(record, outfile, indent=1, sort_keys=True)
+        print('results saved to {}'.format(path))
+
+
+if __name__ == '__main__':
+    main()
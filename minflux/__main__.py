@@ -1,14 +1,27 @@
 """Primary module for minflux."""
+import os
 import sys
+import time
 import glob
 import logging
 import argparse
+from collections import deque
 import minflux.util as util
 import minflux.yaml as yaml
 import minflux.dbwrite as dbwrite
+from minflux.manifest import Manifest
+from minflux.archive import create_archiver, archived_files
+from minflux.dedup import load_index, TransactionIndex
+from minflux.json import use_running_totals
+from minflux.stats import STATS
 from minflux.const import (CONF_FILE, CONF_MINT, CONF_LOGGER,
-                           CONF_LEVEL, CONF_DIR)
-from minflux.const import (__version__, ARG_CONFIG, ARG_NOPUSH)
+                           CONF_LEVEL, CONF_DIR, CONF_MANIFEST, CONF_DEDUP)
+from minflux.const import (__version__, ARG_CONFIG, ARG_NOPUSH,
+                           ARG_JOBS, ARG_ONERROR, ARG_FORCE, ARG_COMPRESS,
+                           ARG_PROFILE, ARG_CONFIG_CACHE, ARG_REGENERATE,
+                           ARG_WATCH, ARG_SETTLE)
+from minflux.const import (POLICY_STOP, POLICY_CONTINUE,
+                           DEFAULT_MANIFEST, DEFAULT_SETTLE)
 
 LOGGER = logging.getLogger(__name__)
 
@@ -29,11 +42,63 @@ class Parser(object):
             type=str,
             required=True
         )
+        self.parser.add_argument(
+            '--{}'.format(ARG_CONFIG_CACHE.replace('_', '-')),
+            help="Reuse the validated config until config.yaml changes.",
+            action='store_true'
+        )
         self.parser.add_argument(
             '--{}'.format(ARG_NOPUSH.replace('_', '-')),
             help="Only generate data file without pushing to db.",
             action='store_true'
         )
+        self.parser.add_argument(
+            '--{}'.format(ARG_COMPRESS),
+            help="Gzip the data file generated with --skip-push.",
+            action='store_true'
+        )
+        self.parser.add_argument(
+            '--{}'.format(ARG_JOBS),
+            help="Number of csv files to parse in parallel (default is 1, "
+                 "or the number of cores with --regenerate-all).",
+            type=int,
+            default=None
+        )
+        self.parser.add_argument(
+            '--{}'.format(ARG_ONERROR.replace('_', '-')),
+            help="Stop at the first failed file or continue with the rest.",
+            choices=[POLICY_STOP, POLICY_CONTINUE],
+            default=POLICY_STOP
+        )
+        self.parser.add_argument(
+            '--{}'.format(ARG_REGENERATE.replace('_', '-')),
+            help="Re-ingest every archived csv file as well as new ones.",
+            action='store_true'
+        )
+        self.parser.add_argument(
+            '--{}'.format(ARG_WATCH),
+            help="Keep running and ingest csv files as they land in the "
+                 "mint directory.",
+            action='store_true'
+        )
+        self.parser.add_argument(
+            '--{}'.format(ARG_SETTLE),
+            help="Seconds a csv file must be unchanged before --watch "
+                 "ingests it (default is {}).".format(DEFAULT_SETTLE),
+            type=float,
+            default=DEFAULT_SETTLE
+        )
+        self.parser.add_argument(
+            '--{}'.format(ARG_FORCE),
+            help="Ingest every csv file, even if unchanged since last run.",
+            action='store_true'
+        )
+        self.parser.add_argument(
+            '--{}'.format(ARG_PROFILE),
+            help="Write a cProfile dump of the run to this file.",
+            type=str,
+            default=None
+        )
         self.parser.add_argument(
             '--{}'.format('version'),
             action='version',
@@ -55,22 +120,277 @@ def get_arguments():
     return opts
 
 
+def skip_unchanged(manifest, filelist):
+    """Returns the files that changed since they were last ingested."""
+    changed = list()
+    for file in filelist:
+        if manifest.is_current(file):
+            LOGGER.info("Skipping unchanged %s", file)
+        else:
+            changed.append(file)
+    return changed
+
+
+def record_result(manifest, file, stamp, result):
+    """Adds a successfully written file to the manifest."""
+    if manifest is not None and result:
+        manifest.record(file, stamp, getattr(result, 'points', None))
+
+
+def archive_result(archiver, file, result):
+    """Queues a successfully written file for archiving.
+
+    Files read back from the archive are left where they are.
+    """
+    if archiver is not None and result and not file.endswith('.gz'):
+        archiver.submit(file)
+
+
+def write_sequential(config, db_client, filelist, args, manifest=None,
+                     index=None, archiver=None):
+    """Parses and writes each file in turn.
+
+    A file that cannot be parsed fails on its own, like a failed write.
+    """
+    status = True
+    for file in filelist:
+        LOGGER.info("Found %s", file)
+        stamp = manifest.stamp(file) if manifest is not None else None
+        start = time.perf_counter()
+        try:
+            result = dbwrite.influxdb_write(config, db_client,
+                                            file, db_skip=args[ARG_NOPUSH],
+                                            index=index,
+                                            compress=args[ARG_COMPRESS])
+        except (Exception, SystemExit) as err:  # pylint: disable=W0703
+            LOGGER.error("Could not parse %s: %s", file, err)
+            if index is not None:
+                index.rollback()
+            result = False
+        STATS.record_file(file, time.perf_counter() - start,
+                          getattr(result, 'points', None))
+        record_result(manifest, file, stamp, result)
+        archive_result(archiver, file, result)
+        if not result:
+            LOGGER.error("Could not write %s to database", file)
+            status = False
+            if args[ARG_ONERROR] == POLICY_STOP:
+                break
+    return status
+
+
+def write_parallel(config, db_client, filelist, args, manifest=None,
+                   index=None, archiver=None):
+    """Parses files in a process pool and writes them from this process.
+
+    At most twice as many files as workers are parsed ahead of the
+    writer so finished point lists do not pile up in memory.  In chunked
+    mode workers spool the points to temporary files instead, which are
+    written a chunk at a time.  Workers read the transaction index from
+    disk; new keys are committed here once a file is written.  A file
+    sharing transactions with one written earlier in the run is converted
+    again in this process against the updated index.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    status = True
+    chunked = dbwrite.chunk_rows(config) is not None
+    build = dbwrite.build_point_file if chunked else dbwrite.build_point_list
+    files = iter(filelist)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=args[ARG_JOBS]) as executor:
+        def submit_next():
+            """Queues the next file for parsing, if any are left."""
+            file = next(files, None)
+            if file is not None:
+                stamp = manifest.stamp(file) if manifest is not None else None
+                future = executor.submit(build, config, file,
+                                         db_skip=args[ARG_NOPUSH])
+                pending.append((file, stamp, future))
+
+        for _ in range(2 * args[ARG_JOBS]):
+            submit_next()
+        while pending:
+            file, stamp, future = pending.popleft()
+            submit_next()
+            LOGGER.info("Found %s", file)
+            start = time.perf_counter()
+            try:
+                points, keys, stats = future.result()
+                STATS.merge(stats)
+            except (Exception, SystemExit) as err:  # pylint: disable=W0703
+                LOGGER.error("Could not parse %s: %s", file, err)
+                points = None
+            result = False
+            if points is not None and overlaps_index(index, keys):
+                # The worker missed keys committed by an earlier file of
+                # this run, so the file is converted again here
+                LOGGER.info("%s overlaps a file written earlier, "
+                            "converting it again", file)
+                if chunked:
+                    os.remove(points)
+                result = dbwrite.influxdb_write(config, db_client, file,
+                                                db_skip=args[ARG_NOPUSH],
+                                                index=index,
+                                                compress=args[ARG_COMPRESS])
+            elif points is not None:
+                if chunked:
+                    points = dbwrite.spooled_points(points)
+                result = dbwrite.push_points(config, db_client, file, points,
+                                             db_skip=args[ARG_NOPUSH],
+                                             compress=args[ARG_COMPRESS])
+                if chunked:
+                    # Removes the spooled file
+                    points.close()
+                if index is not None and result and not args[ARG_NOPUSH]:
+                    index.commit(keys)
+            STATS.record_file(file, time.perf_counter() - start,
+                              getattr(result, 'points', None))
+            record_result(manifest, file, stamp, result)
+            archive_result(archiver, file, result)
+            if not result:
+                LOGGER.error("Could not write %s to database", file)
+                status = False
+                if args[ARG_ONERROR] == POLICY_STOP:
+                    for _, _, queued in pending:
+                        if not queued.cancel() and chunked:
+                            discard_spool(queued)
+                    break
+    return status
+
+
+def overlaps_index(index, keys):
+    """Checks if any new keys of a worker are committed by now."""
+    return index is not None and any(index.seen(key) for key in keys)
+
+
+def discard_spool(future):
+    """Removes the points a worker spooled for a file that is skipped."""
+    try:
+        os.remove(future.result()[0])
+    except (Exception, SystemExit):  # pylint: disable=W0703
+        pass
+
+
 def main():
-    """Start conversion."""
+    """Start conversion, profiling it if asked to."""
     args = get_arguments()
-    config = yaml.load_yaml(args[ARG_CONFIG])
+    if args[ARG_PROFILE] is None:
+        convert(args)
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        convert(args)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(args[ARG_PROFILE])
+        LOGGER.info("Profile written to %s", args[ARG_PROFILE])
+
+
+def convert(args):
+    """Converts and writes the configured csv files."""
+    STATS.reset()
+    if args[ARG_JOBS] is None:
+        args[ARG_JOBS] = 1
+        if args[ARG_REGENERATE]:
+            args[ARG_JOBS] = os.cpu_count() or 1
+    config = yaml.load_yaml(args[ARG_CONFIG],
+                            cache=args[ARG_CONFIG_CACHE])
     util.set_loggers(
         LOGGER,
         file=config[CONF_LOGGER][CONF_FILE],
         level=config[CONF_LOGGER][CONF_LEVEL]
     )
-    db_client = dbwrite.InfluxClient(config)
+    if args[ARG_JOBS] > 1 and use_running_totals(config):
+        # Sums and rollups of each file are added to the totals of the
+        # files before
+        LOGGER.info("Writing one file at a time to keep running totals")
+        args[ARG_JOBS] = 1
+    # The database client is only set up, and imported, when pushing
+    db_client = None
+    if not args[ARG_NOPUSH]:
+        db_client = dbwrite.InfluxClient(config)
+    index = load_index(config[CONF_MINT].get(CONF_DEDUP))
+    # Files are only archived once their points are in the database
+    archiver = None
+    if not args[ARG_NOPUSH]:
+        archiver = create_archiver(config)
+    try:
+        if args[ARG_WATCH]:
+            watch_source(config, db_client, args, index, archiver)
+            return
+        if args[ARG_REGENERATE]:
+            status = regenerate(config, db_client, args, archiver)
+        else:
+            status = write_source(config, db_client, args, index, archiver)
+    finally:
+        # A file that could not be archived would be ingested again
+        if archiver is not None and not archiver.close():
+            status = False
+
+    STATS.report(LOGGER, caches=util.date_cache_info())
+    if status and not args[ARG_NOPUSH]:
+        LOGGER.info("Databse write successful! :)")
+    elif not status:
+        LOGGER.error("Database write unsuccessful :(")
+        sys.exit(1)
+
+
+def regenerate(config, db_client, args, archiver=None):
+    """Writes every archived csv file and the csv files of the source.
+
+    Archived files are decompressed while they are read.  The manifest
+    is not used.  With dedup, a new index is built from every file
+    instead of the stored one, so sums and rollups count every
+    transaction once and no key of a regenerated file is lost.  It
+    replaces the dedup index once every file was written.
+    """
+    mint_config = dict(config[CONF_MINT])
+    dedup = mint_config.get(CONF_DEDUP)
+    index = None
+    if dedup is not None:
+        rebuilt = '{}.regenerate'.format(dedup)
+        for path in glob.glob('{}*'.format(rebuilt)):
+            os.remove(path)
+        # Workers of write_parallel read the index being rebuilt
+        mint_config[CONF_DEDUP] = rebuilt
+        index = TransactionIndex(rebuilt)
+    config = dict(config)
+    config[CONF_MINT] = mint_config
+    if CONF_FILE in mint_config:
+        filelist = [mint_config[CONF_FILE]]
+    else:
+        filelist = glob.glob('{}/*.csv'.format(mint_config[CONF_DIR]))
+    filelist = archived_files(config) + [file for file in filelist
+                                         if os.path.isfile(file)]
+    if not filelist:
+        LOGGER.warning("No csv files found")
+        sys.exit(2)
+    LOGGER.info("Regenerating %d files with %d jobs", len(filelist),
+                args[ARG_JOBS])
+    if args[ARG_JOBS] > 1:
+        status = write_parallel(config, db_client, filelist, args,
+                                index=index, archiver=archiver)
+    else:
+        status = write_sequential(config, db_client, filelist, args,
+                                  index=index, archiver=archiver)
+    if index is not None and status and not args[ARG_NOPUSH]:
+        index.replace(dedup)
+    return status
+
+
+def write_source(config, db_client, args, index=None, archiver=None):
+    """Writes the configured file or directory."""
     status = False
     try:
         source = config[CONF_MINT][CONF_FILE]
         LOGGER.debug("Using single file %s", source)
         status = dbwrite.influxdb_write(config, db_client,
-                                        source, db_skip=args[ARG_NOPUSH])
+                                        source, db_skip=args[ARG_NOPUSH],
+                                        index=index,
+                                        compress=args[ARG_COMPRESS])
+        archive_result(archiver, source, status)
     except KeyError:
         source = config[CONF_MINT][CONF_DIR]
         LOGGER.debug("Using source dir %s", source)
@@ -78,21 +398,81 @@ def main():
         if not filelist:
             LOGGER.warning("No csv files found")
             sys.exit(2)
-        status = True
-        for file in filelist:
-            LOGGER.info("Found %s", file)
-            result = dbwrite.influxdb_write(config, db_client,
-                                            file, db_skip=args[ARG_NOPUSH])
-            if not result:
-                LOGGER.error("Could not write %s to database", file)
-                status = False
-                break
+        manifest = None
+        if not args[ARG_NOPUSH]:
+            manifest = Manifest(config[CONF_MINT].get(
+                CONF_MANIFEST, '{}/{}'.format(source, DEFAULT_MANIFEST)))
+            if not args[ARG_FORCE]:
+                filelist = skip_unchanged(manifest, filelist)
+        try:
+            if args[ARG_JOBS] > 1:
+                status = write_parallel(config, db_client, filelist, args,
+                                        manifest=manifest, index=index,
+                                        archiver=archiver)
+            else:
+                status = write_sequential(config, db_client, filelist, args,
+                                          manifest=manifest, index=index,
+                                          archiver=archiver)
+        finally:
+            if manifest is not None:
+                manifest.save()
+    return status
 
-    if status and not args[ARG_NOPUSH]:
-        LOGGER.info("Databse write successful! :)")
-    elif not status:
-        LOGGER.error("Database write unsuccessful :(")
+
+def watch_source(config, db_client, args, index=None, archiver=None):
+    """Writes csv files as they land in the source directory.
+
+    The config, database client and dedup index are set up once and kept
+    for every file.  A failed file is logged and tried again when it next
+    changes.  Runs until interrupted or sent SIGTERM.
+    """
+    import signal
+    from minflux.watch import watch
+    source = config[CONF_MINT].get(CONF_DIR)
+    if source is None or CONF_FILE in config[CONF_MINT] or \
+            args[ARG_REGENERATE]:
+        LOGGER.error("--watch needs a mint directory and no mint file "
+                     "or --regenerate-all")
         sys.exit(1)
+    manifest = None
+    if not args[ARG_NOPUSH]:
+        manifest = Manifest(config[CONF_MINT].get(
+            CONF_MANIFEST, '{}/{}'.format(source, DEFAULT_MANIFEST)))
+
+    def handle(filelist):
+        """Writes a batch of settled files."""
+        if manifest is not None and not args[ARG_FORCE]:
+            filelist = skip_unchanged(manifest, filelist)
+        if not filelist:
+            return
+        STATS.reset()
+        try:
+            if args[ARG_JOBS] > 1:
+                status = write_parallel(config, db_client, filelist, args,
+                                        manifest=manifest, index=index,
+                                        archiver=archiver)
+            else:
+                status = write_sequential(config, db_client, filelist, args,
+                                          manifest=manifest, index=index,
+                                          archiver=archiver)
+        finally:
+            if manifest is not None:
+                manifest.save()
+        if archiver is not None and not archiver.wait():
+            status = False
+        STATS.report(LOGGER, caches=util.date_cache_info())
+        if not status:
+            LOGGER.error("Database write unsuccessful :(")
+
+    # Stop the same way for a service manager as for Ctrl-C
+    sigterm = signal.signal(signal.SIGTERM, signal.default_int_handler)
+    LOGGER.info("Watching %s for csv files", source)
+    try:
+        watch(source, handle, settle=args[ARG_SETTLE])
+    except KeyboardInterrupt:
+        LOGGER.info("Stopped watching %s", source)
+    finally:
+        signal.signal(signal.SIGTERM, sigterm)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,142 @@
+"""Module used to archive csv files once they are written."""
+import os
+import glob
+import gzip
+import uuid
+import shutil
+import pathlib
+import logging
+from minflux.stats import STATS, STAGE_ARCHIVE
+from minflux.const import (CONF_MINT, CONF_ARCHIVE, CONF_DIR, CONF_LEVEL,
+                           CONF_FILE)
+from minflux.const import DEFAULT_ARCHIVE_LEVEL
+
+LOGGER = logging.getLogger(__name__)
+
+# Files are compressed in the background while later files are written
+ARCHIVE_WORKERS = 2
+
+COPY_BLOCK_SIZE = 1 << 20
+
+
+def create_archiver(config):
+    """Returns an Archiver if archiving is configured, otherwise None."""
+    if CONF_ARCHIVE not in config[CONF_MINT]:
+        return None
+    arch_config = config[CONF_MINT][CONF_ARCHIVE] or dict()
+    return Archiver(arch_config.get(CONF_DIR),
+                    level=arch_config.get(CONF_LEVEL, DEFAULT_ARCHIVE_LEVEL))
+
+
+def archived_files(config):
+    """Returns the archived csv files of the configured source."""
+    arch_config = config[CONF_MINT].get(CONF_ARCHIVE) or dict()
+    archive_dir = arch_config.get(CONF_DIR)
+    if not archive_dir:
+        source = config[CONF_MINT].get(CONF_DIR)
+        if source is None:
+            source = os.path.dirname(config[CONF_MINT][CONF_FILE])
+        archive_dir = os.path.join(source, 'archive')
+    return sorted(glob.glob(os.path.join(archive_dir, '*.csv.gz')))
+
+
+def archive_path(csvfile, archive_dir=None):
+    """Returns the preferred archive file name of csvfile."""
+    current_path = pathlib.Path(csvfile)
+    if not archive_dir:
+        archive_dir = str(current_path.parent / 'archive')
+    return os.path.join(archive_dir, '{}.gz'.format(current_path.name))
+
+
+def unique_path(path):
+    """Returns path made unique with a random suffix before '.csv.gz'."""
+    base = path[:-len('.csv.gz')] if path.endswith('.csv.gz') else path
+    return '{}_{}.csv.gz'.format(base, uuid.uuid4().hex[:12])
+
+
+def archive_file(csvfile, archive_dir=None, level=DEFAULT_ARCHIVE_LEVEL):
+    """Compresses csvfile into the archive, then removes it.
+
+    The archive is written to a temporary file and only linked into
+    place once complete, so a crash never leaves a truncated archive.
+    If the name is taken, a random suffix is used instead of probing
+    for a free one.  Returns the archive file name.
+    """
+    with STATS.timer(STAGE_ARCHIVE):
+        target = archive_path(csvfile, archive_dir)
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, '.{}.{}.tmp'.format(
+            os.path.basename(target), uuid.uuid4().hex))
+        try:
+            with open(tmp_path, 'wb') as outfile:
+                with gzip.GzipFile(filename=os.path.basename(csvfile),
+                                   mode='wb', compresslevel=level,
+                                   fileobj=outfile) as gzipfile:
+                    with open(csvfile, 'rb') as infile:
+                        shutil.copyfileobj(infile, gzipfile, COPY_BLOCK_SIZE)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            target = install(tmp_path, target)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        os.remove(csvfile)
+    LOGGER.info("Archived %s to %s", csvfile, target)
+    return target
+
+
+def install(tmp_path, target):
+    """Moves tmp_path to target without replacing an existing file.
+
+    Returns the name the file was installed under.
+    """
+    try:
+        os.link(tmp_path, target)
+    except OSError:
+        # Taken, or hard links are not supported by the file system
+        target = unique_path(target)
+        os.replace(tmp_path, target)
+        return target
+    os.remove(tmp_path)
+    return target
+
+
+class Archiver(object):
+    """Archives written csv files on a background thread pool."""
+
+    def __init__(self, archive_dir=None, level=DEFAULT_ARCHIVE_LEVEL,
+                 workers=ARCHIVE_WORKERS):
+        """Initialize the archiver."""
+        from concurrent.futures import ThreadPoolExecutor
+        self.archive_dir = archive_dir
+        self.level = level
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = list()
+
+    def submit(self, csvfile):
+        """Queues csvfile for archiving."""
+        LOGGER.debug("Queueing %s for archive", csvfile)
+        self.pending.append((csvfile, self.executor.submit(
+            archive_file, csvfile, self.archive_dir, self.level)))
+
+    def wait(self):
+        """Waits for queued files, returning False if any failed."""
+        status = True
+        for csvfile, future in self.pending:
+            try:
+                future.result()
+            except Exception as err:  # pylint: disable=W0703
+                LOGGER.error("Could not archive %s: %s", csvfile, err)
+                status = False
+        self.pending = list()
+        return status
+
+    def close(self):
+        """Waits for queued files and stops the workers."""
+        status = self.wait()
+        self.executor.shutdown()
+        return status
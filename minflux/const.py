@@ -32,6 +32,54 @@ CONF_ACCOUNT = 'account'
 CONF_DIR = 'directory'
 CONF_ARCHIVE = 'archive'
 CONF_SUM = 'sum'
+CONF_MANIFEST = 'manifest'
+CONF_DEDUP = 'dedup'
+CONF_PERIODS = 'periods'
+CONF_BATCH_SIZE = 'batch_size'
+CONF_RETRIES = 'retries'
+CONF_RETRY_DELAY = 'retry_delay'
+CONF_PROTOCOL = 'protocol'
+CONF_ENGINE = 'engine'
+CONF_CONCURRENCY = 'concurrency'
+CONF_CHUNK_ROWS = 'chunk_rows'
+CONF_MEMORY_BUDGET = 'memory_budget'
+CONF_LAYOUT = 'layout'
+CONF_ROLLUP = 'rollup'
+
+#### PROTOCOLS ####
+PROTOCOL_JSON = 'json'
+PROTOCOL_LINE = 'line'
+
+#### SUM PERIODS ####
+PERIOD_DAY = 'day'
+PERIOD_WEEK = 'week'
+PERIOD_MONTH = 'month'
+
+#### WRITE ENGINES ####
+ENGINE_SYNC = 'sync'
+ENGINE_ASYNC = 'async'
+
+#### MEASUREMENT LAYOUTS ####
+# One measurement each for the category, vendor and account of a row
+LAYOUT_TRIPLE = 'triple'
+# A single measurement with the category, vendor and account as tags
+LAYOUT_SINGLE = 'single'
+MEASUREMENT_TRANSACTIONS = 'transactions'
+
+#### DEFAULTS ####
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 1.0
+DEFAULT_PROTOCOL = PROTOCOL_JSON
+DEFAULT_ENGINE = ENGINE_SYNC
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MANIFEST = '.minflux_manifest.json'
+DEFAULT_SETTLE = 2.0
+DEFAULT_ARCHIVE_LEVEL = 6
+DEFAULT_LAYOUT = LAYOUT_TRIPLE
+
+# Validated config, stored next to config.yaml with --config-cache
+CONFIG_CACHE = '.config.yaml.cache'
 
 #### ATTRIBUTES ####
 ATTR_DATE = 'date'
@@ -46,3 +94,16 @@ ATTR_AMOUNT = 'amount'
 #### ARGUMENTS ####
 ARG_CONFIG = 'config'
 ARG_NOPUSH = 'skip_push'
+ARG_JOBS = 'jobs'
+ARG_ONERROR = 'on_error'
+ARG_FORCE = 'force'
+ARG_COMPRESS = 'compress'
+ARG_PROFILE = 'profile'
+ARG_CONFIG_CACHE = 'config_cache'
+ARG_REGENERATE = 'regenerate_all'
+ARG_WATCH = 'watch'
+ARG_SETTLE = 'settle'
+
+#### ERROR POLICIES ####
+POLICY_STOP = 'stop'
+POLICY_CONTINUE = 'continue'
@@ -1,28 +1,232 @@
 """Module that handles writing to database."""
+import os
+import time
+import random
 import logging
-import json
-from influxdb import InfluxDBClient
-from minflux.json import jsonify
+import tempfile
+from minflux.json import (jsonify, iter_json, use_single_measurement,
+                          MEASUREMENTS)
+from minflux.lineprotocol import linify, PRECISION
+from minflux.util import chunks
+from minflux.dedup import load_index
+from minflux.dump import dump_path, dump_points, load_points
+from minflux.stats import (STATS, STAGE_BUILD, STAGE_WRITE, COUNT_POINTS,
+                           COUNT_BYTES, COUNT_BATCHES)
 from minflux.const import (CONF_INFLUX, CONF_HOST, CONF_PORT,
-                           CONF_USER, CONF_PASSWORD, CONF_DBNAME)
+                           CONF_USER, CONF_PASSWORD, CONF_DBNAME,
+                           CONF_BATCH_SIZE, CONF_RETRIES, CONF_RETRY_DELAY,
+                           CONF_PROTOCOL, PROTOCOL_LINE, PROTOCOL_JSON,
+                           CONF_ENGINE,
+                           ENGINE_ASYNC, CONF_CONCURRENCY, CONF_MINT,
+                           CONF_DEDUP, CONF_CHUNK_ROWS, CONF_MEMORY_BUDGET)
+from minflux.const import (DEFAULT_BATCH_SIZE, DEFAULT_RETRIES,
+                           DEFAULT_RETRY_DELAY, DEFAULT_PROTOCOL,
+                           DEFAULT_ENGINE, DEFAULT_CONCURRENCY)
 
 LOGGER = logging.getLogger(__name__)
 
+# Rough memory held per point of a chunk, measured on generated exports
+BYTES_PER_POINT = {PROTOCOL_JSON: 680, PROTOCOL_LINE: 256}
 
-def influxdb_write(config, client, source, db_skip=False):
-    """Reads source data and writes to client."""
-    json_body = jsonify(config, source)
+
+def influxdb_write(config, client, source, db_skip=False, index=None,
+                   compress=False):
+    """Reads source data and writes to client.
+
+    With a TransactionIndex, already ingested transactions are skipped and
+    the new ones are committed to the index once the write succeeded.
+    The async engine pulls points as it sends batches, so they are built
+    while earlier batches are in flight.
+    """
+    lazy = chunk_rows(config) is not None or use_async_engine(config)
+    points = build_points(config, source, db_skip=db_skip, index=index,
+                          lazy=lazy)
+    result = push_points(config, client, source, points, db_skip=db_skip,
+                         compress=compress)
+    if index is not None:
+        if result and not db_skip:
+            index.commit()
+        else:
+            index.rollback()
+    return result
+
+
+def use_line_protocol(config):
+    """Checks if points should be built as line protocol."""
+    protocol = config[CONF_INFLUX].get(CONF_PROTOCOL, DEFAULT_PROTOCOL)
+    return protocol == PROTOCOL_LINE
+
+
+def use_async_engine(config):
+    """Checks if points should be written through the async pipeline."""
+    engine = config[CONF_INFLUX].get(CONF_ENGINE, DEFAULT_ENGINE)
+    return engine == ENGINE_ASYNC
+
+
+def chunk_rows(config):
+    """Returns the number of rows to process at a time, or None.
+
+    A memory_budget in MB is turned into rows with BYTES_PER_POINT; if
+    chunk_rows is set as well the smaller of the two is used.
+    """
+    mint_config = config.get(CONF_MINT) or dict()
+    rows = mint_config.get(CONF_CHUNK_ROWS)
+    budget = mint_config.get(CONF_MEMORY_BUDGET)
+    if budget is not None:
+        protocol = config[CONF_INFLUX].get(CONF_PROTOCOL, DEFAULT_PROTOCOL)
+        row_size = BYTES_PER_POINT[protocol] * points_per_row(config)
+        budget_rows = max(1, budget * 2 ** 20 // row_size)
+        rows = budget_rows if rows is None else min(rows, budget_rows)
+    return rows
+
+
+def points_per_row(config):
+    """Returns the number of points built from every row."""
+    if use_single_measurement(config):
+        return 1
+    return len(MEASUREMENTS)
+
+
+def build_points(config, source, db_skip=False, index=None, lazy=False):
+    """Converts source data into points for the configured protocol.
+
+    Points only written to disk, and all points when lazy is set, are
+    generated on demand so they are never held in memory all at once.
+    """
+    if use_line_protocol(config):
+        return STATS.timed_iter(STAGE_BUILD,
+                                linify(config, source, index=index),
+                                counter=COUNT_POINTS)
+    if db_skip or lazy:
+        return STATS.timed_iter(STAGE_BUILD,
+                                iter_json(config, source, index=index),
+                                counter=COUNT_POINTS)
+    with STATS.timer(STAGE_BUILD):
+        points = jsonify(config, source, index=index)
+    STATS.count(COUNT_POINTS, len(points))
+    return points
+
+
+def build_point_list(config, source, db_skip=False):
+    """Builds points in a worker process.
+
+    Returns the points as a list that can be pickled, together with the
+    keys of the new transactions, which the caller commits after writing,
+    and the stats recorded while building them.
+    """
+    before = STATS.snapshot()
+    index = load_index(config[CONF_MINT].get(CONF_DEDUP))
+    points = list(build_points(config, source, db_skip=db_skip, index=index))
+    return (points, (index.pending if index is not None else set()),
+            STATS.since(before))
+
+
+def build_point_file(config, source, db_skip=False):
+    """Builds points in a worker process, spooling them to a temp file.
+
+    Used in chunked mode so no process holds the points of a whole file.
+    Returns the file, which the caller reads back with load_points and
+    removes, the keys of the new transactions and the recorded stats.
+    """
+    before = STATS.snapshot()
+    index = load_index(config[CONF_MINT].get(CONF_DEDUP))
+    line_protocol = use_line_protocol(config)
+    suffix = dump_path('', line_protocol=line_protocol)
+    handle, path = tempfile.mkstemp(prefix='minflux-', suffix=suffix)
+    os.close(handle)
+    try:
+        dump_points(build_points(config, source, db_skip=db_skip,
+                                 index=index, lazy=True),
+                    path, line_protocol=line_protocol)
+    except BaseException:
+        os.remove(path)
+        raise
+    return (path, (index.pending if index is not None else set()),
+            STATS.since(before))
+
+
+def spooled_points(path):
+    """Yields the points of a build_point_file file, then removes it."""
+    try:
+        yield from load_points(path)
+    finally:
+        os.remove(path)
+
+
+def push_points(config, client, source, points, db_skip=False,
+                compress=False):
+    """Writes points built from source to client.
+
+    With db_skip the points are streamed to a file next to source
+    instead, as line protocol or NDJSON depending on the protocol.
+    """
     if db_skip:
         LOGGER.warning("Skipping database write.")
-        json_info = json.dumps(json_body)
-        with open('{}.json'.format(source), 'w') as outfile:
-            json.dump(json_info, outfile)
-        LOGGER.info("Data sent to %s.json", source)
-        return True
+        line_protocol = use_line_protocol(config)
+        path = dump_path(source, line_protocol=line_protocol,
+                         compress=compress)
+        count = dump_points(points, path, line_protocol=line_protocol)
+        return WriteResult(points=count)
+
+    rows = chunk_rows(config)
+    if rows is None:
+        result = write_points(config, client, points)
+    else:
+        # Each chunk is written and released before the next is built;
+        # the generator keeps the sum and net_sum state between chunks
+        result = WriteResult()
+        size = rows * points_per_row(config)
+        for number, chunk in enumerate(chunks(points, size)):
+            LOGGER.debug("Writing chunk %d of %s (%d points)",
+                         number + 1, source, len(chunk))
+            result.add(write_points(config, client, chunk))
+    log_result(result, source)
+    return result
+
+
+def write_points(config, client, points):
+    """Writes points with the configured engine and protocol."""
+    if use_async_engine(config):
+        return client.write_async(points,
+                                  line_protocol=use_line_protocol(config))
+    if use_line_protocol(config):
+        return client.write_lines(points)
+    return client.write_data(points)
+
+
+def log_result(result, source):
+    """Logs the batch accounting of a write."""
+    if result:
+        LOGGER.info("Wrote %d points from %s in %d batches",
+                    result.points, source, result.batches)
+    else:
+        LOGGER.error("%d of %d batches from %s failed to write",
+                     result.failed, result.batches, source)
+
+
+class WriteResult(object):
+    """Per-batch accounting of a database write."""
 
-    client.write_data(json_body)
+    def __init__(self, points=0, batches=0, failed=0):
+        """Initialize the result counters."""
+        self.points = points
+        self.batches = batches
+        self.failed = failed
 
-    return True
+    def add(self, other):
+        """Adds the counters of another result."""
+        self.points += other.points
+        self.batches += other.batches
+        self.failed += other.failed
+
+    def __bool__(self):
+        """A write is successful if no batch failed."""
+        return self.failed == 0
+
+    def __repr__(self):
+        """Return representation of the counters."""
+        return 'WriteResult(points={}, batches={}, failed={})'.format(
+            self.points, self.batches, self.failed)
 
 
 class InfluxClient(object):
@@ -35,6 +239,22 @@ class InfluxClient(object):
         self.dbname = config[CONF_INFLUX][CONF_DBNAME]
         self.user = config[CONF_INFLUX][CONF_USER]
         self.password = config[CONF_INFLUX][CONF_PASSWORD]
+        self.batch_size = config[CONF_INFLUX].get(CONF_BATCH_SIZE,
+                                                  DEFAULT_BATCH_SIZE)
+        self.retries = config[CONF_INFLUX].get(CONF_RETRIES,
+                                               DEFAULT_RETRIES)
+        self.retry_delay = config[CONF_INFLUX].get(CONF_RETRY_DELAY,
+                                                   DEFAULT_RETRY_DELAY)
+        self.concurrency = config[CONF_INFLUX].get(CONF_CONCURRENCY,
+                                                   DEFAULT_CONCURRENCY)
+        # Imported here as influxdb pulls in requests, which is only
+        # needed when pushing to the database
+        from influxdb import InfluxDBClient
+        from influxdb.exceptions import (InfluxDBClientError,
+                                         InfluxDBServerError)
+        # Kept here so the write path does not import on every batch
+        self.rejected_errors = InfluxDBClientError
+        self.retried_errors = (InfluxDBServerError, OSError)
         self.client = InfluxDBClient(self.host,
                                      self.port,
                                      self.user,
@@ -42,6 +262,81 @@ class InfluxClient(object):
                                      self.dbname)
 
     def write_data(self, data):
-        """Wrapper for influxdb writes."""
+        """Wrapper for influxdb writes, sent in batches."""
+        return self.write_batches(data, self.client.write_points)
+
+    def write_lines(self, lines):
+        """Writes line protocol strings, sent in batches as raw bytes."""
+        return self.write_batches(lines, self.post_lines)
+
+    def write_async(self, data, line_protocol=False):
+        """Writes data through the asyncio pipeline engine."""
+        from minflux.pipeline import write_pipelined
+        LOGGER.debug("Writing to %s as %s with %d concurrent requests",
+                     self.dbname, self.user, self.concurrency)
+        send = self.post_lines if line_protocol else self.client.write_points
+        return write_pipelined(self, data, send, WriteResult(),
+                               self.concurrency)
+
+    def post_lines(self, lines):
+        """Posts a batch of lines to the write endpoint as-is."""
+        payload = '\n'.join(lines).encode('utf-8') + b'\n'
+        STATS.count(COUNT_BYTES, len(payload))
+        self.client.request('write', 'POST',
+                            params={'db': self.dbname,
+                                    'precision': PRECISION},
+                            data=payload,
+                            expected_response_code=204,
+                            headers={
+                                'Content-Type': 'application/octet-stream'
+                            })
+
+    def write_batches(self, data, send):
+        """Sends data in batches using send, counting the outcome."""
         LOGGER.debug("Writing to %s as %s", self.dbname, self.user)
-        self.client.write_points(data)
+        result = WriteResult()
+        for batch in chunks(data, self.batch_size):
+            result.batches += 1
+            if self.write_batch(batch, send):
+                result.points += len(batch)
+            else:
+                result.failed += 1
+        return result
+
+    def write_batch(self, batch, send):
+        """Writes a single batch, retrying transient errors."""
+        STATS.count(COUNT_BATCHES)
+        with STATS.timer(STAGE_WRITE):
+            return self._write_batch(batch, send)
+
+    def _write_batch(self, batch, send):
+        """Sends a batch until it is written or retries run out.
+
+        Server errors (5xx) and connection or timeout errors, which
+        requests raises as IOError subclasses, are retried.
+        """
+        attempt = 0
+        while True:
+            try:
+                send(batch)
+                return True
+            except self.rejected_errors as err:
+                LOGGER.error("Batch of %d points rejected: %s",
+                             len(batch), err)
+                return False
+            except self.retried_errors as err:
+                if attempt >= self.retries:
+                    LOGGER.error("Giving up on batch of %d points after "
+                                 "%d attempts: %s",
+                                 len(batch), attempt + 1, err)
+                    return False
+                delay = self.backoff(attempt)
+                LOGGER.warning("Write failed (%s), retrying in %.2fs",
+                               err, delay)
+                time.sleep(delay)
+                attempt += 1
+
+    def backoff(self, attempt):
+        """Exponential backoff with jitter for the given attempt."""
+        delay = self.retry_delay * (2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
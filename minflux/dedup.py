@@ -0,0 +1,193 @@
+"""Module used to skip transactions that were already ingested."""
+import os
+import json
+import array
+import hashlib
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+# Keys are stored on disk as native 64 bit unsigned integers
+KEY_TYPECODE = 'Q'
+
+# Running sum and rollup totals are kept in a json file next to the index
+TOTALS_SUFFIX = '.totals'
+
+
+def load_index(path):
+    """Returns the TransactionIndex at path, or None if path is None."""
+    if path is None:
+        return None
+    return TransactionIndex(path)
+
+
+def merge_totals(stored, values):
+    """Adds a sum, and a count, to the stored ones."""
+    return [round(stored[0] + values[0], 2)] + [
+        old + new for old, new in zip(stored[1:], values[1:])]
+
+
+class TransactionIndex(object):
+    """Persistent set of transaction keys that were already ingested.
+
+    Each transaction is reduced to a 64 bit hash of its date, amount,
+    account, description and type.  Keys found while converting a file
+    are kept pending until its points have been written, then appended
+    to the index file with commit().  Only committed keys are treated as
+    seen, so repeated rows within the file being converted are kept.
+
+    As every transaction is only counted once, the index also keeps the
+    running sum and rollup totals, which the sums and rollups of new
+    transactions are added to.
+    """
+
+    def __init__(self, path):
+        """Initialize the index, loading keys from path if it exists."""
+        self.path = path
+        self.keys = set()
+        self.pending = set()
+        self.totals = None
+        self.pending_totals = dict()
+        keys = array.array(KEY_TYPECODE)
+        try:
+            with open(self.path, 'rb') as infile:
+                data = infile.read()
+            usable = len(data) - len(data) % keys.itemsize
+            keys.frombytes(data[:usable])
+        except FileNotFoundError:
+            pass
+        self.keys.update(keys)
+        LOGGER.debug("Loaded %d transaction keys from %s",
+                     len(self.keys), self.path)
+
+    @staticmethod
+    def key(time, amount, account, description, txtype):
+        """Returns the 64 bit key of a transaction.
+
+        The amount is hashed unsigned as the type already carries the sign.
+        """
+        raw = '\x1f'.join([
+            str(time),
+            '{:.2f}'.format(abs(amount)),
+            account,
+            description,
+            txtype
+        ])
+        digest = hashlib.sha256(raw.encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'little')
+
+    def check_entry(self, entry):
+        """Checks a Transaction, marking it pending if it was not seen."""
+        key = self.key(entry.time, entry.amount, entry.account_name,
+                       entry.description, entry.transaction_type)
+        if self.seen(key):
+            return True
+        self.add(key)
+        return False
+
+    def seen(self, key):
+        """Checks if a transaction was committed by an earlier write."""
+        return key in self.keys
+
+    def add(self, key):
+        """Marks a transaction as pending until the next commit."""
+        self.pending.add(key)
+
+    @staticmethod
+    def total_key(*group):
+        """Returns the key of a sum or rollup group in the totals file."""
+        return '\x1f'.join(
+            item.isoformat() if hasattr(item, 'isoformat') else item
+            for item in group)
+
+    def load_totals(self):
+        """Returns the committed totals, loading them on first use."""
+        if self.totals is None:
+            self.totals = dict()
+            path = self.path + TOTALS_SUFFIX
+            try:
+                with open(path, 'r') as infile:
+                    self.totals = json.load(infile)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as err:
+                LOGGER.warning("Ignoring unreadable totals %s: %s",
+                               path, err)
+        return self.totals
+
+    def add_total(self, group, values):
+        """Returns values with the committed total of group added.
+
+        values are the sum, and for rollups the count, of the new
+        transactions.  They are kept pending until the next commit.
+        """
+        key = self.total_key(*group)
+        self.pending_totals[key] = values
+        stored = self.load_totals().get(key)
+        if stored is None:
+            return values
+        return merge_totals(stored, values)
+
+    def add_sums(self, sums):
+        """Returns (measurement, start, sum) items with the totals added."""
+        return [(measurement, start,
+                 self.add_total((measurement, start), [total])[0])
+                for measurement, start, total in sums]
+
+    def add_rollups(self, groups):
+        """Returns rollup groups with the committed totals added.
+
+        groups are the (measurement, start, dimension, name, sum, count)
+        of the new transactions.
+        """
+        return [tuple(group[:4]) + tuple(self.add_total(group[:4], group[4:]))
+                for group in groups]
+
+    def commit_totals(self):
+        """Adds pending sums and rollups to the totals and saves them."""
+        pending = self.pending_totals
+        self.pending_totals = dict()
+        if not pending:
+            return
+        totals = self.load_totals()
+        for key, values in pending.items():
+            stored = totals.get(key)
+            totals[key] = list(values) if stored is None else \
+                merge_totals(stored, values)
+        path = self.path + TOTALS_SUFFIX
+        tmp_path = '{}.tmp'.format(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(tmp_path, 'w') as outfile:
+            json.dump(totals, outfile)
+        os.replace(tmp_path, path)
+
+    def commit(self, keys=None):
+        """Appends pending (or the given) keys to the index file."""
+        self.commit_totals()
+        keys = self.pending if keys is None else keys
+        new_keys = array.array(KEY_TYPECODE,
+                               (key for key in keys if key not in self.keys))
+        self.pending = set()
+        if not new_keys:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'ab') as outfile:
+            new_keys.tofile(outfile)
+        self.keys.update(new_keys)
+        LOGGER.debug("Committed %d transaction keys to %s",
+                     len(new_keys), self.path)
+
+    def rollback(self):
+        """Forgets pending keys and totals after a failed write."""
+        self.pending = set()
+        self.pending_totals = dict()
+
+    def replace(self, path):
+        """Moves the index and its totals over the index at path."""
+        for suffix in ['', TOTALS_SUFFIX]:
+            if os.path.exists(self.path + suffix):
+                os.replace(self.path + suffix, path + suffix)
+            elif os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        self.path = path
@@ -0,0 +1,60 @@
+"""Module used to write points to disk instead of the database."""
+import gzip
+import json
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+EXT_NDJSON = 'ndjson'
+EXT_LINE = 'lp'
+EXT_GZIP = 'gz'
+
+
+def dump_path(source, line_protocol=False, compress=False):
+    """Returns the file that points built from source are written to."""
+    path = '{}.{}'.format(source, EXT_LINE if line_protocol else EXT_NDJSON)
+    if compress:
+        path = '{}.{}'.format(path, EXT_GZIP)
+    return path
+
+
+def open_dump(path, mode='r'):
+    """Opens a dump file as text, through gzip if it is compressed."""
+    if path.endswith('.{}'.format(EXT_GZIP)):
+        return gzip.open(path, '{}t'.format(mode), encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def dump_points(points, path, line_protocol=False):
+    """Streams points to path, one point per line.
+
+    Line protocol strings are written as-is and can be posted straight
+    to the /write endpoint; json points are written as NDJSON.  Returns
+    the number of points written.
+    """
+    count = 0
+    with open_dump(path, 'w') as outfile:
+        for point in points:
+            if not line_protocol:
+                point = json.dumps(point, separators=(',', ':'))
+            outfile.write(point)
+            outfile.write('\n')
+            count += 1
+    LOGGER.info("Wrote %d points to %s", count, path)
+    return count
+
+
+def load_points(path):
+    """Reads points back from a dump file, one point at a time.
+
+    NDJSON dumps yield json points ready for write_points, line protocol
+    dumps yield the lines.
+    """
+    line_protocol = not (path.endswith('.{}'.format(EXT_NDJSON)) or
+                         path.endswith('.{}.{}'.format(EXT_NDJSON, EXT_GZIP)))
+    with open_dump(path) as infile:
+        for line in infile:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            yield line if line_protocol else json.loads(line)
@@ -0,0 +1,261 @@
+"""In-process stand-in for the InfluxDB HTTP write endpoint.
+
+Used to load test the write engines without a database:
+
+    with FakeInflux(latency=0.01, error_rate=0.1) as server:
+        config[CONF_INFLUX][CONF_PORT] = server.port
+        ...
+
+It can also be run on its own with ``python -m minflux.fakeinflux``.
+"""
+import gzip
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+
+# How often the serving thread checks for a shutdown request
+POLL_INTERVAL = 0.05
+
+
+class WriteRequest(object):
+    """A write received by the fake server."""
+
+    __slots__ = ('db', 'precision', 'size', 'points', 'status', 'received')
+
+    def __init__(self, db, precision, size, points, status):
+        """Initialize the request record."""
+        self.db = db
+        self.precision = precision
+        self.size = size
+        self.points = points
+        self.status = status
+        self.received = time.time()
+
+    def __repr__(self):
+        """Return representation of the request."""
+        return 'WriteRequest(db={}, points={}, size={}, status={})'.format(
+            self.db, self.points, self.size, self.status)
+
+
+class FakeInflux(object):
+    """Fake InfluxDB server answering /ping and /write.
+
+    Every write waits latency seconds (plus up to jitter seconds) before
+    it is answered.  Bodies larger than max_body_size are rejected with a
+    413, a share of error_rate writes and the next fail_next writes are
+    answered with error_status.  Every write is logged in requests and,
+    if record is set, the accepted lines are kept in order in lines.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=0, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_status=500, fail_next=0,
+                 max_body_size=None, record=True, seed=None):
+        """Initialize the server, port 0 picks a free port."""
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.fail_next = fail_next
+        self.max_body_size = max_body_size
+        self.record = record
+        self.requests = list()
+        self.lines = list()
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.httpd = _Server((host, port), _Handler)
+        self.httpd.fake = self
+        self.thread = None
+
+    @property
+    def host(self):
+        """Return the address the server listens on."""
+        return self.httpd.server_address[0]
+
+    @property
+    def port(self):
+        """Return the port the server listens on."""
+        return self.httpd.server_address[1]
+
+    @property
+    def points(self):
+        """Return the number of accepted points."""
+        with self.lock:
+            return sum(req.points for req in self.requests
+                       if req.status == 204)
+
+    def start(self):
+        """Serves requests from a background thread."""
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       args=(POLL_INTERVAL,),
+                                       name='fakeinflux', daemon=True)
+        self.thread.start()
+        LOGGER.debug("Fake InfluxDB listening on %s:%d", self.host, self.port)
+        return self
+
+    def stop(self):
+        """Stops serving and closes the socket."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        """Start the server for the duration of a with block."""
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        """Stop the server at the end of a with block."""
+        self.stop()
+
+    def reset(self):
+        """Forgets everything received so far."""
+        with self.lock:
+            self.requests = list()
+            self.lines = list()
+
+    def delay(self):
+        """Returns the time to wait before answering a write."""
+        if not self.jitter:
+            return self.latency
+        with self.lock:
+            return self.latency + self.random.uniform(0, self.jitter)
+
+    def write_status(self, size):
+        """Returns the status code to answer a write of size bytes with."""
+        if self.max_body_size is not None and size > self.max_body_size:
+            return 413
+        with self.lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return self.error_status
+            if self.error_rate and self.random.random() < self.error_rate:
+                return self.error_status
+        return 204
+
+    def receive(self, params, body):
+        """Handles a write body, returning the response status."""
+        time.sleep(self.delay())
+        status = self.write_status(len(body))
+        lines = list()
+        if status == 204:
+            lines = [line for line in body.decode('utf-8').split('\n')
+                     if line]
+        request = WriteRequest(params.get('db'),
+                               params.get('precision', 'n'),
+                               len(body), len(lines), status)
+        with self.lock:
+            self.requests.append(request)
+            if self.record:
+                self.lines.extend(lines)
+        return status
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    """HTTP server handling each request in its own thread."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Request handler of the fake server."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        """Logs requests at debug level instead of stderr."""
+        LOGGER.debug(*args)
+
+    def do_GET(self):  # pylint: disable=C0103
+        """Answers /ping."""
+        self.drain()
+        if urlparse(self.path).path == '/ping':
+            self.answer(204)
+        else:
+            self.answer(404, 'not found')
+
+    def do_POST(self):  # pylint: disable=C0103
+        """Answers /write."""
+        url = urlparse(self.path)
+        body = self.drain()
+        if url.path == '/ping':
+            self.answer(204)
+            return
+        if url.path != '/write':
+            self.answer(404, 'not found')
+            return
+        params = {key: value[-1] for key, value in
+                  parse_qs(url.query).items()}
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        status = self.server.fake.receive(params, body)
+        if status == 204:
+            self.answer(204)
+        elif status == 413:
+            self.answer(413, 'Request Entity Too Large')
+        else:
+            self.answer(status, 'injected error')
+
+    def drain(self):
+        """Reads the request body."""
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def answer(self, status, error=None):
+        """Sends a response with an optional influx style error body."""
+        body = b''
+        if error is not None:
+            body = json.dumps({'error': error}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('X-Influxdb-Version', 'fake')
+        self.send_header('Content-Length', str(len(body)))
+        if body:
+            self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    """Runs the fake server in the foreground."""
+    parser = argparse.ArgumentParser('fakeinflux')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=8086)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Seconds to wait before answering a write.")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help="Random extra seconds added to the latency.")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Share of writes answered with an error.")
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--max-body-size', type=int, default=None,
+                        help="Reject larger write bodies with a 413.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = FakeInflux(args.host, args.port, latency=args.latency,
+                        jitter=args.jitter, error_rate=args.error_rate,
+                        error_status=args.error_status,
+                        max_body_size=args.max_body_size, record=False)
+    LOGGER.info("Listening on %s:%d", server.host, server.port)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        LOGGER.info("Received %d writes with %d points",
+                    len(server.requests), server.points)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,180 +1,449 @@
 """Module used to create influxdb json data."""
 
+import re
+import sys
+import fnmatch
 import logging
+from operator import attrgetter
 import minflux.reader as reader
 import minflux.util as util
-from minflux.const import (ATTR_DATE, ATTR_DESC, ATTR_LABELS,
-                           ATTR_NOTES, ATTR_ACCOUNT, ATTR_CATEGORY,
-                           ATTR_TYPE, ATTR_AMOUNT)
+from minflux.stats import STATS, STAGE_SUM
+from minflux.const import ATTR_DESC, ATTR_ACCOUNT, ATTR_CATEGORY
 from minflux.const import (CONF_NETSUM, CONF_EXCLUDE, CONF_VENDOR,
                            CONF_CATEGORY, CONF_ACCOUNT, CONF_MINT,
-                           CONF_DIR, CONF_ARCHIVE, CONF_SUM)
+                           CONF_SUM, CONF_PERIODS, CONF_ROLLUP, CONF_DEDUP,
+                           PERIOD_DAY, PERIOD_WEEK, PERIOD_MONTH)
+from minflux.const import (CONF_LAYOUT, LAYOUT_SINGLE, DEFAULT_LAYOUT,
+                           MEASUREMENT_TRANSACTIONS)
 
 LOGGER = logging.getLogger(__name__)
 
+# Prefixes marking net_sum exclusions as patterns instead of exact names
+PATTERN_GLOB = 'glob:'
+PATTERN_REGEX = 're:'
+
+# Measurements of the triple layout, also the names sums are kept under
+MEASUREMENTS = ['category', 'vendor', 'account']
+
+# Names of the triple layout measurements of a transaction
+MEASURE_NAMES = attrgetter(ATTR_CATEGORY, ATTR_DESC, ATTR_ACCOUNT)
+
+# The single layout writes every tag to one measurement
+SINGLE_LAYOUT = ((MEASUREMENT_TRANSACTIONS, None),)
+
+# Rollups are written to rollup_day, rollup_week and rollup_month
+ROLLUP_PREFIX = 'rollup_'
+
+# Tag holding the field a rollup groups by, named as in the triple layout
+ROLLUP_DIMENSIONS = list(zip(MEASUREMENTS,
+                             [ATTR_CATEGORY, ATTR_DESC, ATTR_ACCOUNT]))
+
+SUM_PREFIX = {
+    PERIOD_MONTH: 'sum_',
+    PERIOD_WEEK: 'sum_week_',
+    PERIOD_DAY: 'sum_day_'
+}
+
+
+def sum_entry(measurement, start, value):
+    """Returns a sum as a json point stamped with the period start."""
+    return {
+        'measurement': measurement,
+        'time': start.isoformat(),
+        'fields': {
+            'value': value
+        }
+    }
+
+
+def rollup_entry(measurement, start, dimension, name, total, count):
+    """Returns a rollup as a json point stamped with the period start."""
+    return {
+        'measurement': measurement,
+        'time': start.isoformat(),
+        'tags': {
+            'dimension': dimension,
+            'name': name
+        },
+        'fields': {
+            'sum': float(total),
+            'count': count
+        }
+    }
+
 
 class JsonData(object):
-    """Representation of json data for InfluxDB."""
+    """Representation of json data for InfluxDB.
+
+    Encodes the rows and aggregates of iter_points as json points.
+    """
 
     def __init__(self, config, headers):
         """Initialize the Jsonjson_data class."""
         self.headers = headers
-        self.body = list()
-        self.all_dates = list()
-        self.net_value = 0
-        self.add_net_sum_measure = False
-        self.check_net_sum_exclusion = False
+        self.strings = dict()
+        self.tag_cache = dict()
+        self.tag_cache_date = None
         self.measure_map = {
             'vendor': ATTR_DESC,
             'category': ATTR_CATEGORY,
             'account': ATTR_ACCOUNT
         }
-        self.json_entry = {
-            'tags': {
-                'label': None,
-                'notes': None,
-            },
-            'time': None,
-        }
-        if CONF_NETSUM in config:
-            self.add_net_sum_measure = True
-            if (config[CONF_NETSUM] is not None and
-                    CONF_EXCLUDE in config[CONF_NETSUM]):
-                self.check_net_sum_exclusion = True
+
+    def intern(self, value):
+        """Returns the single copy of value used in this run."""
+        return self.strings.setdefault(value, value)
 
     def create_measurement(self, entry, measure_type):
         """Returns measurement name for measure_type."""
-        return entry[self.headers[self.measure_map[measure_type]]]
+        return self.intern(getattr(entry, self.measure_map[measure_type]))
 
-    def create_tags(self, entry, measurement):
-        """Removes 'measurement' from normal tag list."""
+    def create_tags(self, entry, measurement=None):
+        """Removes 'measurement' from normal tag list.
+
+        Without a measurement, as in the single layout, every tag is kept.
+
+        Identical tag sets share one dict, so callers must not modify it.
+        Tag sets always include the raw date, so only the tags of the
+        current date are cached; mint exports are sorted by date.
+        """
+        if entry.date != self.tag_cache_date:
+            self.tag_cache = dict()
+            self.tag_cache_date = entry.date
+        key = (measurement, entry.description, entry.category,
+               entry.account_name, entry.labels, entry.notes)
+        try:
+            return self.tag_cache[key]
+        except KeyError:
+            pass
+        intern = self.intern
         tag_dict = {
-            'vendor': entry[self.headers[ATTR_DESC]],
-            'category': entry[self.headers[ATTR_CATEGORY]],
-            'account': entry[self.headers[ATTR_ACCOUNT]],
-            'raw_date': entry[self.headers[ATTR_DATE]],
-            'label': entry[self.headers[ATTR_LABELS]],
-            'notes': entry[self.headers[ATTR_NOTES]],
+            'vendor': intern(entry.description),
+            'category': intern(entry.category),
+            'account': intern(entry.account_name),
+            'raw_date': intern(entry.date),
+            'label': intern(entry.labels),
+            'notes': intern(entry.notes),
         }
         tag_dict.pop(measurement, None)
+        self.tag_cache[key] = tag_dict
 
         return tag_dict
 
-    def create_entry(self, entry, date):
-        """Creates a generic json data set."""
-        self.json_entry['time'] = date
-
-    def create_value_entry(self, value_dict):
-        """Adds a custom field to data."""
-        self.json_entry['fields'] = value_dict
+    def encode_row(self, entry, measurements):
+        """Returns a point per (measurement name, tag to drop) pair."""
+        date = util.date_to_iso(entry.date)
+        value_dict = {'value': entry.amount}
+        intern = self.intern
+        return [
+            {
+                'measurement': intern(name),
+                'tags': self.create_tags(entry, measurement),
+                'time': date,
+                'fields': value_dict
+            }
+            for name, measurement in measurements
+        ]
 
-    def append_net_sum_entry(self):
-        """Appends a net_sum entry to the end of the json body."""
-        json_entry = {
+    @staticmethod
+    def encode_net_sum(value, entry):
+        """Returns the net_sum point, stamped with the date of entry."""
+        return {
             'measurement': CONF_NETSUM,
-            'time': min(self.all_dates),
+            'time': util.date_to_iso(entry.date),
             'fields': {
-                'value': self.net_value
+                'value': value
             }
         }
-        self.body.append(json_entry)
-
-
-def jsonify(config, csvfile):
-    """Converts csv from mint into json file."""
-    try:
-        arch_config = config[CONF_MINT][CONF_ARCHIVE]
-        arch_dir = None
-        if arch_dir is not None and CONF_DIR in arch_config:
-            arch_dir = arch_config[CONF_DIR]
-        mint = reader.TransactionReader(csvfile,
-                                        archive=True,
-                                        archive_dir=arch_dir)
-    except KeyError:
-        mint = reader.TransactionReader(csvfile)
-
-    json_data = JsonData(config, mint.headers)
-
-    for entry in mint.data:
-        value_dict = dict()
-        value = util.convert_value(entry[json_data.headers[ATTR_AMOUNT]],
-                                   entry[json_data.headers[ATTR_TYPE]])
-        date = util.date_to_iso(entry[json_data.headers[ATTR_DATE]])
-        value_dict['value'] = value
-        json_data.all_dates.append(date)
-
-        json_data.create_entry(entry, date)
-
-        for measurement in ['category', 'vendor', 'account']:
-            measure_name = json_data.create_measurement(entry, measurement)
-            json_data.json_entry['measurement'] = measure_name
-            tag_dict = json_data.create_tags(entry, measurement)
-            json_data.json_entry['tags'] = tag_dict
-            LOGGER.debug("Generating data for %s", measure_name)
-            json_data.create_value_entry(value_dict)
-            json_data.body.append(json_data.json_entry.copy())
-
-        if CONF_NETSUM in config and CONF_EXCLUDE in config[CONF_NETSUM]:
-            json_data.net_value += check_entry_for_net_sum(config[CONF_NETSUM],
-                                                           entry,
-                                                           json_data.headers,
-                                                           value)
-        elif CONF_NETSUM in config:
-            json_data.net_value += value
-
-    if CONF_NETSUM in config:
-        json_data.append_net_sum_entry()
-
-    if CONF_SUM in config[CONF_MINT]:
-        for entry in get_sum_of_entries(json_data.body):
-            json_data.body.append(entry)
-
-    return json_data.body
-
-
-def check_entry_for_net_sum(config, entry, headers, value):
+
+    encode_sum = staticmethod(sum_entry)
+    encode_rollup = staticmethod(rollup_entry)
+
+
+def jsonify(config, csvfile, index=None):
+    """Converts csv from mint into json file.
+
+    If a TransactionIndex is given, rows it has already seen are dropped.
+    """
+    return list(iter_json(config, csvfile, index=index))
+
+
+def iter_json(config, csvfile, index=None):
+    """Converts csv from mint into json points, one point at a time."""
+    mint = reader.TransactionReader(csvfile, stream=True)
+    yield from iter_points(config, mint, JsonData(config, mint.headers),
+                           index=index)
+
+
+def iter_points(config, mint, encoder, index=None):
+    """Turns the transactions of a TransactionReader into points.
+
+    Dedup, the layout, net_sum, sums and rollups are handled here for
+    every protocol.  The encoder (JsonData or LineEncoder) only turns rows
+    and aggregates into json points or lines.  Rows a TransactionIndex
+    has already seen are dropped.
+    """
+    net_sum = create_net_sum_aggregator(config)
+    sums = create_sum_aggregator(config)
+    rollups = create_rollup_aggregator(config)
+    single = use_single_measurement(config)
+
+    for entry in mint.transactions:
+        if index is not None and index.check_entry(entry):
+            continue
+        value = entry.amount
+        measure_names = MEASURE_NAMES(entry)
+        if single:
+            measurements = SINGLE_LAYOUT
+        else:
+            measurements = zip(measure_names, MEASUREMENTS)
+        yield from encoder.encode_row(entry, measurements)
+
+        if sums is not None:
+            sums.add(measure_names, entry.date, value)
+
+        if rollups is not None:
+            rollups.add(entry, value)
+
+        if net_sum is not None:
+            net_sum.add(entry, value)
+
+    # Without new rows there is no date to stamp the net sum with
+    if net_sum is not None and net_sum.first is not None:
+        yield encoder.encode_net_sum(net_sum.value, net_sum.first)
+
+    if sums is not None:
+        with STATS.timer(STAGE_SUM):
+            totals = list(sums.items())
+            if index is not None:
+                # Only new transactions were added up, so the totals of
+                # earlier files are added to them
+                totals = index.add_sums(totals)
+        for measurement, start, total in totals:
+            yield encoder.encode_sum(measurement, start, total)
+
+    if rollups is not None:
+        with STATS.timer(STAGE_SUM):
+            groups = list(rollups.items())
+            if index is not None:
+                # Only new transactions were added up, so the totals of
+                # earlier files are added to them
+                groups = index.add_rollups(groups)
+        for group in groups:
+            yield encoder.encode_rollup(*group)
+
+
+def use_single_measurement(config):
+    """Checks if rows are written to a single transactions measurement."""
+    layout = (config.get(CONF_MINT) or dict()).get(CONF_LAYOUT,
+                                                   DEFAULT_LAYOUT)
+    return layout == LAYOUT_SINGLE
+
+
+def check_entry_for_net_sum(config, entry, value):
     """Checks if entry is valid for summing."""
-    vendor = entry[headers[ATTR_DESC]]
-    category = entry[headers[ATTR_CATEGORY]]
-    account = entry[headers[ATTR_ACCOUNT]]
+    return NetSumFilter(config[CONF_EXCLUDE]).check_entry(entry, value)
+
+
+class NetSumFilter(object):
+    """Compiled net_sum exclusion rules.
+
+    Exact names are looked up in frozensets.  Entries prefixed with
+    'glob:' or 're:' are merged into one precompiled pattern per field.
+    Results are memoized per (vendor, category, account).
+    """
+
+    def __init__(self, exclude):
+        """Compile the exclusion lists of the net_sum config."""
+        self.names = dict()
+        self.patterns = dict()
+        for field in [CONF_VENDOR, CONF_CATEGORY, CONF_ACCOUNT]:
+            names, pattern = self.compile(
+                util.ensure_list(exclude.get(field)))
+            self.names[field] = names
+            self.patterns[field] = pattern
+        self.cache = dict()
+
+    @staticmethod
+    def compile(rules):
+        """Returns a frozenset of names and a merged pattern, or None."""
+        names = set()
+        patterns = list()
+        for rule in rules:
+            rule = str(rule)
+            if rule.startswith(PATTERN_GLOB):
+                patterns.append(fnmatch.translate(rule[len(PATTERN_GLOB):]))
+            elif rule.startswith(PATTERN_REGEX):
+                patterns.append(rule[len(PATTERN_REGEX):])
+            else:
+                names.add(rule)
+        if not patterns:
+            return frozenset(names), None
+        merged = '|'.join('(?:{})'.format(pattern) for pattern in patterns)
+        try:
+            return frozenset(names), re.compile(merged)
+        except re.error as err:
+            LOGGER.error("Invalid net_sum exclude pattern. %s", err)
+            sys.exit(1)
+
+    def excluded(self, vendor, category, account):
+        """Checks if a transaction is excluded from the net sum."""
+        key = (vendor, category, account)
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        result = False
+        for field, value in zip([CONF_VENDOR, CONF_CATEGORY, CONF_ACCOUNT],
+                                key):
+            pattern = self.patterns[field]
+            if (value in self.names[field] or
+                    (pattern is not None and pattern.match(value))):
+                result = True
+                break
+        self.cache[key] = result
+        return result
 
-    if (vendor not in config[CONF_EXCLUDE][CONF_VENDOR] and
-            category not in config[CONF_EXCLUDE][CONF_CATEGORY] and
-            account not in config[CONF_EXCLUDE][CONF_ACCOUNT]):
+    def check_entry(self, entry, value):
+        """Returns value if entry counts towards the net sum, else 0."""
+        if self.excluded(entry.description, entry.category,
+                         entry.account_name):
+            return 0
         return value
-    return 0
 
 
-def get_sum_of_entries(body):
+def create_net_sum_aggregator(config):
+    """Returns a NetSumAggregator if net_sum is configured, else None."""
+    if CONF_NETSUM not in config:
+        return None
+    net_sum_config = config[CONF_NETSUM] or dict()
+    return NetSumAggregator(net_sum_config.get(CONF_EXCLUDE))
+
+
+class NetSumAggregator(object):
+    """Net sum of the transactions that are not excluded.
+
+    The transaction with the earliest date is kept to stamp the sum with.
+    """
+
+    def __init__(self, exclude=None):
+        """Initialize the aggregator, compiling the exclusions if any."""
+        self.net_sum_filter = None
+        if exclude is not None:
+            self.net_sum_filter = NetSumFilter(exclude)
+        self.value = 0.0
+        self.first = None
+
+    def add(self, entry, value):
+        """Adds value unless the transaction is excluded."""
+        if self.first is None or entry.time < self.first.time:
+            self.first = entry
+        if self.net_sum_filter is not None:
+            value = self.net_sum_filter.check_entry(entry, value)
+        self.value += value
+
+
+def create_sum_aggregator(config):
+    """Returns a SumAggregator if sums are configured, else None."""
+    if CONF_SUM not in config[CONF_MINT]:
+        return None
+    sum_config = config[CONF_MINT][CONF_SUM] or dict()
+    return SumAggregator(sum_config.get(CONF_PERIODS))
+
+
+class SumAggregator(object):
+    """Running sums per measurement and per day, week or month.
+
+    Only one value is kept per (measurement, period, start) group, so
+    memory grows with the number of groups rather than with the rows.
+    """
+
+    def __init__(self, periods=None):
+        """Initialize the aggregator for the given periods."""
+        self.periods = periods or [PERIOD_MONTH]
+        self.sums = dict()
+
+    def add(self, measurements, date, value):
+        """Adds value on the raw date to each of the measurements."""
+        starts = [(period, util.period_start(date, period))
+                  for period in self.periods]
+        for measurement in measurements:
+            for period, start in starts:
+                key = (measurement, period, start)
+                self.sums[key] = self.sums.get(key, 0) + value
+
+    def items(self):
+        """Yields (measurement, start datetime, value) for each group."""
+        for (measurement, period, start), value in self.sums.items():
+            yield (SUM_PREFIX[period] + measurement, start, round(value, 2))
+
+    def json_entries(self):
+        """Returns the sums as json points stamped with the period start."""
+        return [sum_entry(*item) for item in self.items()]
+
+
+def create_rollup_aggregator(config):
+    """Returns a RollupAggregator if rollups are configured, else None."""
+    if CONF_ROLLUP not in config[CONF_MINT]:
+        return None
+    rollup_config = config[CONF_MINT][CONF_ROLLUP] or dict()
+    return RollupAggregator(rollup_config.get(CONF_PERIODS))
+
+
+def use_running_totals(config):
+    """Checks if sums or rollups are added to totals kept by dedup."""
+    mint_config = config.get(CONF_MINT) or dict()
+    return CONF_DEDUP in mint_config and (
+        CONF_SUM in mint_config or CONF_ROLLUP in mint_config)
+
+
+class RollupAggregator(object):
+    """Sum and count per category, vendor and account, and period.
+
+    Rollup points are stamped with the start of their period and tagged
+    with the dimension and name they group, so writing the same rows
+    again overwrites them instead of adding up.
+    """
+
+    def __init__(self, periods=None):
+        """Initialize the aggregator for the given periods."""
+        self.periods = periods or [PERIOD_DAY, PERIOD_WEEK, PERIOD_MONTH]
+        self.groups = dict()
+
+    def add(self, entry, value):
+        """Adds the value of a transaction to each of its groups."""
+        starts = [(period, util.period_start(entry.date, period))
+                  for period in self.periods]
+        for dimension, attr in ROLLUP_DIMENSIONS:
+            name = getattr(entry, attr)
+            for period, start in starts:
+                key = (period, start, dimension, name)
+                group = self.groups.get(key)
+                if group is None:
+                    self.groups[key] = [value, 1]
+                else:
+                    group[0] += value
+                    group[1] += 1
+
+    def items(self):
+        """Yields (measurement, start, dimension, name, sum, count)."""
+        for key, (total, count) in self.groups.items():
+            period, start, dimension, name = key
+            yield (ROLLUP_PREFIX + period, start, dimension, name,
+                   round(total, 2), count)
+
+    def json_entries(self):
+        """Returns the rollups as json points."""
+        return [rollup_entry(*item) for item in self.items()]
+
+
+def get_sum_of_entries(body, periods=None):
     """Find all measurements and sum across them."""
-    all_measures = dict()
+    sums = SumAggregator(periods)
     for entry in body:
-        key = entry['measurement']
-        if key not in all_measures:
-            all_measures[key] = list()
         try:
-            value = [
-                entry['tags']['raw_date'],
-                entry['fields']['value']
-            ]
-            all_measures[key].append(value)
+            sums.add([entry['measurement']], entry['tags']['raw_date'],
+                     entry['fields']['value'])
         except KeyError:
             pass
-    new_entries = []
-    for key, entries in all_measures.items():
-        val = 0
-        LOGGER.debug("%s", entries)
-        for entry in entries:
-            iso_date = util.date_to_iso(entry[0], month_only=True)
-            val += entry[1]
-        entry_name = 'sum_{}'.format(key)
-        LOGGER.debug("Creating %s", entry_name)
-        sum_entry = {
-            'measurement': entry_name,
-            'time': iso_date,
-            'fields': {
-                'value': val
-            }
-        }
-        new_entries.append(sum_entry)
-    return new_entries
+    return sums.json_entries()
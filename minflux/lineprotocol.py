@@ -0,0 +1,111 @@
+"""Module used to encode mint data as InfluxDB line protocol."""
+
+import logging
+from functools import lru_cache
+import minflux.reader as reader
+from minflux.json import iter_points
+from minflux.const import CONF_NETSUM
+
+LOGGER = logging.getLogger(__name__)
+
+# Timestamps are written with second precision
+PRECISION = 's'
+
+# Vendors, categories and accounts repeat on most rows
+ESCAPE_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=ESCAPE_CACHE_SIZE)
+def escape_tag(value):
+    """Escapes a measurement, tag key or tag value."""
+    value = str(value).replace(
+        '\\', '\\\\'
+    ).replace(
+        ' ', '\\ '
+    ).replace(
+        ',', '\\,'
+    ).replace(
+        '=', '\\='
+    ).replace(
+        '\n', '\\n'
+    )
+    if value.endswith('\\'):
+        value += ' '
+    return value
+
+
+def format_tags(tags):
+    """Returns the sorted tag section for (key, escaped value) pairs.
+
+    Empty tag values are dropped, as line protocol does not allow them.
+    """
+    return ''.join(',{}={}'.format(key, value)
+                   for key, value in sorted(tags) if value)
+
+
+def encode_point(measurement, tag_str, value, timestamp):
+    """Returns a line for a single value point.
+
+    The measurement and tag string must already be escaped.
+    """
+    return '{}{} value={} {}'.format(measurement, tag_str,
+                                     repr(float(value)), timestamp)
+
+
+def encode_rollup(measurement, dimension, name, total, count, timestamp):
+    """Returns a line for a rollup point."""
+    return '{}{} count={}i,sum={} {}'.format(
+        measurement, format_tags([('dimension', dimension),
+                                  ('name', escape_tag(name))]),
+        count, repr(float(total)), timestamp)
+
+
+def linify(config, csvfile, index=None):
+    """Converts csv from mint into line protocol, one line per point.
+
+    If a TransactionIndex is given, rows it has already seen are dropped.
+    """
+    mint = reader.TransactionReader(csvfile, stream=True)
+    yield from iter_points(config, mint, LineEncoder(), index=index)
+
+
+class LineEncoder(object):
+    """Encodes the rows and aggregates of iter_points as lines."""
+
+    @staticmethod
+    def encode_row(entry, measurements):
+        """Returns a line per (measurement name, tag to drop) pair."""
+        tags = [
+            ('vendor', escape_tag(entry.description)),
+            ('category', escape_tag(entry.category)),
+            ('account', escape_tag(entry.account_name)),
+            ('raw_date', escape_tag(entry.date)),
+            ('label', escape_tag(entry.labels)),
+            ('notes', escape_tag(entry.notes)),
+        ]
+        value = entry.amount
+        timestamp = entry.time
+        return [
+            encode_point(escape_tag(name),
+                         format_tags(tag for tag in tags
+                                     if tag[0] != measurement),
+                         value, timestamp)
+            for name, measurement in measurements
+        ]
+
+    @staticmethod
+    def encode_net_sum(value, entry):
+        """Returns the net_sum line, stamped with the date of entry."""
+        return encode_point(CONF_NETSUM, '', value, entry.time)
+
+    @staticmethod
+    def encode_sum(measurement, start, value):
+        """Returns a sum line stamped with the period start."""
+        return encode_point(escape_tag(measurement), '', value,
+                            int(start.timestamp()))
+
+    @staticmethod
+    def encode_rollup(measurement, start, dimension, name, total, count):
+        """Returns a rollup line stamped with the period start."""
+        return encode_rollup(measurement, dimension, name, total, count,
+                             int(start.timestamp()))
@@ -0,0 +1,97 @@
+"""Module used to track which csv files have already been ingested."""
+import os
+import json
+import hashlib
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_hash(path):
+    """Returns the sha256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest(object):
+    """Persistent record of ingested csv files.
+
+    Each entry holds the size, mtime, content hash and point count of a
+    file at the time it was written to the database.  A file is current
+    when its size and mtime still match, or when it was only touched and
+    its contents hash the same.
+    """
+
+    def __init__(self, path):
+        """Initialize the manifest, loading it from path if it exists."""
+        self.path = path
+        self.files = dict()
+        try:
+            with open(self.path, 'r') as infile:
+                self.files = json.load(infile)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as err:
+            LOGGER.warning("Ignoring unreadable manifest %s: %s",
+                           self.path, err)
+
+    @staticmethod
+    def key(csvfile):
+        """Returns the manifest key for a file."""
+        return os.path.abspath(csvfile)
+
+    def is_current(self, csvfile):
+        """Checks if csvfile is unchanged since it was last ingested."""
+        entry = self.files.get(self.key(csvfile))
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(csvfile)
+        except OSError:
+            return False
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime_ns == entry['mtime_ns']:
+            return True
+        if file_hash(csvfile) != entry['sha256']:
+            return False
+        # Contents unchanged, remember the new mtime to skip hashing
+        entry['mtime_ns'] = stat.st_mtime_ns
+        return True
+
+    @staticmethod
+    def stamp(csvfile):
+        """Returns the size, mtime and hash of csvfile, or None."""
+        try:
+            stat = os.stat(csvfile)
+            return {
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha256': file_hash(csvfile)
+            }
+        except OSError as err:
+            LOGGER.warning("Could not stat %s: %s", csvfile, err)
+            return None
+
+    def record(self, csvfile, stamp, points=None):
+        """Records a stamp taken before csvfile was ingested."""
+        if stamp is None:
+            return
+        entry = dict(stamp)
+        entry['points'] = points
+        self.files[self.key(csvfile)] = entry
+
+    def save(self):
+        """Atomically writes the manifest to disk."""
+        tmp_path = '{}.tmp'.format(self.path)
+        try:
+            with open(tmp_path, 'w') as outfile:
+                json.dump(self.files, outfile, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError as err:
+            LOGGER.error("Could not save manifest %s: %s", self.path, err)
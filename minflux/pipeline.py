@@ -0,0 +1,69 @@
+"""Asyncio pipeline overlapping point generation with database writes."""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from minflux.util import chunks
+
+LOGGER = logging.getLogger(__name__)
+
+
+def write_pipelined(client, points, send, result, concurrency):
+    """Writes points in batches with up to concurrency requests in flight.
+
+    Batches are pulled from the points iterable on the event loop while
+    the blocking writes run in a thread pool, so building the next batch
+    overlaps with requests that are still in flight.  The queue between
+    the two holds at most two batches per writer.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            _pipeline(loop, client, points, send, result, concurrency))
+    finally:
+        loop.close()
+
+
+async def _pipeline(loop, client, points, send, result, concurrency):
+    """Runs the producer and the writer tasks until all batches are sent."""
+    queue = asyncio.Queue(maxsize=2 * concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        writers = [
+            loop.create_task(_writer(loop, queue, client, send,
+                                     result, executor))
+            for _ in range(concurrency)
+        ]
+        try:
+            for batch in chunks(points, client.batch_size):
+                await queue.put(batch)
+                # Let writers pick up the batch before building the next
+                await asyncio.sleep(0)
+            for _ in writers:
+                await queue.put(None)
+            await asyncio.gather(*writers)
+        except BaseException:
+            for writer in writers:
+                writer.cancel()
+            raise
+    return result
+
+
+async def _writer(loop, queue, client, send, result, executor):
+    """Takes batches off the queue and writes them in the executor."""
+    while True:
+        batch = await queue.get()
+        if batch is None:
+            return
+        result.batches += 1
+        LOGGER.debug("Writing batch of %d points", len(batch))
+        try:
+            success = await loop.run_in_executor(executor, client.write_batch,
+                                                 batch, send)
+        except Exception as err:  # pylint: disable=W0703
+            # A dead writer would leave the producer blocked on the queue
+            LOGGER.error("Could not write batch of %d points: %s",
+                         len(batch), err)
+            success = False
+        if success:
+            result.points += len(batch)
+        else:
+            result.failed += 1
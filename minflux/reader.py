@@ -1,29 +1,106 @@
 """Module used to read csv and report results."""
 import os
 import sys
-import pathlib
-import shutil
-import gzip
 import csv
+import gzip
 import logging
+from operator import itemgetter
+import minflux.util as util
+from minflux.stats import STATS, STAGE_PARSE, COUNT_ROWS
 from minflux.const import (ATTR_DATE, ATTR_DESC, ATTR_LABELS,
                            ATTR_NOTES, ATTR_ACCOUNT, ATTR_CATEGORY,
                            ATTR_TYPE, ATTR_AMOUNT)
 
 LOGGER = logging.getLogger(__name__)
 
+# Csv columns copied into each Transaction, in Transaction.from_fields order
+TRANSACTION_FIELDS = (ATTR_DATE, ATTR_DESC, ATTR_CATEGORY, ATTR_ACCOUNT,
+                      ATTR_LABELS, ATTR_NOTES, ATTR_TYPE, ATTR_AMOUNT)
+
+
+class Transaction(object):
+    """Compact record of a single transaction.
+
+    The amount is already signed by transaction type and time holds the
+    date as seconds since the epoch.  The remaining fields are the raw
+    csv strings.
+    """
+
+    __slots__ = ('date', 'description', 'category', 'account_name',
+                 'labels', 'notes', 'transaction_type', 'amount', 'time')
+
+    def __init__(self, date, description, category, account_name,
+                 labels, notes, transaction_type, amount, time):
+        """Initialize the transaction record."""
+        self.date = date
+        self.description = description
+        self.category = category
+        self.account_name = account_name
+        self.labels = labels
+        self.notes = notes
+        self.transaction_type = transaction_type
+        self.amount = amount
+        self.time = time
+
+    @classmethod
+    def from_fields(cls, fields):
+        """Creates a transaction from raw strings of TRANSACTION_FIELDS."""
+        (date, description, category, account_name,
+         labels, notes, transaction_type, amount) = fields
+        return cls(date, description, category, account_name, labels, notes,
+                   transaction_type,
+                   util.convert_value(amount, transaction_type),
+                   util.date_to_epoch(date))
+
+    def __repr__(self):
+        """Return representation of the transaction."""
+        return 'Transaction({})'.format(', '.join(
+            '{}={!r}'.format(attr, getattr(self, attr))
+            for attr in self.__slots__))
+
+
+def open_csv(csvfile):
+    """Opens a csv file for reading, decompressing archived .gz files."""
+    if csvfile.endswith('.gz'):
+        return gzip.open(csvfile, 'rt', newline='')
+    return open(csvfile, newline='')
+
+
+def field_getter(headers):
+    """Returns a function picking the TRANSACTION_FIELDS out of a row.
+
+    The header indices are resolved once; columns missing from the csv
+    are returned as empty strings.
+    """
+    indices = [headers.get(field) for field in TRANSACTION_FIELDS]
+    if None not in indices:
+        return itemgetter(*indices)
+    LOGGER.warning("Missing columns in csv: %s",
+                   [field for field, index in zip(TRANSACTION_FIELDS, indices)
+                    if index is None])
+
+    def getter(row):
+        """Picks fields, using empty strings for missing columns."""
+        return tuple(row[index] if index is not None else ''
+                     for index in indices)
+    return getter
+
 
 class TransactionReader(object):
     """Class to parse transactions."""
 
-    def __init__(self, csvfile, archive=False, archive_dir=None):
+    def __init__(self, csvfile, stream=False):
         """Initialize class."""
         self._csvfile = csvfile
         self._data = None
+        self._stream = stream
         if not os.path.isfile(self._csvfile):
             LOGGER.error("Invalid file %s", self._csvfile)
             sys.exit(1)
-        self.read_csv()
+        if stream:
+            self.read_header()
+        else:
+            self.read_csv()
         self._headers = {
             ATTR_DATE: None,
             ATTR_DESC: None,
@@ -35,8 +112,6 @@ class TransactionReader(object):
             ATTR_TYPE: None
         }
         self.get_headers()
-        if archive:
-            self.archive(archive_dir)
 
     @property
     def headers(self):
@@ -45,18 +120,50 @@ class TransactionReader(object):
 
     @property
     def data(self):
-        """Returns data read in from csv file."""
+        """Returns data read in from csv file.
+
+        In stream mode this is a generator yielding one row at a time.
+        """
+        if self._stream:
+            return self.iter_rows()
         return self._data
 
+    @property
+    def transactions(self):
+        """Yields a Transaction record for each data row."""
+        return STATS.timed_iter(STAGE_PARSE, self.iter_transactions(),
+                                counter=COUNT_ROWS)
+
+    def iter_transactions(self):
+        """Converts data rows into Transaction records."""
+        getter = field_getter(self._headers)
+        from_fields = Transaction.from_fields
+        for row in self.data:
+            yield from_fields(getter(row))
+
     def read_csv(self):
         """Reads the csv file."""
         data = list()
-        with open(self._csvfile, newline='') as txfile:
+        with open_csv(self._csvfile) as txfile:
             txreader = csv.reader(txfile, delimiter=',', quotechar='"')
             for row in txreader:
                 data.append(row)
         self._data = data
 
+    def read_header(self):
+        """Reads only the header line of the csv file."""
+        with open_csv(self._csvfile) as txfile:
+            txreader = csv.reader(txfile, delimiter=',', quotechar='"')
+            self._data = [next(txreader, [])]
+
+    def iter_rows(self):
+        """Lazily yields data rows, skipping the header line."""
+        with open_csv(self._csvfile) as txfile:
+            txreader = csv.reader(txfile, delimiter=',', quotechar='"')
+            next(txreader, None)
+            for row in txreader:
+                yield row
+
     def get_headers(self):
         """Retrieve header data from csv input."""
         header_line = self._data[0]
@@ -69,42 +176,3 @@ class TransactionReader(object):
         LOGGER.debug("Headers: %s", self._headers)
         # Get rid of header line from data
         self._data.pop(0)
-
-    def archive(self, archive_dir):
-        """Used to send csv file to archive."""
-        current_path = pathlib.Path(self._csvfile)
-        if not archive_dir:
-            archive_dir = '{}/archive'.format(current_path.parent)
-        # Creates directory if it does not exist
-        pathlib.Path(archive_dir).mkdir(parents=True, exist_ok=True)
-        file_name_only = current_path.name
-        check_file = '{}/{}.gz'.format(archive_dir, file_name_only)
-
-        # Make sure there are no name collisions with archive
-        if os.path.exists(check_file):
-            file_name_no_ext = current_path.stem
-            count = 1
-            check_file = '{}/{}_{}.csv.gz'.format(archive_dir,
-                                                  file_name_no_ext,
-                                                  count)
-            while os.path.exists(check_file):
-                count += 1
-                check_file = '{}/{}_{}.csv.gz'.format(archive_dir,
-                                                      file_name_no_ext,
-                                                      count)
-                if count > 256:
-                    LOGGER.error("Too many name collisions during "
-                                 "archive of %s.  Consider using files "
-                                 "with unique names instead.",
-                                 file_name_no_ext)
-                    sys.exit(1)
-        LOGGER.info("Compressing with gzip to %s", check_file)
-        with gzip.GzipFile(check_file, 'wb') as gzipfile:
-            with open(self._csvfile, 'rb') as input_file:
-                shutil.copyfileobj(input_file, gzipfile)
-
-        if os.path.exists(check_file):
-            os.remove(self._csvfile)
-        else:
-            LOGGER.error("Compressed file not found, skipping deletion of "
-                         "%s. Archiving not performed!", self._csvfile)
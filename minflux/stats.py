@@ -0,0 +1,161 @@
+"""Module used to time the stages of a run and count what went through."""
+import os
+import time
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger(__name__)
+
+STAGE_PARSE = 'parse'
+STAGE_BUILD = 'build'
+STAGE_SUM = 'sum'
+STAGE_ARCHIVE = 'archive'
+STAGE_WRITE = 'write'
+
+COUNT_ROWS = 'rows'
+COUNT_POINTS = 'points'
+COUNT_BYTES = 'bytes'
+COUNT_BATCHES = 'batches'
+
+
+class Stats(object):
+    """Stage timers, counters and per file times of a run.
+
+    Timers are inclusive: the build stage pulls rows from the parse
+    stage, so its time contains the parse time.  Updates are locked as
+    the async engine writes from several threads.
+    """
+
+    def __init__(self):
+        """Initialize empty stats."""
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forgets everything recorded so far."""
+        with self.lock:
+            self.timers = defaultdict(float)
+            self.counters = defaultdict(int)
+            self.files = list()
+            self.started = time.perf_counter()
+
+    def add_time(self, stage, seconds):
+        """Adds seconds spent in stage."""
+        with self.lock:
+            self.timers[stage] += seconds
+
+    def count(self, name, amount=1):
+        """Increments a counter."""
+        with self.lock:
+            self.counters[name] += amount
+
+    @contextmanager
+    def timer(self, stage):
+        """Times the enclosed block as stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def timed_iter(self, stage, iterable, counter=None):
+        """Yields from iterable, timing the work done to produce each item.
+
+        Time spent by the consumer between items is not counted.  With a
+        counter name, the number of items is added to that counter.
+        """
+        elapsed = 0.0
+        items = 0
+        clock = time.perf_counter
+        iterator = iter(iterable)
+        try:
+            while True:
+                start = clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    elapsed += clock() - start
+                    return
+                elapsed += clock() - start
+                items += 1
+                yield item
+        finally:
+            self.add_time(stage, elapsed)
+            if counter is not None:
+                self.count(counter, items)
+
+    def record_file(self, path, seconds, points=None):
+        """Records the time taken by a single file."""
+        with self.lock:
+            self.files.append((path, seconds, points))
+
+    def snapshot(self):
+        """Returns timers and counters as plain data for another process."""
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'timers': dict(self.timers),
+                'counters': dict(self.counters)
+            }
+
+    def since(self, before):
+        """Returns a snapshot of what was recorded after before."""
+        after = self.snapshot()
+        for kind in ('timers', 'counters'):
+            for name, amount in before[kind].items():
+                after[kind][name] -= amount
+        return after
+
+    def merge(self, snapshot):
+        """Adds a snapshot taken in a worker process.
+
+        Snapshots of this process are ignored since they are already
+        counted.
+        """
+        if snapshot is None or snapshot['pid'] == os.getpid():
+            return
+        with self.lock:
+            for stage, seconds in snapshot['timers'].items():
+                self.timers[stage] += seconds
+            for name, amount in snapshot['counters'].items():
+                self.counters[name] += amount
+
+    def report(self, logger=LOGGER, caches=None):
+        """Logs a summary of the run.
+
+        caches maps names to the cache_info() of lru caches worth
+        reporting.
+        """
+        elapsed = time.perf_counter() - self.started
+        rows = self.counters[COUNT_ROWS]
+        points = self.counters[COUNT_POINTS]
+        sent = '{} batches'.format(self.counters[COUNT_BATCHES])
+        # Json points are encoded by the influxdb client, so bytes are
+        # only known for line protocol posts
+        if COUNT_BYTES in self.counters:
+            sent = '{} bytes in {}'.format(self.counters[COUNT_BYTES], sent)
+        logger.info("Run took %.2fs: %d rows (%s rows/s), %d points "
+                    "(%s points/s), %s",
+                    elapsed, rows, rate(rows, elapsed), points,
+                    rate(points, elapsed), sent)
+        for stage in sorted(self.timers):
+            logger.info("  %-8s %8.3fs", stage, self.timers[stage])
+        for path, seconds, file_points in self.files:
+            logger.info("  %s: %.3fs, %s points", path, seconds,
+                        '-' if file_points is None else file_points)
+        for name, info in (caches or dict()).items():
+            if info.hits + info.misses:
+                logger.info("  %s cache: %d hits, %d misses",
+                            name, info.hits, info.misses)
+
+
+def rate(amount, seconds):
+    """Returns amount per second as a rounded string."""
+    if seconds <= 0:
+        return '-'
+    return '{:.0f}'.format(amount / seconds)
+
+
+STATS = Stats()
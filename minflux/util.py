@@ -1,26 +1,91 @@
 """Various helper functions for minflux."""
 import os
 import logging
+import datetime
+from itertools import islice
+from functools import lru_cache
 from typing import Any, Union, TypeVar, Sequence
-from dateutil import parser, tz
-import coloredlogs
-import voluptuous as vol
+from minflux.const import PERIOD_WEEK, PERIOD_MONTH
 
 # typing typevar
 T = TypeVar('T')
 
 LOGGER = logging.getLogger(__name__)
 
+DATE_CACHE_SIZE = 8192
+
+UTC = datetime.timezone.utc
+
 
 def date_to_iso(date, month_only=False):
     """Converts timestamp to RFC3339 format."""
+    return _date_to_iso(date, month_only)
+
+
+def date_to_epoch(date, month_only=False):
+    """Converts timestamp to integer seconds since the epoch."""
+    return _date_to_epoch(date, month_only)
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _date_to_iso(date, month_only):
+    """Cached conversion keyed by the raw date string."""
+    return _parse_raw_date(date, month_only).isoformat()
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _date_to_epoch(date, month_only):
+    """Cached conversion keyed by the raw date string."""
+    return int(_parse_raw_date(date, month_only).timestamp())
+
+
+def date_cache_info():
+    """Returns the hit statistics of each date cache by name."""
+    return {
+        'date_to_iso': _date_to_iso.cache_info(),
+        'date_to_epoch': _date_to_epoch.cache_info(),
+        'period_start': period_start.cache_info()
+    }
+
+
+def _parse_raw_date(date, month_only):
+    """Parses a raw date, optionally moved to the first of its month."""
     if month_only:
         new_date = date.split('/')
         new_date[1] = '1'
         date = '/'.join(new_date)
+    return parse_date(date)
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def period_start(date, period):
+    """Returns the UTC datetime starting the day, week or month of date.
+
+    Weeks start on Monday.
+    """
+    dtobj = parse_date(date).replace(hour=0, minute=0, second=0,
+                                     microsecond=0)
+    if period == PERIOD_MONTH:
+        return dtobj.replace(day=1)
+    if period == PERIOD_WEEK:
+        return dtobj - datetime.timedelta(days=dtobj.weekday())
+    return dtobj
+
+
+def parse_date(date):
+    """Parses a date, using a fast path for mint's M/D/YYYY format."""
+    parts = date.split('/')
+    if len(parts) == 3 and all(part.isdigit() for part in parts):
+        month, day, year = parts
+        if len(year) == 4 and len(month) <= 2 and len(day) <= 2:
+            try:
+                return datetime.datetime(int(year), int(month), int(day),
+                                         tzinfo=UTC)
+            except ValueError:
+                pass
+    from dateutil import parser
     dtobj = parser.parse(date)
-    dtobj = dtobj.replace(tzinfo=tz.tzutc())
-    return dtobj.isoformat()
+    return dtobj.replace(tzinfo=UTC)
 
 
 def convert_value(value, txtype):
@@ -30,6 +95,15 @@ def convert_value(value, txtype):
     return round(txtype_map[txtype] * float(value), 2)
 
 
+def chunks(iterable, size):
+    """Yields successive lists of at most size items from iterable."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
 def set_loggers(logger, file=None, level='info'):
     """Sets up loggers."""
     root = logging.getLogger()
@@ -54,6 +128,7 @@ def set_loggers(logger, file=None, level='info'):
         handler.setFormatter(logging.Formatter(formatter))
         root.addHandler(handler)
 
+    import coloredlogs
     coloredlogs.install(level=level.upper())
 
 
@@ -61,6 +136,7 @@ def string(value: Any) -> str:
     """Force value to string if not None."""
     if value is not None:
         return str(value)
+    import voluptuous as vol
     raise vol.Invalid("string value is None")
 
 
@@ -72,6 +148,7 @@ def boolean(value: Any) -> bool:
             return True
         if value in ('0', 'false', 'no', 'off', 'disable'):
             return False
+        import voluptuous as vol
         raise vol.Invalid("invalid boolean value {}".format(value))
     return bool(value)
 
@@ -0,0 +1,205 @@
+"""Module used to watch the csv directory for new files.
+
+inotify is used through ctypes where the platform has it, otherwise the
+directory is polled.  Either way a file is only handed on once it has
+stopped changing, so half written downloads are not ingested.
+"""
+import os
+import time
+import select
+import struct
+import logging
+from minflux.const import DEFAULT_SETTLE
+
+LOGGER = logging.getLogger(__name__)
+
+CSV_SUFFIX = '.csv'
+
+# Seconds between scans when polling
+POLL_INTERVAL = 1.0
+
+# inotify flags, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+EVENT_HEADER = struct.Struct('iIII')
+EVENT_BUFFER_SIZE = 1 << 16
+
+
+def is_csv(name):
+    """Checks if a file name is a csv file."""
+    return name.endswith(CSV_SUFFIX)
+
+
+def list_csv(directory):
+    """Returns the csv files in directory."""
+    try:
+        return sorted(entry.path for entry in os.scandir(directory)
+                      if entry.is_file() and is_csv(entry.name))
+    except OSError as err:
+        LOGGER.warning("Could not list %s: %s", directory, err)
+        return list()
+
+
+class Inotify(object):
+    """Reports csv files written or moved into a directory."""
+
+    def __init__(self, directory):
+        """Start watching directory, raising OSError if inotify fails."""
+        import ctypes
+        import ctypes.util
+        self.directory = directory
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        try:
+            init = libc.inotify_init1
+            add_watch = libc.inotify_add_watch
+        except AttributeError:
+            raise OSError("inotify is not available")
+        self.fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if add_watch(self.fd, os.fsencode(directory), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "Could not watch {}".format(directory))
+
+    def changes(self, timeout):
+        """Waits up to timeout seconds, returning the csv files touched."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return list()
+        try:
+            data = os.read(self.fd, EVENT_BUFFER_SIZE)
+        except BlockingIOError:
+            return list()
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped, look at everything again
+                changed.update(list_csv(self.directory))
+            elif is_csv(name):
+                changed.add(os.path.join(self.directory, name))
+        return sorted(changed)
+
+    def close(self):
+        """Stops watching."""
+        os.close(self.fd)
+
+
+class Poller(object):
+    """Reports csv files that appeared or changed since the last scan."""
+
+    def __init__(self, directory, interval=POLL_INTERVAL):
+        """Start polling directory, every interval seconds."""
+        self.directory = directory
+        self.interval = interval
+        self.seen = self.scan()
+
+    def scan(self):
+        """Returns the size and mtime of every csv file."""
+        stamps = dict()
+        for path in list_csv(self.directory):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stamps[path] = (stat.st_size, stat.st_mtime_ns)
+        return stamps
+
+    def changes(self, timeout):
+        """Waits up to timeout seconds, returning the new or changed files."""
+        time.sleep(min(timeout, self.interval))
+        stamps = self.scan()
+        changed = [path for path, stamp in stamps.items()
+                   if self.seen.get(path) != stamp]
+        self.seen = stamps
+        return sorted(changed)
+
+    def close(self):
+        """Stops polling."""
+        pass
+
+
+def create_watcher(directory, interval=POLL_INTERVAL):
+    """Returns an Inotify watcher if possible, otherwise a Poller."""
+    try:
+        watcher = Inotify(directory)
+    except OSError as err:
+        LOGGER.info("Polling %s every %.1fs (%s)", directory, interval, err)
+        return Poller(directory, interval)
+    LOGGER.info("Watching %s with inotify", directory)
+    return watcher
+
+
+class Debouncer(object):
+    """Holds files back until they stop changing.
+
+    A file is ready when its size and mtime are the same on two looks in
+    a row and it was last modified at least settle seconds ago.
+    """
+
+    def __init__(self, settle=DEFAULT_SETTLE, clock=time.time):
+        """Initialize the debouncer."""
+        self.settle = settle
+        self.clock = clock
+        self.pending = dict()
+
+    def add(self, paths):
+        """Starts tracking paths."""
+        for path in paths:
+            self.pending.setdefault(path, None)
+
+    def ready(self):
+        """Returns the files that have settled and stops tracking them."""
+        now = self.clock()
+        ready = list()
+        for path, last in list(self.pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Moved away or deleted before it settled
+                del self.pending[path]
+                continue
+            stamp = (stat.st_size, stat.st_mtime_ns)
+            if stamp == last and now - stat.st_mtime >= self.settle:
+                ready.append(path)
+                del self.pending[path]
+            else:
+                self.pending[path] = stamp
+        return sorted(ready)
+
+
+def watch(directory, handle, settle=DEFAULT_SETTLE, interval=POLL_INTERVAL,
+          stop=None, watcher=None):
+    """Calls handle with lists of settled csv files until stop is set.
+
+    Files already in directory are handed on first.  stop is a
+    threading.Event; without one, watch runs until interrupted.
+    """
+    if watcher is None:
+        watcher = create_watcher(directory, interval)
+    debouncer = Debouncer(settle)
+    debouncer.add(list_csv(directory))
+    # Settled files are noticed within a fraction of the settle time
+    tick = max(0.05, min(interval, settle / 4))
+    try:
+        while stop is None or not stop.is_set():
+            debouncer.add(watcher.changes(tick if debouncer.pending
+                                          else interval))
+            ready = debouncer.ready()
+            if ready:
+                handle(ready)
+    finally:
+        watcher.close()
@@ -2,67 +2,213 @@
 
 import os
 import sys
+import json
 import logging
-import yaml
-import voluptuous as vol
+import tempfile
+from functools import lru_cache
 from minflux.util import string, ensure_list
 from minflux.const import (CONF_HOST, CONF_PORT, CONF_USER,
                            CONF_PASSWORD, CONF_DBNAME, CONF_FILE,
                            CONF_LOGGER, CONF_LEVEL, CONF_INFLUX,
                            CONF_MINT, CONF_NETSUM, CONF_EXCLUDE,
                            CONF_VENDOR, CONF_CATEGORY, CONF_ACCOUNT,
-                           CONF_DIR, CONF_ARCHIVE, CONF_SUM)
+                           CONF_DIR, CONF_ARCHIVE, CONF_SUM,
+                           CONF_BATCH_SIZE, CONF_RETRIES, CONF_RETRY_DELAY,
+                           CONF_PROTOCOL, PROTOCOL_JSON, PROTOCOL_LINE,
+                           CONF_ENGINE, ENGINE_SYNC, ENGINE_ASYNC,
+                           CONF_CONCURRENCY, CONF_MANIFEST, CONF_DEDUP,
+                           CONF_PERIODS, PERIOD_DAY, PERIOD_WEEK,
+                           PERIOD_MONTH, CONF_CHUNK_ROWS, CONF_MEMORY_BUDGET,
+                           CONF_LAYOUT, LAYOUT_TRIPLE, LAYOUT_SINGLE,
+                           CONF_ROLLUP)
+from minflux.const import __version__, CONFIG_CACHE
+from minflux.const import (DEFAULT_BATCH_SIZE, DEFAULT_RETRIES,
+                           DEFAULT_RETRY_DELAY, DEFAULT_PROTOCOL,
+                           DEFAULT_ENGINE, DEFAULT_CONCURRENCY,
+                           DEFAULT_ARCHIVE_LEVEL, DEFAULT_LAYOUT)
 
 LOGGER = logging.getLogger(__name__)
 
-SCHEMA = vol.Schema({
-    vol.Required(CONF_INFLUX): vol.Schema({
-        vol.Required(CONF_HOST): string,
-        vol.Required(CONF_PORT): string,
-        vol.Required(CONF_USER): string,
-        vol.Required(CONF_PASSWORD): string,
-        vol.Required(CONF_DBNAME): string
-    }),
-    vol.Required(CONF_MINT): vol.Schema({
-        vol.Optional(CONF_FILE): string,
-        vol.Optional(CONF_DIR): string,
-        vol.Optional(CONF_ARCHIVE): vol.Any(
-            vol.Schema({vol.Optional(CONF_DIR): string}), None
-        ),
-        vol.Optional(CONF_SUM): None
-    }),
-    vol.Optional(CONF_LOGGER, default={CONF_FILE: '', CONF_LEVEL: 'INFO'}):
-        vol.Schema({
-            vol.Optional(CONF_FILE, default=''): string,
-            vol.Optional(CONF_LEVEL, default=logging.INFO): string
+
+@lru_cache(maxsize=None)
+def get_schema():
+    """Returns the config schema, importing voluptuous on first use."""
+    import voluptuous as vol
+    return vol.Schema({
+        vol.Required(CONF_INFLUX): vol.Schema({
+            vol.Required(CONF_HOST): string,
+            vol.Required(CONF_PORT): string,
+            vol.Required(CONF_USER): string,
+            vol.Required(CONF_PASSWORD): string,
+            vol.Required(CONF_DBNAME): string,
+            vol.Optional(CONF_BATCH_SIZE, default=DEFAULT_BATCH_SIZE):
+                vol.All(vol.Coerce(int), vol.Range(min=1)),
+            vol.Optional(CONF_RETRIES, default=DEFAULT_RETRIES):
+                vol.All(vol.Coerce(int), vol.Range(min=0)),
+            vol.Optional(CONF_RETRY_DELAY, default=DEFAULT_RETRY_DELAY):
+                vol.All(vol.Coerce(float), vol.Range(min=0)),
+            vol.Optional(CONF_PROTOCOL, default=DEFAULT_PROTOCOL):
+                vol.In([PROTOCOL_JSON, PROTOCOL_LINE]),
+            vol.Optional(CONF_ENGINE, default=DEFAULT_ENGINE):
+                vol.In([ENGINE_SYNC, ENGINE_ASYNC]),
+            vol.Optional(CONF_CONCURRENCY, default=DEFAULT_CONCURRENCY):
+                vol.All(vol.Coerce(int), vol.Range(min=1))
         }),
-    vol.Optional(CONF_NETSUM): vol.Any(
-        vol.Schema({
-            vol.Optional(CONF_EXCLUDE, default={}):
+        vol.Required(CONF_MINT): vol.Schema({
+            vol.Optional(CONF_FILE): string,
+            vol.Optional(CONF_DIR): string,
+            vol.Optional(CONF_ARCHIVE): vol.Any(
                 vol.Schema({
-                    vol.Optional(CONF_VENDOR, default=[]): ensure_list,
-                    vol.Optional(CONF_CATEGORY, default=[]): ensure_list,
-                    vol.Optional(CONF_ACCOUNT, default=[]): ensure_list
-                })
-        }), None)
-})
+                    vol.Optional(CONF_DIR): string,
+                    vol.Optional(CONF_LEVEL, default=DEFAULT_ARCHIVE_LEVEL):
+                        vol.All(vol.Coerce(int), vol.Range(min=0, max=9))
+                }), None
+            ),
+            vol.Optional(CONF_SUM): vol.Any(None, vol.Schema({
+                vol.Optional(CONF_PERIODS, default=[PERIOD_MONTH]): vol.All(
+                    ensure_list,
+                    [vol.In([PERIOD_DAY, PERIOD_WEEK, PERIOD_MONTH])]
+                )
+            })),
+            vol.Optional(CONF_ROLLUP): vol.Any(None, vol.Schema({
+                vol.Optional(CONF_PERIODS, default=[
+                    PERIOD_DAY, PERIOD_WEEK, PERIOD_MONTH
+                ]): vol.All(
+                    ensure_list,
+                    [vol.In([PERIOD_DAY, PERIOD_WEEK, PERIOD_MONTH])]
+                )
+            })),
+            vol.Optional(CONF_MANIFEST): string,
+            vol.Optional(CONF_DEDUP): string,
+            vol.Optional(CONF_CHUNK_ROWS):
+                vol.All(vol.Coerce(int), vol.Range(min=1)),
+            vol.Optional(CONF_MEMORY_BUDGET):
+                vol.All(vol.Coerce(int), vol.Range(min=1)),
+            vol.Optional(CONF_LAYOUT, default=DEFAULT_LAYOUT):
+                vol.In([LAYOUT_TRIPLE, LAYOUT_SINGLE])
+        }),
+        vol.Optional(CONF_LOGGER, default={CONF_FILE: '', CONF_LEVEL: 'INFO'}):
+            vol.Schema({
+                vol.Optional(CONF_FILE, default=''): string,
+                vol.Optional(CONF_LEVEL, default=logging.INFO): string
+            }),
+        vol.Optional(CONF_NETSUM): vol.Any(
+            vol.Schema({
+                vol.Optional(CONF_EXCLUDE, default={}):
+                    vol.Schema({
+                        vol.Optional(CONF_VENDOR, default=[]): ensure_list,
+                        vol.Optional(CONF_CATEGORY, default=[]): ensure_list,
+                        vol.Optional(CONF_ACCOUNT, default=[]): ensure_list
+                    })
+            }), None)
+    })
+
+
+class LazySchema(object):
+    """Module level SCHEMA, building the real schema on first use."""
+
+    def __call__(self, data):
+        """Validates data against the config schema."""
+        return get_schema()(data)
+
+    def __getattr__(self, name):
+        """Passes attribute lookups on to the config schema."""
+        return getattr(get_schema(), name)
 
 
-def load_yaml(directory):
-    """Reads yaml file and returns result."""
+SCHEMA = LazySchema()
+
+
+def load_yaml(directory, cache=False):
+    """Reads yaml file and returns the validated config.
+
+    With cache set, the validated config is stored next to the yaml file
+    and reused until the yaml file changes.
+    """
     config_file = '{}/config.yaml'.format(directory)
     if not os.path.isfile(config_file):
-        LOGGER.error("% is not a valid file", config_file)
+        LOGGER.error("%s is not a valid file", config_file)
         sys.exit(1)
+    cache_file = '{}/{}'.format(directory, CONFIG_CACHE)
+    stamp = None
+    if cache:
+        stamp = config_stamp(config_file)
+        config = read_cache(cache_file, stamp)
+        if config is not None:
+            LOGGER.debug("Using cached config %s", cache_file)
+            return config
+    config = validate(read_yaml(config_file))
+    LOGGER.debug(config)
+    if cache:
+        write_cache(cache_file, stamp, config)
+    return config
+
+
+def read_yaml(config_file):
+    """Parses the yaml file, with the LibYAML loader if available."""
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
     with open(config_file, 'r') as yamlfile:
-        cfg = yaml.load(yamlfile)
+        return yaml.load(yamlfile, Loader=loader)
+
+
+def validate(cfg):
+    """Validates a parsed config, exiting if it is invalid."""
+    import voluptuous as vol
     try:
-        LOGGER.debug(SCHEMA(cfg))
-        mint_props = [CONF_FILE, CONF_DIR]
-        if any(x in mint_props for x in cfg[CONF_MINT]):
-            return SCHEMA(cfg)
-        else:
-            raise vol.error.MultipleInvalid("Missing entry for mint")
-    except vol.error.MultipleInvalid as err:
+        config = get_schema()(cfg)
+    except vol.Invalid as err:
         LOGGER.error("Invalid configuration. %s", err)
         sys.exit(1)
+    if not any(x in [CONF_FILE, CONF_DIR] for x in config[CONF_MINT]):
+        LOGGER.error("Invalid configuration. Missing entry for mint")
+        sys.exit(1)
+    return config
+
+
+def config_stamp(config_file):
+    """Returns what identifies a version of the yaml file."""
+    stat = os.stat(config_file)
+    return {
+        'path': os.path.abspath(config_file),
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'version': __version__
+    }
+
+
+def read_cache(cache_file, stamp):
+    """Returns the cached config if it matches stamp, otherwise None."""
+    try:
+        with open(cache_file, 'r') as infile:
+            cached = json.load(infile)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as err:
+        LOGGER.warning("Ignoring unreadable config cache %s: %s",
+                       cache_file, err)
+        return None
+    if not isinstance(cached, dict) or cached.get('stamp') != stamp:
+        return None
+    return cached.get('config')
+
+
+def write_cache(cache_file, stamp, config):
+    """Atomically stores the validated config.
+
+    The cache holds the database password, so like mkstemp files it is
+    only readable by its owner.
+    """
+    tmp_path = None
+    try:
+        handle, tmp_path = tempfile.mkstemp(
+            prefix='{}.'.format(os.path.basename(cache_file)),
+            dir=os.path.dirname(os.path.abspath(cache_file)))
+        with os.fdopen(handle, 'w') as outfile:
+            json.dump({'stamp': stamp, 'config': config}, outfile)
+        os.replace(tmp_path, cache_file)
+    except (OSError, TypeError, ValueError) as err:
+        LOGGER.warning("Could not write config cache %s: %s",
+                       cache_file, err)
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
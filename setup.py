@@ -24,6 +24,7 @@ setup(
     packages=PACKAGES,
     include_package_data=True,
     platforms='any',
+    python_requires='>=3.5',
     install_requires=REQUIRES,
     entry_points={
         'console_scripts': [
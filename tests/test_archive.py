@@ -0,0 +1,107 @@
+"""Tests archiving of written csv files."""
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from minflux import archive as archive
+
+CSV = b'"Date","Amount"\n"1/1/2017","1.00"\n'
+
+
+class TestArchive(unittest.TestCase):
+    """Test the archive functions and the Archiver class."""
+
+    def setUp(self):
+        """Creates a csv file."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.csvfile = os.path.join(self.tmpdir, 'foo.csv')
+        self.write_csv()
+
+    def tearDown(self):
+        """Removes the temporary files."""
+        shutil.rmtree(self.tmpdir)
+
+    def write_csv(self):
+        """Writes the csv file."""
+        with open(self.csvfile, 'wb') as outfile:
+            outfile.write(CSV)
+
+    def read(self, path):
+        """Returns the decompressed contents of an archive."""
+        with gzip.open(path, 'rb') as infile:
+            return infile.read()
+
+    def test_default_dir(self):
+        """Tests files go to an archive directory next to the csv."""
+        path = archive.archive_file(self.csvfile)
+        self.assertEqual(path, os.path.join(self.tmpdir, 'archive',
+                                            'foo.csv.gz'))
+        self.assertEqual(self.read(path), CSV)
+        self.assertFalse(os.path.exists(self.csvfile))
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['foo.csv.gz'])
+
+    def test_custom_dir_and_level(self):
+        """Tests the archive directory and compression level are used."""
+        arch_dir = os.path.join(self.tmpdir, 'old')
+        path = archive.archive_file(self.csvfile, arch_dir, level=1)
+        self.assertEqual(path, os.path.join(arch_dir, 'foo.csv.gz'))
+        self.assertEqual(self.read(path), CSV)
+
+    def test_collision(self):
+        """Tests taken names get a unique suffix."""
+        first = archive.archive_file(self.csvfile)
+        self.write_csv()
+        second = archive.archive_file(self.csvfile)
+        self.assertNotEqual(first, second)
+        self.assertTrue(os.path.basename(second).startswith('foo_'))
+        self.assertTrue(second.endswith('.csv.gz'))
+        self.assertEqual(self.read(first), CSV)
+        self.assertEqual(self.read(second), CSV)
+
+    @mock.patch('minflux.archive.shutil.copyfileobj')
+    def test_failure_keeps_csv(self, mock_copy):
+        """Tests a failed archive leaves the csv and no partial file."""
+        mock_copy.side_effect = OSError('disk full')
+        with self.assertRaises(OSError):
+            archive.archive_file(self.csvfile)
+        self.assertTrue(os.path.exists(self.csvfile))
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir, 'archive')),
+                         [])
+
+    def test_archiver(self):
+        """Tests the archiver compresses queued files in the background."""
+        archiver = archive.Archiver()
+        archiver.submit(self.csvfile)
+        archiver.submit(os.path.join(self.tmpdir, 'missing.csv'))
+        self.assertFalse(archiver.close())
+        self.assertFalse(os.path.exists(self.csvfile))
+        self.assertTrue(os.path.exists(os.path.join(
+            self.tmpdir, 'archive', 'foo.csv.gz')))
+
+    def test_archived_files(self):
+        """Tests archived files are found in the configured directory."""
+        archive.archive_file(self.csvfile)
+        config = {'mint': {'directory': self.tmpdir}}
+        found = [os.path.join(self.tmpdir, 'archive', 'foo.csv.gz')]
+        self.assertEqual(archive.archived_files(config), found)
+        config = {'mint': {'file': self.csvfile, 'archive': None}}
+        self.assertEqual(archive.archived_files(config), found)
+        config = {'mint': {'directory': self.tmpdir,
+                           'archive': {'directory': '/nonexistent'}}}
+        self.assertEqual(archive.archived_files(config), [])
+
+    def test_create_archiver(self):
+        """Tests an archiver is only created when configured."""
+        self.assertIsNone(archive.create_archiver({'mint': {}}))
+        archiver = archive.create_archiver({'mint': {'archive': None}})
+        self.assertIsNone(archiver.archive_dir)
+        self.assertEqual(archiver.level, 6)
+        archiver.close()
+        archiver = archive.create_archiver({
+            'mint': {'archive': {'directory': '/tmp', 'level': 9}}
+        })
+        self.assertEqual(archiver.archive_dir, '/tmp')
+        self.assertEqual(archiver.level, 9)
+        archiver.close()
@@ -1,8 +1,14 @@
 """Tests dbwrite functionality."""
+import os
+import shutil
+import tempfile
 import unittest
 from unittest import mock
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
 from minflux import dbwrite as dbwrite
 
+POINT = {'measurement': 'foo', 'time': 0, 'fields': {'value': 1.0}}
+
 
 class TestInfluxClient(unittest.TestCase):
     """Tests InfluxClient class."""
@@ -32,13 +38,84 @@ class TestInfluxClient(unittest.TestCase):
         self.assertEqual(client.user, self.config['influxdb']['user'])
         self.assertEqual(client.password, self.config['influxdb']['password'])
 
-    @mock.patch('minflux.dbwrite.InfluxDBClient.write_points')
+    @mock.patch('influxdb.InfluxDBClient.write_points')
     def test_write_data(self, mock_influx):
         """Tests the write_data call inside InfluxClient."""
         mock_influx.return_value = None
         client = dbwrite.InfluxClient(self.config)
-        client.write_data('')
+        result = client.write_data([POINT])
+        self.assertEqual(mock_influx.call_count, 1)
+        self.assertTrue(result)
+        self.assertEqual(result.points, 1)
+
+    @mock.patch('influxdb.InfluxDBClient.write_points')
+    def test_write_data_batches(self, mock_influx):
+        """Tests data is split into batch_size requests."""
+        self.config['influxdb']['batch_size'] = 2
+        client = dbwrite.InfluxClient(self.config)
+        result = client.write_data([POINT] * 5)
+        self.assertEqual(mock_influx.call_count, 3)
+        self.assertEqual(result.batches, 3)
+        self.assertEqual(result.points, 5)
+        self.assertEqual(result.failed, 0)
+
+    @mock.patch('minflux.dbwrite.time.sleep')
+    @mock.patch('influxdb.InfluxDBClient.write_points')
+    def test_write_data_retry(self, mock_influx, mock_sleep):
+        """Tests transient errors are retried with backoff."""
+        mock_influx.side_effect = [InfluxDBServerError('down'),
+                                   ConnectionError('reset'),
+                                   None]
+        client = dbwrite.InfluxClient(self.config)
+        result = client.write_data([POINT])
+        self.assertTrue(result)
+        self.assertEqual(mock_influx.call_count, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+        first, second = [call[0][0] for call in mock_sleep.call_args_list]
+        self.assertTrue(0.5 <= first <= 1.0)
+        self.assertTrue(1.0 <= second <= 2.0)
+
+    @mock.patch('minflux.dbwrite.time.sleep')
+    @mock.patch('influxdb.InfluxDBClient.write_points')
+    def test_write_data_give_up(self, mock_influx, mock_sleep):
+        """Tests failed batches are counted once retries run out."""
+        self.config['influxdb']['batch_size'] = 1
+        self.config['influxdb']['retries'] = 1
+        mock_influx.side_effect = [InfluxDBServerError('down'),
+                                   InfluxDBServerError('down'),
+                                   None]
+        client = dbwrite.InfluxClient(self.config)
+        result = client.write_data([POINT, POINT])
+        self.assertFalse(result)
+        self.assertEqual(result.batches, 2)
+        self.assertEqual(result.failed, 1)
+        self.assertEqual(result.points, 1)
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    @mock.patch('influxdb.InfluxDBClient.request')
+    def test_write_lines(self, mock_request):
+        """Tests line protocol is posted as raw bytes in batches."""
+        self.config['influxdb']['batch_size'] = 2
+        client = dbwrite.InfluxClient(self.config)
+        result = client.write_lines(['foo value=1.0 0'] * 3)
+        self.assertTrue(result)
+        self.assertEqual(result.points, 3)
+        self.assertEqual(mock_request.call_count, 2)
+        kwargs = mock_request.call_args_list[0][1]
+        self.assertEqual(kwargs['data'],
+                         b'foo value=1.0 0\nfoo value=1.0 0\n')
+        self.assertEqual(kwargs['params']['precision'], 's')
+
+    @mock.patch('minflux.dbwrite.time.sleep')
+    @mock.patch('influxdb.InfluxDBClient.write_points')
+    def test_write_data_rejected(self, mock_influx, mock_sleep):
+        """Tests client errors fail the batch without retrying."""
+        mock_influx.side_effect = InfluxDBClientError('bad point')
+        client = dbwrite.InfluxClient(self.config)
+        result = client.write_data([POINT])
+        self.assertFalse(result)
         self.assertEqual(mock_influx.call_count, 1)
+        self.assertEqual(mock_sleep.call_count, 0)
 
 
 class TestInfluxDBWriter(unittest.TestCase):
@@ -62,22 +139,150 @@ class TestInfluxDBWriter(unittest.TestCase):
         self.config = dict()
         self.client = None
 
-    @mock.patch('minflux.dbwrite.json.dump')
-    @mock.patch('minflux.dbwrite.jsonify')
-    def test_db_skip(self, mock_json, mock_jsonify):
-        """Tests return of db_skip."""
-        mock_json.return_value = True
-        mock_jsonify.return_value = {}
-        self.assertTrue(dbwrite.influxdb_write(self.config,
-                                               self.client,
-                                               '',
-                                               db_skip=True))
+    @mock.patch('minflux.dbwrite.iter_json')
+    def test_db_skip(self, mock_iter_json):
+        """Tests db_skip streams NDJSON next to the source."""
+        mock_iter_json.return_value = iter([POINT, POINT])
+        tmpdir = tempfile.mkdtemp()
+        try:
+            source = os.path.join(tmpdir, 'foo.csv')
+            result = dbwrite.influxdb_write(self.config, self.client,
+                                            source, db_skip=True)
+            self.assertTrue(result)
+            self.assertEqual(result.points, 2)
+            self.assertTrue(os.path.isfile('{}.ndjson'.format(source)))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    @mock.patch('minflux.dbwrite.linify')
+    def test_db_skip_line_compressed(self, mock_linify):
+        """Tests db_skip writes gzipped line protocol."""
+        self.config['influxdb']['protocol'] = 'line'
+        mock_linify.return_value = iter(['foo value=1.0 0'])
+        tmpdir = tempfile.mkdtemp()
+        try:
+            source = os.path.join(tmpdir, 'foo.csv')
+            result = dbwrite.influxdb_write(self.config, self.client,
+                                            source, db_skip=True,
+                                            compress=True)
+            self.assertEqual(result.points, 1)
+            self.assertTrue(os.path.isfile('{}.lp.gz'.format(source)))
+        finally:
+            shutil.rmtree(tmpdir)
 
     @mock.patch('minflux.dbwrite.jsonify')
-    @mock.patch('minflux.dbwrite.InfluxDBClient.write_points')
+    @mock.patch('influxdb.InfluxDBClient.write_points')
     def test_normal_write(self, mock_influx, mock_jsonify):
         """Tests a normal db write."""
         mock_influx.return_value = None
-        mock_jsonify.return_value = dict()
+        mock_jsonify.return_value = [POINT]
         self.assertTrue(dbwrite.influxdb_write(self.config, self.client, ''))
         self.assertEqual(mock_influx.call_count, 1)
+
+    @mock.patch('minflux.dbwrite.linify')
+    @mock.patch('influxdb.InfluxDBClient.request')
+    def test_line_protocol_write(self, mock_request, mock_linify):
+        """Tests the line protocol writer is used when configured."""
+        self.config['influxdb']['protocol'] = 'line'
+        mock_linify.return_value = iter(['foo value=1.0 0'])
+        self.assertTrue(dbwrite.influxdb_write(self.config, self.client, ''))
+        self.assertEqual(mock_request.call_count, 1)
+
+    @mock.patch('minflux.dbwrite.time.sleep')
+    @mock.patch('minflux.dbwrite.jsonify')
+    @mock.patch('influxdb.InfluxDBClient.write_points')
+    def test_failed_write(self, mock_influx, mock_jsonify, mock_sleep):
+        """Tests a failed batch is reported back as an unsuccessful write."""
+        mock_influx.side_effect = InfluxDBServerError('down')
+        mock_jsonify.return_value = [POINT]
+        result = dbwrite.influxdb_write(self.config, self.client, '')
+        self.assertFalse(result)
+        self.assertEqual(result.failed, 1)
+
+
+class TestChunkedWrite(unittest.TestCase):
+    """Tests writing a chunk of rows at a time."""
+
+    def setUp(self):
+        """General initialization."""
+        self.config = {
+            'influxdb': {
+                'host': 'foo',
+                'port': 1234,
+                'dbname': 'foobar',
+                'user': 'bar',
+                'password': 'barfoo'
+            },
+            'mint': {}
+        }
+        self.client = dbwrite.InfluxClient(self.config)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Removes the temporary directory."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_chunk_rows(self):
+        """Tests chunk sizes from chunk_rows and memory_budget."""
+        self.assertIsNone(dbwrite.chunk_rows(self.config))
+        self.config['mint']['chunk_rows'] = 1000
+        self.assertEqual(dbwrite.chunk_rows(self.config), 1000)
+        self.config['mint']['memory_budget'] = 1
+        self.assertEqual(dbwrite.chunk_rows(self.config), 514)
+        self.config['influxdb']['protocol'] = 'line'
+        self.assertEqual(dbwrite.chunk_rows(self.config), 1000)
+        del self.config['mint']['chunk_rows']
+        self.assertEqual(dbwrite.chunk_rows(self.config), 1365)
+
+    @mock.patch('minflux.dbwrite.jsonify')
+    @mock.patch('minflux.dbwrite.iter_json')
+    @mock.patch('influxdb.InfluxDBClient.write_points')
+    def test_chunked_write(self, mock_influx, mock_iter_json, mock_jsonify):
+        """Tests each chunk is written on its own, without jsonify."""
+        self.config['mint']['chunk_rows'] = 1
+        mock_iter_json.return_value = iter([POINT] * 7)
+        result = dbwrite.influxdb_write(self.config, self.client, '')
+        self.assertTrue(result)
+        self.assertEqual(result.points, 7)
+        self.assertEqual(result.batches, 3)
+        self.assertEqual([len(call[0][0]) for call in
+                          mock_influx.call_args_list], [3, 3, 1])
+        self.assertFalse(mock_jsonify.called)
+
+    @mock.patch('influxdb.InfluxDBClient.write_points')
+    def test_same_points(self, mock_influx):
+        """Tests sums and net_sum span chunks like a single write."""
+        source = os.path.join(self.tmpdir, 'foo.csv')
+        with open(source, 'w') as outfile:
+            outfile.write('"Date","Description","Amount",'
+                          '"Transaction Type","Category","Account Name"\n')
+            for day in range(1, 10):
+                outfile.write('"1/{0:02d}/2017","Shop {1}","{0}.00","debit",'
+                              '"Food","Checking"\n'.format(day, day % 2))
+        self.config['mint']['sum'] = {'periods': ['month']}
+        self.config['net_sum'] = None
+        written = list()
+        mock_influx.side_effect = written.extend
+        dbwrite.influxdb_write(self.config, self.client, source)
+        whole = list(written)
+        del written[:]
+        self.config['mint']['chunk_rows'] = 2
+        result = dbwrite.influxdb_write(self.config, self.client, source)
+        self.assertEqual(written, whole)
+        self.assertEqual(len(whole), 32)
+        self.assertEqual(result.batches, 6)
+        totals = {point['measurement']: point['fields']['value']
+                  for point in whole if 'tags' not in point}
+        self.assertEqual(totals['net_sum'], -45.0)
+        self.assertEqual(totals['sum_Food'], -45.0)
+
+    @mock.patch('minflux.dbwrite.iter_json')
+    def test_spooled_points(self, mock_iter_json):
+        """Tests worker points are spooled to a file and read back."""
+        mock_iter_json.return_value = iter([POINT, POINT])
+        path, keys, stats = dbwrite.build_point_file(self.config, '')
+        self.assertTrue(path.endswith('.ndjson'))
+        self.assertEqual(keys, set())
+        self.assertEqual(stats['counters']['points'], 2)
+        self.assertEqual(list(dbwrite.spooled_points(path)), [POINT, POINT])
+        self.assertFalse(os.path.exists(path))
@@ -0,0 +1,222 @@
+"""Tests the transaction deduplication index."""
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+from minflux import dedup as dedup
+from minflux import json as json
+from minflux import dbwrite as dbwrite
+from tests.test_json import MockReader, make_transaction
+
+TRANSACTIONS = MockReader('').transactions
+DATE = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class ExportReader(MockReader):
+    """MockReader of two overlapping exports, 'first' and 'second'."""
+
+    def __init__(self, file, stream=False):
+        """Initialize ExportReader class."""
+        super().__init__(file, stream=stream)
+        self.file = file
+
+    @property
+    def transactions(self):
+        """Returns the transactions of the export."""
+        if self.file == 'first':
+            return TRANSACTIONS[:1]
+        return TRANSACTIONS + [
+            make_transaction('foocat', 'foo', 'bar', '1/3/1970', 2.00)]
+
+
+class TestTransactionIndex(unittest.TestCase):
+    """Test the TransactionIndex class."""
+
+    def setUp(self):
+        """Creates a location for the index file."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'index', 'keys.bin')
+
+    def tearDown(self):
+        """Removes the temporary files."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_index(self):
+        """Tests no index is created without a path."""
+        self.assertEqual(dedup.load_index(None), None)
+        self.assertTrue(isinstance(dedup.load_index(self.path),
+                                   dedup.TransactionIndex))
+
+    def test_key(self):
+        """Tests keys ignore the amount sign but not other fields."""
+        key = dedup.TransactionIndex.key(86400, -3.5, 'acc', 'desc', 'debit')
+        self.assertEqual(key, dedup.TransactionIndex.key(
+            86400, 3.50, 'acc', 'desc', 'debit'))
+        self.assertNotEqual(key, dedup.TransactionIndex.key(
+            86400, 3.50, 'acc', 'desc', 'credit'))
+        self.assertTrue(0 <= key < 2 ** 64)
+
+    def test_commit_persists(self):
+        """Tests committed keys are seen after reloading."""
+        index = dedup.TransactionIndex(self.path)
+        self.assertFalse(index.check_entry(TRANSACTIONS[0]))
+        self.assertFalse(index.check_entry(TRANSACTIONS[0]))
+        index.commit()
+        self.assertEqual(os.path.getsize(self.path), 8)
+        index = dedup.TransactionIndex(self.path)
+        self.assertTrue(index.check_entry(TRANSACTIONS[0]))
+        self.assertFalse(index.check_entry(TRANSACTIONS[1]))
+
+    def test_rollback(self):
+        """Tests rolled back keys are not persisted."""
+        index = dedup.TransactionIndex(self.path)
+        index.check_entry(TRANSACTIONS[0])
+        index.rollback()
+        index.commit()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(index.check_entry(TRANSACTIONS[0]))
+
+    def test_rollup_totals(self):
+        """Tests committed rollups are added to and persisted."""
+        index = dedup.TransactionIndex(self.path)
+        group = ('rollup_month', DATE, 'category', 'foo', 3.5, 1)
+        self.assertEqual(index.add_rollups([group]), [group])
+        index.rollback()
+        self.assertEqual(index.add_rollups([group]), [group])
+        index.commit()
+        index = dedup.TransactionIndex(self.path)
+        self.assertEqual(index.add_rollups([group]),
+                         [('rollup_month', DATE, 'category', 'foo', 7.0, 2)])
+        self.assertTrue(os.path.exists(self.path + dedup.TOTALS_SUFFIX))
+
+    def test_truncated_file(self):
+        """Tests a partially written key is ignored."""
+        index = dedup.TransactionIndex(self.path)
+        index.check_entry(TRANSACTIONS[0])
+        index.commit()
+        with open(self.path, 'ab') as outfile:
+            outfile.write(b'\x01\x02\x03')
+        index = dedup.TransactionIndex(self.path)
+        self.assertEqual(len(index.keys), 1)
+
+
+class TestDedupIngest(unittest.TestCase):
+    """Test deduplication while converting and writing."""
+
+    def setUp(self):
+        """Creates an index with the first transaction committed."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.index = dedup.TransactionIndex(
+            os.path.join(self.tmpdir, 'keys.bin'))
+        self.index.check_entry(TRANSACTIONS[0])
+        self.index.commit()
+        self.config = {
+            'influxdb': {
+                'host': 'foo',
+                'port': 1234,
+                'dbname': 'foobar',
+                'user': 'bar',
+                'password': 'barfoo'
+            },
+            'mint': {}
+        }
+
+    def tearDown(self):
+        """Removes the temporary files."""
+        shutil.rmtree(self.tmpdir)
+
+    @mock.patch('minflux.json.reader')
+    def test_jsonify_skips_seen(self, mock_reader):
+        """Tests only new transactions become points."""
+        mock_reader.TransactionReader = MockReader
+        body = json.jsonify({'mint': {}}, '/tmp/notreal', index=self.index)
+        self.assertEqual(len(body), 3)
+        self.assertEqual(body[0]['tags']['raw_date'], '1/2/1970')
+        self.assertEqual(len(self.index.pending), 1)
+
+    @mock.patch('minflux.json.reader')
+    def test_jsonify_rerun(self, mock_reader):
+        """Tests a file ingested again yields no untimed net_sum."""
+        mock_reader.TransactionReader = MockReader
+        config = {'mint': {}, 'net_sum': None}
+        body = json.jsonify(config, '/tmp/notreal', index=self.index)
+        self.assertEqual(body[-1]['measurement'], 'net_sum')
+        self.assertIsInstance(body[-1]['fields']['value'], float)
+        self.index.commit()
+        self.assertEqual(json.jsonify(config, '/tmp/notreal',
+                                      index=self.index), [])
+
+    @mock.patch('minflux.json.reader')
+    def test_rollups_across_exports(self, mock_reader):
+        """Tests overlapping exports give the rollups of a full export."""
+        mock_reader.TransactionReader = ExportReader
+        config = {'mint': {'rollup': {'periods': ['month']}}}
+        index = dedup.TransactionIndex(os.path.join(self.tmpdir, 'new.bin'))
+        written = dict()
+        for export in ['first', 'second']:
+            for point in json.jsonify(config, export, index=index):
+                if point['measurement'] == 'rollup_month':
+                    tags = (point['tags']['dimension'], point['tags']['name'])
+                    written[tags] = point['fields']
+            index.commit()
+        full = {(point['tags']['dimension'], point['tags']['name']):
+                point['fields'] for point in json.jsonify(config, 'second')
+                if point['measurement'] == 'rollup_month'}
+        self.assertEqual(written, full)
+
+    @mock.patch('minflux.json.reader')
+    def test_sums_across_exports(self, mock_reader):
+        """Tests a monthly sum counts the rows of every export once."""
+        exports = {
+            'a.csv': [make_transaction('Food', 'shop', 'card', '1/5/2017',
+                                       -10.00),
+                      make_transaction('Food', 'cafe', 'card', '1/10/2017',
+                                       -20.00)],
+            'b.csv': [make_transaction('Food', 'cafe', 'card', '1/10/2017',
+                                       -20.00),
+                      make_transaction('Food', 'bar', 'card', '1/20/2017',
+                                       -5.00)]
+        }
+
+        def export_reader(file, stream=False):
+            """Returns a reader of one of the exports."""
+            return mock.Mock(headers=MockReader('').headers,
+                             transactions=exports[file])
+
+        mock_reader.TransactionReader = export_reader
+        config = {'mint': {'sum': None}}
+        index = dedup.TransactionIndex(os.path.join(self.tmpdir, 'new.bin'))
+        written = list()
+        for export in ['a.csv', 'b.csv']:
+            written.extend(point['fields']['value'] for point in
+                           json.jsonify(config, export, index=index)
+                           if point['measurement'] == 'sum_Food')
+            index.commit()
+        self.assertEqual(written, [-30.0, -35.0])
+
+    @mock.patch('minflux.json.reader')
+    @mock.patch('influxdb.InfluxDBClient.write_points')
+    def test_commit_on_success(self, mock_influx, mock_reader):
+        """Tests new keys are committed after a successful write."""
+        mock_reader.TransactionReader = MockReader
+        client = dbwrite.InfluxClient(self.config)
+        self.assertTrue(dbwrite.influxdb_write(self.config, client, '',
+                                               index=self.index))
+        self.assertEqual(len(self.index.keys), 2)
+        self.assertEqual(len(self.index.pending), 0)
+
+    @mock.patch('minflux.dbwrite.time.sleep')
+    @mock.patch('minflux.json.reader')
+    @mock.patch('influxdb.InfluxDBClient.write_points')
+    def test_rollback_on_failure(self, mock_influx, mock_reader,
+                                 mock_sleep):
+        """Tests new keys are dropped when the write fails."""
+        mock_reader.TransactionReader = MockReader
+        mock_influx.side_effect = OSError('down')
+        client = dbwrite.InfluxClient(self.config)
+        self.assertFalse(dbwrite.influxdb_write(self.config, client, '',
+                                                index=self.index))
+        self.assertEqual(len(self.index.keys), 1)
+        self.assertEqual(len(self.index.pending), 0)
@@ -0,0 +1,50 @@
+"""Tests writing points to disk."""
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+from minflux import dump as dump
+
+POINT = {'measurement': 'foo', 'tags': {'account': 'bar'},
+         'time': '2017-01-01T00:00:00', 'fields': {'value': -1.5}}
+
+
+class TestDump(unittest.TestCase):
+    """Test the dump functions."""
+
+    def setUp(self):
+        """Creates a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmpdir, 'foo.csv')
+
+    def tearDown(self):
+        """Removes the temporary files."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_dump_path(self):
+        """Tests the extension follows the format and compression."""
+        self.assertEqual(dump.dump_path('a.csv'), 'a.csv.ndjson')
+        self.assertEqual(dump.dump_path('a.csv', line_protocol=True),
+                         'a.csv.lp')
+        self.assertEqual(dump.dump_path('a.csv', compress=True),
+                         'a.csv.ndjson.gz')
+
+    def test_ndjson_round_trip(self):
+        """Tests json points are written one per line and read back."""
+        path = dump.dump_path(self.source)
+        count = dump.dump_points(iter([POINT, POINT]), path)
+        self.assertEqual(count, 2)
+        with open(path) as infile:
+            self.assertEqual(len(infile.readlines()), 2)
+        self.assertEqual(list(dump.load_points(path)), [POINT, POINT])
+
+    def test_line_gzip_round_trip(self):
+        """Tests line protocol is gzipped as-is and read back."""
+        lines = ['foo,account=bar value=-1.5 1483228800',
+                 'net_sum value=1.0 0']
+        path = dump.dump_path(self.source, line_protocol=True, compress=True)
+        self.assertEqual(dump.dump_points(lines, path, line_protocol=True), 2)
+        with gzip.open(path, 'rt') as infile:
+            self.assertEqual(infile.read(), '\n'.join(lines) + '\n')
+        self.assertEqual(list(dump.load_points(path)), lines)
@@ -0,0 +1,84 @@
+"""Tests the fake InfluxDB write endpoint."""
+import unittest
+from minflux import dbwrite as dbwrite
+from minflux.fakeinflux import FakeInflux
+
+POINT = {'measurement': 'foo', 'tags': {'account': 'bar'},
+         'time': '2017-01-01T00:00:00', 'fields': {'value': 1.0}}
+
+
+class TestFakeInflux(unittest.TestCase):
+    """Writes through InfluxClient to a FakeInflux server."""
+
+    def setUp(self):
+        """Starts a fake server."""
+        self.server = FakeInflux().start()
+        self.config = {
+            'influxdb': {
+                'host': self.server.host,
+                'port': self.server.port,
+                'dbname': 'foobar',
+                'user': 'bar',
+                'password': 'barfoo',
+                'batch_size': 2,
+                'retries': 1,
+                'retry_delay': 0
+            }
+        }
+        self.client = dbwrite.InfluxClient(self.config)
+
+    def tearDown(self):
+        """Stops the fake server."""
+        self.server.stop()
+
+    def test_write_json(self):
+        """Tests json points arrive as line protocol in batches."""
+        result = self.client.write_data([POINT] * 3)
+        self.assertTrue(result)
+        self.assertEqual(result.batches, 2)
+        self.assertEqual(self.server.points, 3)
+        self.assertEqual([req.db for req in self.server.requests],
+                         ['foobar', 'foobar'])
+        self.assertTrue(self.server.lines[0].startswith(
+            'foo,account=bar value=1.0'))
+
+    def test_write_lines(self):
+        """Tests line protocol is recorded as posted."""
+        lines = ['foo value=1.0 0', 'bar value=2.0 1', 'baz value=3.0 2']
+        result = self.client.write_lines(lines)
+        self.assertTrue(result)
+        self.assertEqual(self.server.lines, lines)
+        self.assertEqual(self.server.requests[0].precision, 's')
+
+    def test_write_async(self):
+        """Tests the async engine against the server."""
+        lines = ['foo value={}.0 {}'.format(i, i) for i in range(9)]
+        result = self.client.write_async(lines, line_protocol=True)
+        self.assertTrue(result)
+        self.assertEqual(result.batches, 5)
+        self.assertEqual(sorted(self.server.lines), sorted(lines))
+
+    def test_retry_injected_error(self):
+        """Tests server errors are retried."""
+        self.server.fail_next = 1
+        result = self.client.write_lines(['foo value=1.0 0'])
+        self.assertTrue(result)
+        self.assertEqual([req.status for req in self.server.requests],
+                         [500, 204])
+        self.assertEqual(self.server.lines, ['foo value=1.0 0'])
+
+    def test_body_too_large(self):
+        """Tests oversized bodies are rejected without a retry."""
+        self.server.max_body_size = 10
+        result = self.client.write_lines(['foo value=1.0 0'])
+        self.assertFalse(result)
+        self.assertEqual(result.failed, 1)
+        self.assertEqual([req.status for req in self.server.requests], [413])
+        self.assertEqual(self.server.lines, [])
+
+    def test_reset(self):
+        """Tests reset forgets received writes."""
+        self.client.write_lines(['foo value=1.0 0'])
+        self.server.reset()
+        self.assertEqual(self.server.requests, [])
+        self.assertEqual(self.server.points, 0)
@@ -2,6 +2,7 @@
 import unittest
 from unittest import mock
 from minflux import json as json
+from minflux import reader as reader
 
 DATA = [
     [
@@ -30,7 +31,7 @@ DATA = [
 class MockReader(object):
     """Class used to mock the reader module."""
 
-    def __init__(self, file, archive=False, archive_dir=None):
+    def __init__(self, file, stream=False):
         """Initialize MockReader class."""
         self.headers = {
             'date': 0,
@@ -44,6 +45,19 @@ class MockReader(object):
         }
         self.data = DATA
 
+    @property
+    def transactions(self):
+        """Returns DATA as Transaction records."""
+        getter = reader.field_getter(self.headers)
+        return [reader.Transaction.from_fields(getter(row)) for row in DATA]
+
+
+def make_transaction(category, description, account_name, date='1/1/1970',
+                     amount=1.00):
+    """Creates a Transaction with the given names."""
+    return reader.Transaction(date, description, category, account_name,
+                              'lab', 'note', 'credit', amount, 0)
+
 
 class TestJsonify(unittest.TestCase):
     """Test jsonify functionality."""
@@ -51,14 +65,9 @@ class TestJsonify(unittest.TestCase):
     def setUp(self):
         """Sets up common entries for testing."""
         self.json = {'tags': {}}
-        self.headers = {
-            'category': 0,
-            'description': 1,
-            'account_name': 2
-        }
-        self.entry = ['foo', 'bar', 'foobar']
+        self.entry = make_transaction('foo', 'bar', 'foobar')
 
-        self.entry_2 = ['pass', 'pass', 'pass']
+        self.entry_2 = make_transaction('pass', 'pass', 'pass')
 
         self.netsum_config = {
             'exclude': {
@@ -71,20 +80,17 @@ class TestJsonify(unittest.TestCase):
     def tearDown(self):
         """Tears down common entries for testing."""
         self.json = dict()
-        self.headers = dict()
-        self.entry = list()
-        self.entry_2 = list()
+        self.entry = None
+        self.entry_2 = None
         self.netsum_config = dict()
 
     def test_net_sum_no_exclude(self):
         """Verifies amounts properly summed given no exclusions in config."""
         value = 0
         value += json.check_entry_for_net_sum(self.netsum_config,
-                                              self.entry,
-                                              self.headers, 1)
+                                              self.entry, 1)
         value += json.check_entry_for_net_sum(self.netsum_config,
-                                              self.entry_2,
-                                              self.headers, 3)
+                                              self.entry_2, 3)
         self.assertEqual(value, 4)
 
     def test_net_sum_with_exclude(self):
@@ -92,13 +98,56 @@ class TestJsonify(unittest.TestCase):
         value = 0
         self.netsum_config['exclude']['vendor'] = ['bar']
         value += json.check_entry_for_net_sum(self.netsum_config,
-                                              self.entry,
-                                              self.headers, 1)
+                                              self.entry, 1)
         value += json.check_entry_for_net_sum(self.netsum_config,
-                                              self.entry_2,
-                                              self.headers, 3)
+                                              self.entry_2, 3)
         self.assertEqual(value, 3, msg='{}'.format(self.netsum_config))
 
+    def test_net_sum_filter_names(self):
+        """Verifies exact names are excluded per field."""
+        net_filter = json.NetSumFilter({
+            'vendor': ['foo'],
+            'category': 'bar',
+        })
+        self.assertTrue(net_filter.excluded('foo', 'x', 'y'))
+        self.assertTrue(net_filter.excluded('x', 'bar', 'y'))
+        self.assertFalse(net_filter.excluded('x', 'foo', 'bar'))
+
+    def test_net_sum_filter_patterns(self):
+        """Verifies glob and regex rules are matched."""
+        net_filter = json.NetSumFilter({
+            'vendor': ['glob:Amazon*', 're:(?i:transfer)'],
+            'account': ['glob:*Savings'],
+            'category': []
+        })
+        self.assertTrue(net_filter.excluded('Amazon.com', 'x', 'y'))
+        self.assertTrue(net_filter.excluded('TRANSFER TO', 'x', 'y'))
+        self.assertTrue(net_filter.excluded('x', 'y', 'Joint Savings'))
+        self.assertFalse(net_filter.excluded('Shop Amazon', 'x', 'y'))
+        self.assertFalse(net_filter.excluded('x', 'y', 'Savings Card'))
+
+    def test_net_sum_filter_cache(self):
+        """Verifies results are memoized per transaction tuple."""
+        net_filter = json.NetSumFilter({'vendor': ['foo']})
+        self.assertTrue(net_filter.excluded('foo', 'x', 'y'))
+        self.assertEqual(net_filter.cache, {('foo', 'x', 'y'): True})
+        net_filter.names['vendor'] = frozenset()
+        self.assertTrue(net_filter.excluded('foo', 'x', 'y'))
+
+    def test_net_sum_filter_bad_regex(self):
+        """Verifies an invalid pattern exits."""
+        with self.assertRaises(SystemExit) as cm:
+            json.NetSumFilter({'vendor': ['re:(']})
+        self.assertEqual(cm.exception.code, 1)
+
+    @mock.patch('minflux.json.reader')
+    def test_jsonify_bare_net_sum(self, mock_reader):
+        """Verifies net_sum without exclusions sums every entry."""
+        mock_reader.TransactionReader = MockReader
+        body = json.jsonify({'mint': {}, 'net_sum': None}, '/tmp/notreal')
+        self.assertEqual(body[-1]['measurement'], 'net_sum')
+        self.assertEqual(body[-1]['fields']['value'], 2.25)
+
     @mock.patch('minflux.json.reader')
     def test_jsonify(self, mock_reader):
         """Verifies keys/values properly set in json body."""
@@ -129,6 +178,31 @@ class TestJsonify(unittest.TestCase):
         for key in measurement_keys:
             self.assertEqual(measurement_counter[key], 1)
 
+    @mock.patch('minflux.json.reader')
+    def test_jsonify_single(self, mock_reader):
+        """Verifies the single layout writes one point per row."""
+        mock_reader.TransactionReader = MockReader
+        body = json.jsonify({'mint': {'layout': 'single', 'sum': None},
+                             'net_sum': self.netsum_config}, '/tmp/notreal')
+        rows = [entry for entry in body
+                if entry['measurement'] == 'transactions']
+        self.assertEqual(len(rows), 2, msg=body)
+        self.assertEqual(rows[0]['tags'], {
+            'vendor': 'foo',
+            'category': 'foocat',
+            'account': 'bar',
+            'raw_date': '1/1/1970',
+            'label': 'foolabel',
+            'notes': 'barnote'
+        })
+        self.assertEqual(rows[1]['fields']['value'], -1.25)
+        measurements = [entry['measurement'] for entry in body]
+        self.assertTrue('net_sum' in measurements)
+        # Sums are still kept per category, vendor and account
+        self.assertTrue('sum_foocat' in measurements)
+        self.assertTrue('sum_rab' in measurements)
+        self.assertEqual(len(body), 9)
+
     def test_get_sum_entries(self):
         """Tests ability to sum across measurements."""
         body_mock = [
@@ -189,6 +263,95 @@ class TestJsonify(unittest.TestCase):
                          '1970-01-01T00:00:00+00:00')
         self.assertEqual(entries[bar_index]['fields']['value'], 4.50)
 
+    def test_sum_aggregator_months(self):
+        """Tests sums are split per measurement and month."""
+        sums = json.SumAggregator()
+        sums.add(['foo', 'bar'], '1/31/1970', 1.25)
+        sums.add(['foo'], '1/1/1970', 1.00)
+        sums.add(['foo'], '2/1/1970', 4.00)
+        entries = {(entry['measurement'], entry['time']):
+                   entry['fields']['value']
+                   for entry in sums.json_entries()}
+        self.assertEqual(entries, {
+            ('sum_foo', '1970-01-01T00:00:00+00:00'): 2.25,
+            ('sum_bar', '1970-01-01T00:00:00+00:00'): 1.25,
+            ('sum_foo', '1970-02-01T00:00:00+00:00'): 4.00
+        })
+
+    def test_sum_aggregator_periods(self):
+        """Tests weekly and daily sums get their own measurements."""
+        sums = json.SumAggregator(['day', 'week'])
+        sums.add(['foo'], '1/5/1970', 1.00)
+        sums.add(['foo'], '1/6/1970', 2.00)
+        entries = {(entry['measurement'], entry['time']):
+                   entry['fields']['value']
+                   for entry in sums.json_entries()}
+        self.assertEqual(entries, {
+            ('sum_day_foo', '1970-01-05T00:00:00+00:00'): 1.00,
+            ('sum_day_foo', '1970-01-06T00:00:00+00:00'): 2.00,
+            ('sum_week_foo', '1970-01-05T00:00:00+00:00'): 3.00
+        })
+
+    @mock.patch('minflux.json.reader')
+    def test_jsonify_sum(self, mock_reader):
+        """Verifies sum points are generated in the same pass."""
+        mock_reader.TransactionReader = MockReader
+        config = {
+            'mint': {'sum': {'periods': ['month', 'day']}},
+            'net_sum': self.netsum_config
+        }
+        body = json.jsonify(config, '/tmp/notreal')
+        sums = [entry for entry in body
+                if entry['measurement'].startswith('sum_')]
+        self.assertEqual(len(sums), 12, msg=sums)
+        self.assertFalse(any(entry['measurement'] == 'sum_net_sum'
+                             for entry in sums))
+        month = [entry for entry in sums
+                 if entry['measurement'] == 'sum_foocat']
+        self.assertEqual(month[0]['time'], '1970-01-01T00:00:00+00:00')
+        self.assertEqual(month[0]['fields']['value'], 3.50)
+
+    def test_rollup_aggregator(self):
+        """Tests rollups sum and count each dimension per period."""
+        rollups = json.RollupAggregator(['week', 'month'])
+        rollups.add(make_transaction('food', 'shop', 'card', '1/5/1970',
+                                     -2.00), -2.00)
+        rollups.add(make_transaction('food', 'cafe', 'card', '1/6/1970',
+                                     -1.50), -1.50)
+        rollups.add(make_transaction('food', 'shop', 'card', '2/1/1970',
+                                     -3.00), -3.00)
+        entries = {(entry['measurement'], entry['time'],
+                    entry['tags']['dimension'], entry['tags']['name']):
+                   (entry['fields']['sum'], entry['fields']['count'])
+                   for entry in rollups.json_entries()}
+        self.assertEqual(len(entries), 14)
+        self.assertEqual(entries[('rollup_month', '1970-01-01T00:00:00+00:00',
+                                  'category', 'food')], (-3.50, 2))
+        self.assertEqual(entries[('rollup_week', '1970-01-05T00:00:00+00:00',
+                                  'account', 'card')], (-3.50, 2))
+        self.assertEqual(entries[('rollup_month', '1970-02-01T00:00:00+00:00',
+                                  'vendor', 'shop')], (-3.00, 1))
+        self.assertEqual(entries[('rollup_week', '1970-01-05T00:00:00+00:00',
+                                  'vendor', 'cafe')], (-1.50, 1))
+
+    @mock.patch('minflux.json.reader')
+    def test_jsonify_rollup(self, mock_reader):
+        """Verifies rollups are written once per group and repeatable."""
+        mock_reader.TransactionReader = MockReader
+        config = {'mint': {'rollup': {'periods': ['month']}}}
+        body = json.jsonify(config, '/tmp/notreal')
+        rollups = [entry for entry in body
+                   if entry['measurement'] == 'rollup_month']
+        self.assertEqual(len(body), 12, msg=body)
+        self.assertEqual(len(rollups), 6, msg=rollups)
+        self.assertTrue({
+            'measurement': 'rollup_month',
+            'time': '1970-01-01T00:00:00+00:00',
+            'tags': {'dimension': 'category', 'name': 'tacoof'},
+            'fields': {'sum': -1.25, 'count': 1}
+        } in rollups)
+        self.assertEqual(json.jsonify(config, '/tmp/notreal'), body)
+
     @mock.patch('minflux.json.reader')
     def test_archive_single_file_custom_dir(self, mock_reader):
         """Verify we don't cause errors in this mode."""
@@ -257,8 +420,7 @@ class TestJsonData(unittest.TestCase):
                 }
             }
         }
-        self.test_entry = ['desc', 'cat', 'acc', 'lab',
-                           'note', '1/1/1970', 'credit', '1.00']
+        self.test_entry = make_transaction('cat', 'desc', 'acc')
         self.Json = json.JsonData(self.config_no_netsum, self.headers)
         self.JsonNetSum = json.JsonData(self.config_netsum, self.headers)
         self.JsonExclude = json.JsonData(self.config_netsum_exclude,
@@ -281,9 +443,9 @@ class TestJsonData(unittest.TestCase):
                                                    'vendor')
         meas_account = self.Json.create_measurement(self.test_entry,
                                                     'account')
-        self.assertEqual(meas_account, self.test_entry[2])
-        self.assertEqual(meas_vendor, self.test_entry[0])
-        self.assertEqual(meas_category, self.test_entry[1])
+        self.assertEqual(meas_account, 'acc')
+        self.assertEqual(meas_vendor, 'desc')
+        self.assertEqual(meas_category, 'cat')
 
     def test_tag_create(self):
         """Tests the tag creation of the JsonData class."""
@@ -293,10 +455,37 @@ class TestJsonData(unittest.TestCase):
             tag_dict[tag] = self.Json.create_tags(self.test_entry,
                                                   tag)
             self.assertTrue(tag not in tag_dict[tag])
+        self.assertEqual(tag_dict['vendor'], {
+            'category': 'cat',
+            'account': 'acc',
+            'raw_date': '1/1/1970',
+            'label': 'lab',
+            'notes': 'note'
+        })
+
+    def test_tag_create_shared(self):
+        """Tests identical tag sets share one dict and interned values."""
+        first = self.Json.create_tags(self.test_entry, 'vendor')
+        again = make_transaction('cat', ''.join(['de', 'sc']), 'acc')
+        self.assertIs(self.Json.create_tags(again, 'vendor'), first)
+        other = make_transaction('cat', 'other', 'acc')
+        other_tags = self.Json.create_tags(other, 'category')
+        self.assertIsNot(other_tags, first)
+        self.assertIs(other_tags['account'], first['account'])
+        later = make_transaction('cat', 'desc', 'acc', date='1/2/1970')
+        self.assertIsNot(self.Json.create_tags(later, 'vendor'), first)
 
     def test_netsum_logic(self):
-        """Tests the logic to generate net_sum within the JsonData class."""
-        self.assertTrue(self.JsonNetSum.add_net_sum_measure)
-        self.assertFalse(self.JsonNetSum.check_net_sum_exclusion)
-        self.assertTrue(self.JsonExclude.add_net_sum_measure)
-        self.assertTrue(self.JsonExclude.check_net_sum_exclusion)
+        """Tests the net_sum config picks the net sum aggregator."""
+        self.assertIsNone(
+            json.create_net_sum_aggregator(self.config_no_netsum))
+        net_sum = json.create_net_sum_aggregator(self.config_netsum)
+        self.assertIsNone(net_sum.net_sum_filter)
+        exclude = json.create_net_sum_aggregator(self.config_netsum_exclude)
+        self.assertIsNotNone(exclude.net_sum_filter)
+        for aggregator in [net_sum, exclude]:
+            aggregator.add(self.test_entry, 2.5)
+            aggregator.add(make_transaction('foobar', 'desc', 'acc'), 1.0)
+        self.assertEqual(net_sum.value, 3.5)
+        self.assertEqual(exclude.value, 2.5)
+        self.assertIs(exclude.first, self.test_entry)
@@ -0,0 +1,114 @@
+"""Tests the line protocol encoding functionality."""
+import unittest
+from unittest import mock
+from minflux import lineprotocol as lineprotocol
+from minflux import json as json
+from tests.test_json import MockReader
+
+
+class TestLineProtocol(unittest.TestCase):
+    """Test line protocol encoding."""
+
+    def setUp(self):
+        """Sets up common entries for testing."""
+        self.netsum_config = {
+            'exclude': {
+                'vendor': [],
+                'category': [],
+                'account': []
+            }
+        }
+
+    def tearDown(self):
+        """Tears down common entries for testing."""
+        self.netsum_config = dict()
+
+    def test_escape_tag(self):
+        """Tests escaping of special characters."""
+        self.assertEqual(lineprotocol.escape_tag('foo bar'), 'foo\\ bar')
+        self.assertEqual(lineprotocol.escape_tag('a,b=c'), 'a\\,b\\=c')
+        self.assertEqual(lineprotocol.escape_tag('foo\\'), 'foo\\\\ ')
+
+    def test_format_tags(self):
+        """Tests tags are sorted and empty values dropped."""
+        tags = [('vendor', 'foo'), ('label', ''), ('account', 'bar')]
+        self.assertEqual(lineprotocol.format_tags(tags),
+                         ',account=bar,vendor=foo')
+
+    def test_encode_point(self):
+        """Tests encoding of a single point."""
+        line = lineprotocol.encode_point('foo', ',bar=baz', -1.5, 86400)
+        self.assertEqual(line, 'foo,bar=baz value=-1.5 86400')
+
+    @mock.patch('minflux.lineprotocol.reader')
+    def test_linify(self, mock_reader):
+        """Verifies measurements, tags and net_sum lines."""
+        mock_reader.TransactionReader = MockReader
+        lines = list(lineprotocol.linify(
+            {'mint': {}, 'net_sum': self.netsum_config}, '/tmp/notreal'))
+        self.assertEqual(len(lines), 7, msg=lines)
+        self.assertEqual(
+            lines[0],
+            'foocat,account=bar,label=foolabel,notes=barnote,'
+            'raw_date=1/1/1970,vendor=foo value=3.5 0')
+        self.assertEqual(lines[-1], 'net_sum value=2.25 0')
+
+    @mock.patch('minflux.lineprotocol.reader')
+    def test_linify_single(self, mock_reader):
+        """Verifies the single layout writes one line per row."""
+        mock_reader.TransactionReader = MockReader
+        lines = list(lineprotocol.linify(
+            {'mint': {'layout': 'single'}, 'net_sum': self.netsum_config},
+            '/tmp/notreal'))
+        self.assertEqual(len(lines), 3, msg=lines)
+        self.assertEqual(
+            lines[0],
+            'transactions,account=bar,category=foocat,label=foolabel,'
+            'notes=barnote,raw_date=1/1/1970,vendor=foo value=3.5 0')
+        self.assertEqual(lines[-1], 'net_sum value=2.25 0')
+
+    @mock.patch('minflux.lineprotocol.reader')
+    def test_linify_rollup(self, mock_reader):
+        """Verifies rollup lines carry a sum and an integer count."""
+        mock_reader.TransactionReader = MockReader
+        lines = list(lineprotocol.linify(
+            {'mint': {'rollup': {'periods': ['day']}}}, '/tmp/notreal'))
+        self.assertEqual(len(lines), 12, msg=lines)
+        self.assertTrue('rollup_day,dimension=category,name=foocat '
+                        'count=1i,sum=3.5 0' in lines)
+        self.assertTrue('rollup_day,dimension=account,name=rab '
+                        'count=1i,sum=-1.25 86400' in lines)
+
+    @mock.patch('minflux.lineprotocol.reader')
+    def test_linify_sum(self, mock_reader):
+        """Verifies sum lines are added per measurement."""
+        mock_reader.TransactionReader = MockReader
+        lines = list(lineprotocol.linify({'mint': {'sum': None}},
+                                         '/tmp/notreal'))
+        self.assertEqual(len(lines), 12, msg=lines)
+        self.assertTrue('sum_foocat value=3.5 0' in lines)
+        self.assertTrue('sum_tacoof value=-1.25 0' in lines)
+
+    @mock.patch('minflux.json.reader')
+    @mock.patch('minflux.lineprotocol.reader')
+    def test_linify_matches_jsonify(self, mock_reader, mock_json_reader):
+        """Verifies both protocols write the same points."""
+        mock_reader.TransactionReader = MockReader
+        mock_json_reader.TransactionReader = MockReader
+        mint_configs = [
+            {},
+            {'layout': 'single'},
+            {'sum': {'periods': ['day', 'month']},
+             'rollup': {'periods': ['week']}}
+        ]
+        for mint_config in mint_configs:
+            config = {'mint': mint_config, 'net_sum': self.netsum_config}
+            lines = list(lineprotocol.linify(config, '/tmp/notreal'))
+            points = json.jsonify(config, '/tmp/notreal')
+            self.assertEqual(
+                [line.split(',')[0].split(' ')[0] for line in lines],
+                [point['measurement'] for point in points])
+            self.assertEqual(
+                [float(line.split('=')[-1].split(' ')[0]) for line in lines],
+                [point['fields'].get('value', point['fields'].get('sum'))
+                 for point in points])
@@ -1,7 +1,38 @@
 """Tests main functionality."""
+import os
+import sys
+import gzip
+import shutil
+import subprocess
+import tempfile
 import unittest
 from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
 from minflux import __main__ as main
+from minflux.dbwrite import influxdb_write
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CSV_HEADER = ('"Date","Description","Original Description","Amount",'
+              '"Transaction Type","Category","Account Name","Labels",'
+              '"Notes"\n')
+
+DIR_CONFIG = {
+    'influxdb': {
+        'host': 'foo',
+        'port': 1234,
+        'user': 'foo',
+        'password': 'bar',
+        'dbname': 'foobar'
+    },
+    'mint': {
+        'directory': '/foo/bar'
+    },
+    'logger': {
+        'file': '',
+        'level': 'INFO'
+    }
+}
 
 
 @mock.patch('minflux.__main__.dbwrite.influxdb_write')
@@ -43,6 +74,35 @@ class TestMainModule(unittest.TestCase):
                 main.main()
         self.assertEqual(mock_client.call_count, 1)
 
+    @mock.patch('cProfile.Profile')
+    def test_profile(self, mock_profile, mock_load_yaml, mock_client):
+        """Tests --profile dumps a profile even when the run fails."""
+        test_args = ['mfdb', '--config=/tmp/fake/path',
+                     '--profile=/tmp/fake/run.prof']
+        mock_client.return_value = False
+        mock_load_yaml.return_value = {
+            'influxdb': {
+                'host': 'foo',
+                'port': 1234,
+                'user': 'foo',
+                'password': 'bar',
+                'dbname': 'foobar'
+            },
+            'mint': {
+                'file': '/tmp/fake.csv'
+            },
+            'logger': {
+                'file': '',
+                'level': 'INFO'
+            }
+        }
+        with mock.patch('sys.argv', test_args):
+            with self.assertRaises(SystemExit):
+                main.main()
+        profiler = mock_profile.return_value
+        self.assertEqual(profiler.enable.call_count, 1)
+        profiler.dump_stats.assert_called_once_with('/tmp/fake/run.prof')
+
     @mock.patch('minflux.__main__.glob.glob')
     def test_with_dir(self, mock_glob, mock_load_yaml, mock_client):
         """Tests handling of directory containing multiple csv files."""
@@ -100,3 +160,436 @@ class TestMainModule(unittest.TestCase):
                     main.main()
             self.assertEqual(mock_client.call_count, 1)
             self.assertEqual(cm.exception.code, 1)
+
+    @mock.patch('minflux.__main__.glob.glob')
+    def test_bad_write_continue(self, mock_glob, mock_load_yaml, mock_client):
+        """Checks all files are attempted with the continue policy."""
+        test_args = ['mfdb', '--config=/tmp/fake/path', '--on-error=continue']
+        mock_client.return_value = False
+        mock_glob.return_value = ['foo.csv', 'bar.csv', 'foobar.csv']
+        mock_load_yaml.return_value = DIR_CONFIG
+        with mock.patch('sys.argv', test_args):
+            with self.assertRaises(SystemExit) as cm:
+                main.main()
+            self.assertEqual(mock_client.call_count, 3)
+            self.assertEqual(cm.exception.code, 1)
+
+
+@mock.patch('concurrent.futures.ProcessPoolExecutor', ThreadPoolExecutor)
+@mock.patch('minflux.__main__.dbwrite.push_points')
+@mock.patch('minflux.__main__.dbwrite.build_point_list')
+@mock.patch('minflux.__main__.glob.glob')
+@mock.patch('minflux.__main__.yaml.load_yaml')
+class TestMainParallel(unittest.TestCase):
+    """Test the parallel directory mode of the main module."""
+
+    def test_parallel_dir(self, mock_load_yaml, mock_glob, mock_build,
+                          mock_push):
+        """Tests every file is parsed by the pool and written in order."""
+        test_args = ['mfdb', '--config=/tmp/fake/path', '--jobs=2']
+        files = ['a.csv', 'b.csv', 'c.csv', 'd.csv', 'e.csv']
+        mock_load_yaml.return_value = DIR_CONFIG
+        mock_glob.return_value = files
+        mock_build.side_effect = lambda config, file, db_skip: (
+            [file], set(), None)
+        mock_push.return_value = True
+        with mock.patch('sys.argv', test_args):
+            main.main()
+        self.assertEqual(mock_build.call_count, 5)
+        written = [call[0][2] for call in mock_push.call_args_list]
+        self.assertEqual(written, files)
+        points = [call[0][3] for call in mock_push.call_args_list]
+        self.assertEqual(points, [[file] for file in files])
+
+    def test_parallel_stop(self, mock_load_yaml, mock_glob, mock_build,
+                           mock_push):
+        """Tests the stop policy ends the run on the first failure."""
+        test_args = ['mfdb', '--config=/tmp/fake/path', '--jobs=2']
+        mock_load_yaml.return_value = DIR_CONFIG
+        mock_glob.return_value = ['a.csv', 'b.csv', 'c.csv']
+        mock_build.side_effect = SystemExit(1)
+        with mock.patch('sys.argv', test_args):
+            with self.assertRaises(SystemExit) as cm:
+                main.main()
+        self.assertEqual(cm.exception.code, 1)
+        self.assertEqual(mock_push.call_count, 0)
+
+    def test_parallel_continue(self, mock_load_yaml, mock_glob, mock_build,
+                               mock_push):
+        """Tests the continue policy writes the remaining files."""
+        test_args = ['mfdb', '--config=/tmp/fake/path', '--jobs=2',
+                     '--on-error=continue']
+        mock_load_yaml.return_value = DIR_CONFIG
+        mock_glob.return_value = ['a.csv', 'b.csv', 'c.csv']
+        mock_build.side_effect = lambda config, file, db_skip: (
+            [file], set(), None)
+        mock_push.side_effect = [False, True, True]
+        with mock.patch('sys.argv', test_args):
+            with self.assertRaises(SystemExit) as cm:
+                main.main()
+        self.assertEqual(cm.exception.code, 1)
+        self.assertEqual(mock_push.call_count, 3)
+
+    @mock.patch('minflux.__main__.dbwrite.influxdb_write')
+    def test_parallel_overlap(self, mock_write, mock_load_yaml, mock_glob,
+                              mock_build, mock_push):
+        """Tests files overlapping an earlier file are deduped again."""
+        test_args = ['mfdb', '--config=/tmp/fake/path', '--jobs=2']
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        config = dict(DIR_CONFIG, mint={
+            'directory': tmpdir, 'dedup': os.path.join(tmpdir, 'index')})
+        mock_load_yaml.return_value = config
+        mock_glob.return_value = ['a.csv', 'b.csv', 'c.csv']
+        keys = {'a.csv': {1, 2}, 'b.csv': {2, 3}, 'c.csv': {4}}
+        mock_build.side_effect = lambda config, file, db_skip: (
+            [file], keys[file], None)
+        mock_push.return_value = True
+        mock_write.return_value = True
+        with mock.patch('sys.argv', test_args):
+            main.main()
+        written = [call[0][2] for call in mock_push.call_args_list]
+        self.assertEqual(written, ['a.csv', 'c.csv'])
+        self.assertEqual(mock_write.call_count, 1)
+        self.assertEqual(mock_write.call_args[0][2], 'b.csv')
+        self.assertEqual(mock_write.call_args[1]['index'].keys, {1, 2, 4})
+
+    @mock.patch('minflux.__main__.dbwrite.build_point_file')
+    def test_parallel_chunked(self, mock_spool, mock_load_yaml, mock_glob,
+                              mock_build, mock_push):
+        """Tests workers spool points to files in chunked mode."""
+        test_args = ['mfdb', '--config=/tmp/fake/path', '--jobs=2']
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        config = dict(DIR_CONFIG, mint={'directory': tmpdir,
+                                        'chunk_rows': 10})
+        mock_load_yaml.return_value = config
+        mock_glob.return_value = ['a.csv', 'b.csv']
+
+        def spool(config, file, db_skip):
+            """Writes a point file for file."""
+            path = os.path.join(tmpdir, '{}.ndjson'.format(file))
+            with open(path, 'w') as outfile:
+                outfile.write('{"measurement": "foo"}\n')
+            return path, set(), None
+
+        mock_spool.side_effect = spool
+        mock_push.side_effect = lambda config, client, file, points, **kw: (
+            list(points) == [{'measurement': 'foo'}])
+        with mock.patch('sys.argv', test_args):
+            main.main()
+        self.assertEqual(mock_spool.call_count, 2)
+        self.assertEqual(mock_build.call_count, 0)
+        self.assertEqual(mock_push.call_count, 2)
+        self.assertEqual(os.listdir(tmpdir), ['.minflux_manifest.json'])
+
+
+@mock.patch('minflux.__main__.dbwrite.influxdb_write')
+@mock.patch('minflux.__main__.yaml.load_yaml')
+class TestMainManifest(unittest.TestCase):
+    """Test skipping of already ingested files in directory mode."""
+
+    def setUp(self):
+        """Creates a directory with csv files."""
+        self.tmpdir = tempfile.mkdtemp()
+        for name in ['foo.csv', 'bar.csv']:
+            with open(os.path.join(self.tmpdir, name), 'w') as outfile:
+                outfile.write(name)
+        self.config = {
+            'influxdb': DIR_CONFIG['influxdb'],
+            'mint': {
+                'directory': self.tmpdir
+            },
+            'logger': DIR_CONFIG['logger']
+        }
+
+    def tearDown(self):
+        """Removes the temporary directory."""
+        shutil.rmtree(self.tmpdir)
+
+    def run_main(self, *extra_args):
+        """Runs main against the temporary directory."""
+        test_args = ['mfdb', '--config=/tmp/fake/path'] + list(extra_args)
+        with mock.patch('sys.argv', test_args):
+            main.main()
+
+    def test_skip_unchanged(self, mock_load_yaml, mock_client):
+        """Tests a second run skips files that did not change."""
+        mock_load_yaml.return_value = self.config
+        mock_client.return_value = True
+        self.run_main()
+        self.assertEqual(mock_client.call_count, 2)
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.tmpdir, '.minflux_manifest.json')))
+        with open(os.path.join(self.tmpdir, 'foo.csv'), 'a') as outfile:
+            outfile.write('more')
+        self.run_main()
+        self.assertEqual(mock_client.call_count, 3)
+        self.assertTrue(mock_client.call_args[0][2].endswith('foo.csv'))
+
+    def test_force(self, mock_load_yaml, mock_client):
+        """Tests --force ingests unchanged files again."""
+        mock_load_yaml.return_value = self.config
+        mock_client.return_value = True
+        self.run_main()
+        self.run_main('--force')
+        self.assertEqual(mock_client.call_count, 4)
+
+    def test_failed_not_recorded(self, mock_load_yaml, mock_client):
+        """Tests files that failed to write are retried next run."""
+        mock_load_yaml.return_value = self.config
+        mock_client.return_value = False
+        with self.assertRaises(SystemExit):
+            self.run_main('--on-error=continue')
+        mock_client.return_value = True
+        self.run_main()
+        self.assertEqual(mock_client.call_count, 4)
+
+    def test_archive_written(self, mock_load_yaml, mock_client):
+        """Tests only files written to the database are archived."""
+        self.config['mint']['archive'] = None
+        mock_load_yaml.return_value = self.config
+        mock_client.side_effect = lambda config, client, file, **kwargs: (
+            file.endswith('foo.csv'))
+        with self.assertRaises(SystemExit):
+            self.run_main('--on-error=continue')
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir, 'archive')),
+                         ['foo.csv.gz'])
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir,
+                                                     'foo.csv')))
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir,
+                                                    'bar.csv')))
+
+    def test_archive_failed(self, mock_load_yaml, mock_client):
+        """Tests a failed archive fails the run."""
+        self.config['mint']['archive'] = None
+        mock_load_yaml.return_value = self.config
+        mock_client.return_value = True
+        with mock.patch('minflux.archive.archive_file') as mock_archive:
+            mock_archive.side_effect = OSError('disk full')
+            with self.assertRaises(SystemExit) as cm:
+                self.run_main()
+        self.assertEqual(cm.exception.code, 1)
+        self.assertEqual(mock_archive.call_count, 2)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir,
+                                                    'foo.csv')))
+
+    def test_archive_skip_push(self, mock_load_yaml, mock_client):
+        """Tests nothing is archived without a database write."""
+        self.config['mint']['archive'] = None
+        mock_load_yaml.return_value = self.config
+        mock_client.return_value = True
+        self.run_main('--skip-push')
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir,
+                                                     'archive')))
+
+
+@mock.patch('minflux.watch.watch')
+@mock.patch('minflux.__main__.dbwrite.influxdb_write')
+@mock.patch('minflux.__main__.yaml.load_yaml')
+class TestMainWatch(unittest.TestCase):
+    """Test ingesting files as they land with --watch."""
+
+    def setUp(self):
+        """Creates a directory with a csv file."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.csvfile = os.path.join(self.tmpdir, 'foo.csv')
+        with open(self.csvfile, 'w') as outfile:
+            outfile.write('foo')
+        self.config = {
+            'influxdb': DIR_CONFIG['influxdb'],
+            'mint': {
+                'directory': self.tmpdir
+            },
+            'logger': DIR_CONFIG['logger']
+        }
+
+    def tearDown(self):
+        """Removes the temporary directory."""
+        shutil.rmtree(self.tmpdir)
+
+    def run_main(self, *extra_args):
+        """Runs main with --watch against the temporary directory."""
+        test_args = ['mfdb', '--config=/tmp/fake/path',
+                     '--watch'] + list(extra_args)
+        with mock.patch('sys.argv', test_args):
+            main.main()
+
+    def test_watch(self, mock_load_yaml, mock_client, mock_watch):
+        """Tests batches are written once, until interrupted."""
+        mock_load_yaml.return_value = self.config
+        mock_client.return_value = True
+
+        def fake_watch(directory, handle, settle):
+            self.assertEqual(directory, self.tmpdir)
+            self.assertEqual(settle, 0.5)
+            handle([self.csvfile])
+            handle([self.csvfile])
+            raise KeyboardInterrupt
+
+        mock_watch.side_effect = fake_watch
+        self.run_main('--settle=0.5')
+        self.assertEqual(mock_client.call_count, 1)
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.tmpdir, '.minflux_manifest.json')))
+
+    def test_watch_failure(self, mock_load_yaml, mock_client, mock_watch):
+        """Tests a failed file does not stop watching."""
+        mock_load_yaml.return_value = self.config
+        mock_client.side_effect = [False, True]
+        mock_watch.side_effect = lambda directory, handle, settle: [
+            handle([self.csvfile]), handle([self.csvfile])]
+        self.run_main()
+        self.assertEqual(mock_client.call_count, 2)
+
+    def test_watch_malformed(self, mock_load_yaml, mock_client, mock_watch):
+        """Tests a file that cannot be parsed does not stop watching."""
+        header = CSV_HEADER
+        bad = os.path.join(self.tmpdir, 'bad.csv')
+        with open(bad, 'w') as outfile:
+            outfile.write(header)
+            outfile.write('"garbage","a","A","1.00","debit","c","x","",""\n')
+        with open(self.csvfile, 'w') as outfile:
+            outfile.write(header)
+            outfile.write('"1/2/2018","a","A","1.00","debit","c","x","",""\n')
+        self.config['mint']['dedup'] = os.path.join(self.tmpdir, 'index')
+        mock_load_yaml.return_value = self.config
+        mock_client.side_effect = influxdb_write
+        mock_watch.side_effect = lambda directory, handle, settle: [
+            handle([bad]), handle([self.csvfile])]
+        with mock.patch('minflux.dbwrite.push_points') as mock_push:
+            mock_push.return_value = True
+            self.run_main()
+        self.assertEqual(mock_push.call_count, 1)
+        self.assertEqual(mock_push.call_args[0][2], self.csvfile)
+        self.assertEqual(os.path.getsize(self.config['mint']['dedup']), 8)
+
+    def test_watch_file(self, mock_load_yaml, mock_client, mock_watch):
+        """Tests --watch needs a directory."""
+        mock_load_yaml.return_value = {
+            'influxdb': DIR_CONFIG['influxdb'],
+            'mint': {
+                'file': self.csvfile
+            },
+            'logger': DIR_CONFIG['logger']
+        }
+        with self.assertRaises(SystemExit) as cm:
+            self.run_main()
+        self.assertEqual(cm.exception.code, 1)
+        mock_watch.assert_not_called()
+
+
+@mock.patch('minflux.__main__.dbwrite.influxdb_write')
+@mock.patch('minflux.__main__.yaml.load_yaml')
+class TestMainRegenerate(unittest.TestCase):
+    """Test re-ingesting archived files."""
+
+    def setUp(self):
+        """Creates a directory with an archived and a new csv file."""
+        self.tmpdir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmpdir, 'archive'))
+        self.archived = os.path.join(self.tmpdir, 'archive', 'foo.csv.gz')
+        self.new = os.path.join(self.tmpdir, 'bar.csv')
+        for name in [self.archived, self.new]:
+            with open(name, 'w') as outfile:
+                outfile.write(name)
+        self.config = {
+            'influxdb': DIR_CONFIG['influxdb'],
+            'mint': {
+                'directory': self.tmpdir,
+                'archive': None,
+                'dedup': os.path.join(self.tmpdir, 'index')
+            },
+            'logger': DIR_CONFIG['logger']
+        }
+
+    def tearDown(self):
+        """Removes the temporary directory."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_regenerate(self, mock_load_yaml, mock_client):
+        """Tests archived and new files are written to a new dedup index."""
+        with gzip.open(self.archived, 'wt') as outfile:
+            outfile.write(CSV_HEADER)
+            outfile.write('"1/2/2018","a","A","1.00","debit","c","x","",""\n')
+        with open(self.new, 'w') as outfile:
+            outfile.write(CSV_HEADER)
+            outfile.write('"1/2/2018","a","A","1.00","debit","c","x","",""\n')
+            outfile.write('"1/3/2018","b","B","2.00","debit","c","x","",""\n')
+        index_file = self.config['mint']['dedup']
+        with open(index_file, 'wb') as outfile:
+            outfile.write(b'\x00' * 8)
+        mock_load_yaml.return_value = self.config
+        mock_client.side_effect = influxdb_write
+        test_args = ['mfdb', '--config=/tmp/fake/path', '--regenerate-all',
+                     '--jobs=1']
+        with mock.patch('sys.argv', test_args), \
+                mock.patch('minflux.dbwrite.push_points') as mock_push:
+            mock_push.return_value = True
+            main.main()
+        written = [call[0][2] for call in mock_client.call_args_list]
+        self.assertEqual(written, [self.archived, self.new])
+        # The stored key is dropped, the keys of both files are kept
+        self.assertEqual(os.path.getsize(index_file), 16)
+        self.assertEqual(len(mock_client.call_args[1]['index'].keys), 2)
+        self.assertFalse(os.path.exists(index_file + '.regenerate'))
+        self.assertTrue(os.path.exists(self.archived))
+        self.assertFalse(os.path.exists(self.new))
+
+    @mock.patch('minflux.__main__.os.cpu_count')
+    @mock.patch('minflux.__main__.write_parallel')
+    def test_regenerate_jobs(self, mock_parallel, mock_cpu_count,
+                             mock_load_yaml, mock_client):
+        """Tests all cores are used unless --jobs is given."""
+        mock_load_yaml.return_value = self.config
+        mock_parallel.return_value = True
+        mock_cpu_count.return_value = 8
+        test_args = ['mfdb', '--config=/tmp/fake/path', '--regenerate-all']
+        with mock.patch('sys.argv', test_args):
+            main.main()
+        self.assertEqual(mock_parallel.call_args[0][3]['jobs'], 8)
+        # Workers check rows against the index being rebuilt
+        self.assertEqual(mock_parallel.call_args[0][0]['mint']['dedup'],
+                         self.config['mint']['dedup'] + '.regenerate')
+        self.assertIsNotNone(mock_parallel.call_args[1]['index'])
+        self.assertEqual(mock_parallel.call_args[0][2],
+                         [self.archived, self.new])
+
+    @mock.patch('minflux.__main__.write_parallel')
+    def test_regenerate_rollups(self, mock_parallel, mock_load_yaml,
+                                mock_client):
+        """Tests rollups rebuild the dedup index one file at a time."""
+        self.config['mint']['rollup'] = {'periods': ['month']}
+        mock_load_yaml.return_value = self.config
+        index_file = self.config['mint']['dedup']
+        with open(index_file, 'wb') as outfile:
+            outfile.write(b'\x00' * 16)
+
+        def write(config, client, source, **kwargs):
+            """Commits one key per file to the rebuilt index."""
+            kwargs['index'].add(len(kwargs['index'].keys))
+            kwargs['index'].commit()
+            return True
+
+        mock_client.side_effect = write
+        test_args = ['mfdb', '--config=/tmp/fake/path', '--regenerate-all']
+        with mock.patch('sys.argv', test_args):
+            main.main()
+        self.assertFalse(mock_parallel.called)
+        self.assertEqual(mock_client.call_args[1]['index'].path, index_file)
+        self.assertEqual(os.path.getsize(index_file), 16)
+        self.assertFalse(os.path.exists(index_file + '.regenerate'))
+
+
+class TestMainImports(unittest.TestCase):
+    """Test heavy dependencies are not imported at startup."""
+
+    def test_lazy_imports(self):
+        """Tests importing the cli leaves optional dependencies unloaded."""
+        code = ("import sys, minflux.__main__; "
+                "print(' '.join(name for name in ('influxdb', 'requests', "
+                "'coloredlogs', 'dateutil', 'voluptuous', 'yaml', "
+                "'asyncio') if name in sys.modules))")
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=ROOT_DIR)
+        self.assertEqual(output.strip(), b'')
@@ -0,0 +1,76 @@
+"""Tests the ingestion manifest functionality."""
+import os
+import shutil
+import tempfile
+import unittest
+from minflux import manifest as manifest
+
+
+class TestManifest(unittest.TestCase):
+    """Test the Manifest class."""
+
+    def setUp(self):
+        """Creates a csv file and manifest location."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.csvfile = os.path.join(self.tmpdir, 'foo.csv')
+        self.path = os.path.join(self.tmpdir, 'manifest.json')
+        with open(self.csvfile, 'w') as outfile:
+            outfile.write('"Date","Amount"\n"1/1/2017","1.00"\n')
+
+    def tearDown(self):
+        """Removes the temporary files."""
+        shutil.rmtree(self.tmpdir)
+
+    def record(self):
+        """Records the csv file and reloads the saved manifest."""
+        mfst = manifest.Manifest(self.path)
+        mfst.record(self.csvfile, mfst.stamp(self.csvfile), points=3)
+        mfst.save()
+        return manifest.Manifest(self.path)
+
+    def test_new_file(self):
+        """Tests files not in the manifest are not current."""
+        mfst = manifest.Manifest(self.path)
+        self.assertFalse(mfst.is_current(self.csvfile))
+
+    def test_recorded_file(self):
+        """Tests recorded files are current and persisted."""
+        mfst = self.record()
+        self.assertTrue(mfst.is_current(self.csvfile))
+        entry = mfst.files[os.path.abspath(self.csvfile)]
+        self.assertEqual(entry['points'], 3)
+        self.assertEqual(entry['size'], os.path.getsize(self.csvfile))
+        self.assertEqual(entry['sha256'], manifest.file_hash(self.csvfile))
+
+    def test_touched_file(self):
+        """Tests a file with a new mtime but same contents is current."""
+        mfst = self.record()
+        stat = os.stat(self.csvfile)
+        os.utime(self.csvfile, ns=(stat.st_atime_ns,
+                                   stat.st_mtime_ns + 10**9))
+        self.assertTrue(mfst.is_current(self.csvfile))
+
+    def test_changed_file(self):
+        """Tests a modified file is no longer current."""
+        mfst = self.record()
+        stat = os.stat(self.csvfile)
+        with open(self.csvfile, 'w') as outfile:
+            outfile.write('"Date","Amount"\n"1/2/2017","1.00"\n')
+        os.utime(self.csvfile, ns=(stat.st_atime_ns,
+                                   stat.st_mtime_ns + 10**9))
+        self.assertFalse(mfst.is_current(self.csvfile))
+
+    def test_missing_stamp(self):
+        """Tests files that vanished are not recorded."""
+        mfst = manifest.Manifest(self.path)
+        stamp = mfst.stamp(os.path.join(self.tmpdir, 'missing.csv'))
+        self.assertEqual(stamp, None)
+        mfst.record('missing.csv', stamp)
+        self.assertEqual(mfst.files, dict())
+
+    def test_corrupt_manifest(self):
+        """Tests an unreadable manifest is ignored."""
+        with open(self.path, 'w') as outfile:
+            outfile.write('not json')
+        mfst = manifest.Manifest(self.path)
+        self.assertEqual(mfst.files, dict())
@@ -0,0 +1,155 @@
+"""Tests the asyncio write pipeline."""
+import time
+import threading
+import unittest
+from unittest import mock
+from minflux import pipeline as pipeline
+from minflux import dbwrite as dbwrite
+
+
+class MockClient(object):
+    """Client stand-in recording concurrent batch writes."""
+
+    def __init__(self, batch_size=2, fail=None):
+        """Initialize MockClient class."""
+        self.batch_size = batch_size
+        self.fail = fail or []
+        self.written = list()
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def write_batch(self, batch, send):
+        """Pretend to write a batch with some network latency."""
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.01)
+        with self.lock:
+            self.active -= 1
+            self.written.append(batch)
+        send(batch)
+        return batch[0] not in self.fail
+
+
+class TestPipeline(unittest.TestCase):
+    """Test write_pipelined functionality."""
+
+    def test_all_batches_written(self):
+        """Tests every point is written and counted."""
+        client = MockClient()
+        send = mock.MagicMock()
+        result = pipeline.write_pipelined(client, iter(range(9)), send,
+                                          dbwrite.WriteResult(), 3)
+        self.assertTrue(result)
+        self.assertEqual(result.points, 9)
+        self.assertEqual(result.batches, 5)
+        self.assertEqual(send.call_count, 5)
+        written = sorted(x for batch in client.written for x in batch)
+        self.assertEqual(written, list(range(9)))
+
+    def test_concurrency_capped(self):
+        """Tests no more than concurrency writes are in flight."""
+        client = MockClient(batch_size=1)
+        pipeline.write_pipelined(client, range(20), mock.MagicMock(),
+                                 dbwrite.WriteResult(), 2)
+        self.assertTrue(client.max_active <= 2)
+        self.assertEqual(len(client.written), 20)
+
+    def test_failed_batches(self):
+        """Tests failed batches are counted."""
+        client = MockClient(fail=[2])
+        result = pipeline.write_pipelined(client, range(6),
+                                          mock.MagicMock(),
+                                          dbwrite.WriteResult(), 2)
+        self.assertFalse(result)
+        self.assertEqual(result.failed, 1)
+        self.assertEqual(result.points, 4)
+
+    def test_writer_error(self):
+        """Tests unexpected write errors fail the batch, not the pipeline."""
+        def send(batch):
+            """Rejects one point as malformed."""
+            if batch[0] == 3:
+                raise ValueError('bad point')
+        client = MockClient(batch_size=1)
+        result = pipeline.write_pipelined(client, range(10), send,
+                                          dbwrite.WriteResult(), 2)
+        self.assertFalse(result)
+        self.assertEqual(result.failed, 1)
+        self.assertEqual(result.points, 9)
+        self.assertEqual(len(client.written), 10)
+
+    def test_producer_error(self):
+        """Tests errors while building points stop the pipeline."""
+        def points():
+            """Yields a few points before failing."""
+            yield 1
+            yield 2
+            raise SystemExit(1)
+        client = MockClient()
+        with self.assertRaises(SystemExit):
+            pipeline.write_pipelined(client, points(), mock.MagicMock(),
+                                     dbwrite.WriteResult(), 2)
+
+
+class TestAsyncEngine(unittest.TestCase):
+    """Test the async engine selection in dbwrite."""
+
+    def setUp(self):
+        """General initialization."""
+        self.config = {
+            'influxdb': {
+                'host': 'foo',
+                'port': 1234,
+                'dbname': 'foobar',
+                'user': 'bar',
+                'password': 'barfoo',
+                'engine': 'async',
+                'batch_size': 2
+            }
+        }
+
+    @mock.patch('minflux.dbwrite.iter_json')
+    @mock.patch('influxdb.InfluxDBClient.write_points')
+    def test_async_write(self, mock_influx, mock_iter_json):
+        """Tests influxdb_write uses the pipeline when configured."""
+        mock_iter_json.return_value = iter([{'measurement': 'foo'}] * 5)
+        client = dbwrite.InfluxClient(self.config)
+        result = dbwrite.influxdb_write(self.config, client, '')
+        self.assertTrue(result)
+        self.assertEqual(result.points, 5)
+        self.assertEqual(mock_influx.call_count, 3)
+
+    @mock.patch('minflux.dbwrite.iter_json')
+    @mock.patch('influxdb.InfluxDBClient.write_points')
+    def test_async_json_streams(self, mock_influx, mock_iter_json):
+        """Tests json batches are sent while later points are built."""
+        sent = threading.Event()
+        sent_early = list()
+
+        def points():
+            """Yields a batch, then waits for it to be sent."""
+            yield {'measurement': 'foo'}
+            yield {'measurement': 'foo'}
+            sent_early.append(sent.wait(5))
+            yield {'measurement': 'foo'}
+
+        mock_influx.side_effect = lambda batch: sent.set()
+        mock_iter_json.return_value = points()
+        client = dbwrite.InfluxClient(self.config)
+        result = dbwrite.influxdb_write(self.config, client, '')
+        self.assertTrue(result)
+        self.assertEqual(sent_early, [True])
+        self.assertEqual(result.points, 3)
+
+    @mock.patch('minflux.dbwrite.linify')
+    @mock.patch('influxdb.InfluxDBClient.request')
+    def test_async_line_write(self, mock_request, mock_linify):
+        """Tests the async engine posts line protocol batches."""
+        self.config['influxdb']['protocol'] = 'line'
+        mock_linify.return_value = iter(['foo value=1.0 0'] * 3)
+        client = dbwrite.InfluxClient(self.config)
+        result = dbwrite.influxdb_write(self.config, client, '')
+        self.assertTrue(result)
+        self.assertEqual(mock_request.call_count, 2)
@@ -1,36 +1,13 @@
 """Tests the csv reading functionality."""
+import os
+import gzip
+import shutil
+import tempfile
 import unittest
 from unittest import mock
 from minflux import reader as reader
 
 
-class MockPathLib(object):
-    """Mock class for pathlib library."""
-
-    def __init__(self, dir):
-        """Mock init."""
-        pass
-
-    @property
-    def parent(self):
-        """Mock pathlib.Path.parent."""
-        return '/tmp'
-
-    @property
-    def name(self):
-        """Mock pathlib.Path.name."""
-        return 'bar.foo'
-
-    @property
-    def stem(self):
-        """Mock pathlib.Path.stem."""
-        return '.foo'
-
-    def mkdir(self, parents=False, exist_ok=False):
-        """Mock pathlib.Path.mkdir method."""
-        return None
-
-
 @mock.patch('minflux.yaml.os.path.isfile')
 class TestTransactionReader(unittest.TestCase):
     """Test the TransactionReader class."""
@@ -94,42 +71,101 @@ class TestTransactionReader(unittest.TestCase):
         for key in self.Reader.headers:
             self.assertTrue(self.Reader.headers[key] is not None)
 
-    def test_file_not_exist(self, mock_is_file):
-        """Checks that error thrown if file does not exist."""
-        mock_is_file.return_value = False
-        with self.assertRaises(SystemExit) as cm:
-            self.Reader = reader.TransactionReader('/tmp/fake')
-        self.assertEqual(cm.exception.code, 1)
-
-    @mock.patch('minflux.reader.TransactionReader.archive')
     @mock.patch('minflux.reader.csv.reader')
-    def test_archive_entry(self, mock_csv_read, mock_archive, mock_is_file):
-        """Checks that archiving is attempted when flagged in config."""
-        mock_archive.return_value = None
+    def test_stream_rows(self, mock_csv_read, mock_is_file):
+        """Verifies rows are yielded lazily in stream mode."""
         mock_is_file.return_value = True
-        mock_csv_read.return_value = self.mock_csv_read_return
+        mock_csv_read.side_effect = lambda *args, **kwargs: iter(
+            self.mock_csv_read_return)
         mock_fh = mock.mock_open()
         with mock.patch('builtins.open', mock_fh, create=False):
-            self.Reader = reader.TransactionReader('/tmp/fake', archive=True)
-        self.assertEqual(mock_archive.call_count, 1)
+            self.Reader = reader.TransactionReader('/tmp/fake', stream=True)
+            self.assertEqual(mock_csv_read.call_count, 1)
+            rows = self.Reader.data
+            self.assertFalse(isinstance(rows, list))
+            self.assertEqual(list(rows), [self.mock_csv_read_return[1]])
+        for key in self.Reader.headers:
+            self.assertTrue(self.Reader.headers[key] is not None)
 
-    @mock.patch('minflux.reader.pathlib')
-    @mock.patch('minflux.reader.os.path.exists')
     @mock.patch('minflux.reader.csv.reader')
-    def test_archive_exist_on_too_many_collisons(self,
-                                                 mock_csv_read,
-                                                 mock_exists,
-                                                 mock_pathlib,
-                                                 mock_is_file):
-        """Checks that code exists if too many name collisions exist."""
-        mock_pathlib.Path = MockPathLib
+    def test_transactions(self, mock_csv_read, mock_is_file):
+        """Verifies rows are turned into Transaction records."""
         mock_is_file.return_value = True
-        mock_exists.return_value = True
-        mock_csv_read.return_value = self.mock_csv_read_return
+        mock_csv_read.side_effect = lambda *args, **kwargs: iter([
+            self.mock_csv_read_return[0],
+            ['1/1/2017', 'foo', 'bar', '3.50', 'debit', 'lab', 'note', 'acc']
+        ])
         mock_fh = mock.mock_open()
         with mock.patch('builtins.open', mock_fh, create=False):
-            with self.assertRaises(SystemExit) as cm:
-                self.Reader = reader.TransactionReader('/tmp/fake',
-                                                       archive=True)
+            self.Reader = reader.TransactionReader('/tmp/fake', stream=True)
+            transactions = list(self.Reader.transactions)
+        self.assertEqual(len(transactions), 1)
+        entry = transactions[0]
+        self.assertEqual(entry.date, '1/1/2017')
+        self.assertEqual(entry.category, 'foo')
+        self.assertEqual(entry.description, 'bar')
+        self.assertEqual(entry.account_name, 'acc')
+        self.assertEqual(entry.labels, 'lab')
+        self.assertEqual(entry.notes, 'note')
+        self.assertEqual(entry.transaction_type, 'debit')
+        self.assertEqual(entry.amount, -3.50)
+        self.assertEqual(entry.time, 1483228800)
+        with self.assertRaises(AttributeError):
+            entry.extra = None
+
+    def test_field_getter_missing_column(self, mock_is_file):
+        """Verifies missing columns are read as empty strings."""
+        headers = {
+            'date': 0,
+            'description': 1,
+            'category': 2,
+            'account_name': 3,
+            'labels': None,
+            'notes': None,
+            'transaction_type': 4,
+            'amount': 5
+        }
+        getter = reader.field_getter(headers)
+        self.assertEqual(getter(['d', 'v', 'c', 'a', 'credit', '1']),
+                         ('d', 'v', 'c', 'a', '', '', 'credit', '1'))
+
+    def test_file_not_exist(self, mock_is_file):
+        """Checks that error thrown if file does not exist."""
+        mock_is_file.return_value = False
+        with self.assertRaises(SystemExit) as cm:
+            self.Reader = reader.TransactionReader('/tmp/fake')
         self.assertEqual(cm.exception.code, 1)
-        self.assertEqual(mock_exists.call_count, 257)
+
+
+class TestArchivedReader(unittest.TestCase):
+    """Test reading archived csv files."""
+
+    def setUp(self):
+        """Writes a plain and a gzipped csv file."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.contents = ('"Date","Description","Original Description",'
+                         '"Amount","Transaction Type","Category",'
+                         '"Account Name","Labels","Notes"\n'
+                         '"1/02/2017","Coffee, Inc.","COFFEE","3.50",'
+                         '"debit","Coffee Shops","Checking","",""\n')
+        self.csvfile = os.path.join(self.tmpdir, 'foo.csv')
+        with open(self.csvfile, 'w') as outfile:
+            outfile.write(self.contents)
+        self.gzfile = os.path.join(self.tmpdir, 'foo.csv.gz')
+        with gzip.open(self.gzfile, 'wt') as outfile:
+            outfile.write(self.contents)
+
+    def tearDown(self):
+        """Removes the temporary files."""
+        shutil.rmtree(self.tmpdir)
+
+    def test_gzip_rows(self):
+        """Verifies archived files give the same rows as the csv."""
+        for stream in [False, True]:
+            plain = reader.TransactionReader(self.csvfile, stream=stream)
+            archived = reader.TransactionReader(self.gzfile, stream=stream)
+            self.assertEqual(archived.headers, plain.headers)
+            self.assertEqual(list(archived.data), list(plain.data))
+        entry = next(iter(archived.transactions))
+        self.assertEqual(entry.description, 'Coffee, Inc.')
+        self.assertEqual(entry.amount, -3.50)
@@ -0,0 +1,82 @@
+"""Tests the run statistics."""
+import os
+import unittest
+from unittest import mock
+from minflux import stats as stats
+
+
+class TestStats(unittest.TestCase):
+    """Test the Stats class."""
+
+    def setUp(self):
+        """Creates empty stats."""
+        self.stats = stats.Stats()
+
+    def test_timer(self):
+        """Tests timed blocks add up per stage."""
+        with self.stats.timer('foo'):
+            pass
+        with self.stats.timer('foo'):
+            pass
+        self.assertEqual(list(self.stats.timers), ['foo'])
+        self.assertGreaterEqual(self.stats.timers['foo'], 0)
+
+    def test_timed_iter(self):
+        """Tests iterating counts items and keeps them in order."""
+        items = list(self.stats.timed_iter('foo', iter('abc'),
+                                           counter='letters'))
+        self.assertEqual(items, ['a', 'b', 'c'])
+        self.assertEqual(self.stats.counters['letters'], 3)
+        self.assertIn('foo', self.stats.timers)
+
+    def test_timed_iter_closed(self):
+        """Tests abandoned iterations are still recorded."""
+        iterator = self.stats.timed_iter('foo', iter('abc'), counter='n')
+        next(iterator)
+        iterator.close()
+        self.assertEqual(self.stats.counters['n'], 1)
+
+    def test_since_merge(self):
+        """Tests worker snapshots are merged as differences."""
+        self.stats.count('rows', 5)
+        before = self.stats.snapshot()
+        self.stats.count('rows', 2)
+        delta = self.stats.since(before)
+        self.assertEqual(delta['counters']['rows'], 2)
+        self.stats.merge(delta)
+        self.assertEqual(self.stats.counters['rows'], 7)
+        delta['pid'] = os.getpid() + 1
+        self.stats.merge(delta)
+        self.assertEqual(self.stats.counters['rows'], 9)
+
+    def test_report(self):
+        """Tests the report logs totals, stages and files."""
+        logger = mock.Mock()
+        self.stats.count(stats.COUNT_ROWS, 10)
+        self.stats.add_time(stats.STAGE_PARSE, 0.5)
+        self.stats.record_file('foo.csv', 1.0, 30)
+        self.stats.report(logger)
+        self.assertEqual(logger.info.call_count, 3)
+        self.assertEqual(logger.info.call_args_list[0][0][2], 10)
+
+    def test_report_bytes(self):
+        """Tests bytes are only reported once they were counted."""
+        logger = mock.Mock()
+        self.stats.count(stats.COUNT_BATCHES, 2)
+        self.stats.report(logger)
+        self.assertEqual(logger.info.call_args[0][-1], '2 batches')
+        self.stats.count(stats.COUNT_BYTES, 516)
+        self.stats.report(logger)
+        self.assertEqual(logger.info.call_args[0][-1],
+                         '516 bytes in 2 batches')
+
+    def test_report_caches(self):
+        """Tests every date cache that was used is reported."""
+        logger = mock.Mock()
+        used = mock.Mock(hits=3, misses=1)
+        unused = mock.Mock(hits=0, misses=0)
+        self.stats.report(logger, caches={'date_to_iso': used,
+                                          'date_to_epoch': unused})
+        self.assertEqual(logger.info.call_count, 2)
+        self.assertEqual(logger.info.call_args[0][1:],
+                         ('date_to_iso', 3, 1))
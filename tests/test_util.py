@@ -2,6 +2,7 @@
 import unittest
 import voluptuous as vol
 import logging
+from dateutil import parser, tz
 from minflux import util as util
 
 
@@ -16,6 +17,39 @@ class TestUtilFunctions(unittest.TestCase):
         self.assertEqual(util.date_to_iso(date, month_only=True),
                          '1970-01-01T00:00:00+00:00')
 
+    def test_date_to_iso_fast_path(self):
+        """Tests the fast path matches dateutil for mint date formats."""
+        for date in ['1/8/1970', '01/08/1970', '12/31/2017', '2/29/2016']:
+            expected = parser.parse(date).replace(tzinfo=tz.tzutc())
+            self.assertEqual(util.date_to_iso(date), expected.isoformat())
+
+    def test_date_to_iso_fallback(self):
+        """Tests dates outside the fast path fall back to dateutil."""
+        self.assertEqual(util.date_to_iso('1970-01-08'),
+                         '1970-01-08T00:00:00+00:00')
+        self.assertEqual(util.date_to_iso('Jan 8 1970'),
+                         '1970-01-08T00:00:00+00:00')
+        with self.assertRaises(ValueError):
+            util.date_to_iso('2/30/2017')
+
+    def test_date_to_iso_cached(self):
+        """Tests repeated dates are served from the cache."""
+        util.date_to_iso('3/4/1971')
+        hits = util._date_to_iso.cache_info().hits
+        util.date_to_iso('3/4/1971')
+        self.assertEqual(util.date_cache_info()['date_to_iso'].hits,
+                         hits + 1)
+
+    def test_period_start(self):
+        """Tests start of day, week and month for a date."""
+        date = '1/8/1970'
+        self.assertEqual(util.period_start(date, 'day').isoformat(),
+                         '1970-01-08T00:00:00+00:00')
+        self.assertEqual(util.period_start(date, 'week').isoformat(),
+                         '1970-01-05T00:00:00+00:00')
+        self.assertEqual(util.period_start(date, 'month').isoformat(),
+                         '1970-01-01T00:00:00+00:00')
+
     def test_convert_value(self):
         """Tests conversion of value to signed value."""
         self.assertEqual(util.convert_value(10, 'debit'), -10)
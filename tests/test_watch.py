@@ -0,0 +1,125 @@
+"""Tests watching the csv directory."""
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from minflux import watch
+
+
+class WatchTestCase(unittest.TestCase):
+    """Creates a temporary directory to watch."""
+
+    def setUp(self):
+        """Creates a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Removes the temporary directory."""
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, contents='foo', age=0):
+        """Writes a file, dating it age seconds ago."""
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'a') as outfile:
+            outfile.write(contents)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+
+class TestDebouncer(WatchTestCase):
+    """Test files are held back until they settle."""
+
+    def test_settled(self):
+        """Verifies an old file is ready on the second look."""
+        path = self.write('foo.csv', age=10)
+        debouncer = watch.Debouncer(settle=2)
+        debouncer.add([path])
+        self.assertEqual(debouncer.ready(), [])
+        self.assertEqual(debouncer.ready(), [path])
+        self.assertEqual(debouncer.pending, {})
+
+    def test_still_written(self):
+        """Verifies a file is held while it grows or is recent."""
+        path = self.write('foo.csv', age=10)
+        now = [time.time()]
+        debouncer = watch.Debouncer(settle=2, clock=lambda: now[0])
+        debouncer.add([path])
+        debouncer.ready()
+        self.write('foo.csv', age=10)
+        self.assertEqual(debouncer.ready(), [])
+        self.write('foo.csv')
+        self.assertEqual(debouncer.ready(), [])
+        self.assertEqual(debouncer.ready(), [])
+        now[0] += 3
+        self.assertEqual(debouncer.ready(), [path])
+
+    def test_removed(self):
+        """Verifies files removed before they settle are dropped."""
+        debouncer = watch.Debouncer()
+        debouncer.add([os.path.join(self.tmpdir, 'foo.csv')])
+        self.assertEqual(debouncer.ready(), [])
+        self.assertEqual(debouncer.pending, {})
+
+
+class TestWatchers(WatchTestCase):
+    """Test changed csv files are reported."""
+
+    def check_watcher(self, watcher):
+        """Verifies new and changed csv files are reported."""
+        try:
+            foo = self.write('foo.csv')
+            self.write('foo.txt')
+            self.assertEqual(watcher.changes(1), [foo])
+            self.assertEqual(watcher.changes(0.01), [])
+            self.write('foo.csv', age=5)
+            self.assertEqual(watcher.changes(1), [foo])
+        finally:
+            watcher.close()
+
+    def test_poller(self):
+        """Verifies polling the directory."""
+        self.check_watcher(watch.Poller(self.tmpdir, interval=0.01))
+
+    def test_inotify(self):
+        """Verifies inotify, where the platform has it."""
+        try:
+            watcher = watch.Inotify(self.tmpdir)
+        except OSError:
+            self.skipTest('inotify is not available')
+        self.check_watcher(watcher)
+
+    def test_fallback(self):
+        """Verifies a missing directory falls back to polling."""
+        watcher = watch.create_watcher(os.path.join(self.tmpdir, 'nope'))
+        self.assertIsInstance(watcher, watch.Poller)
+
+
+class TestWatch(WatchTestCase):
+    """Test the watch loop."""
+
+    def test_watch(self):
+        """Verifies existing and new files are handed on once settled."""
+        old = self.write('old.csv', age=10)
+        handled = list()
+        stop = threading.Event()
+        new_file = threading.Event()
+
+        def handle(files):
+            handled.extend(files)
+            if len(handled) == 2:
+                stop.set()
+            else:
+                new_file.set()
+
+        thread = threading.Thread(target=watch.watch, args=(
+            self.tmpdir, handle), kwargs={'settle': 0.2, 'interval': 0.05,
+                                          'stop': stop})
+        thread.start()
+        self.assertTrue(new_file.wait(5))
+        new = self.write('new.csv')
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(handled, [old, new])
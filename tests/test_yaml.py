@@ -1,11 +1,14 @@
 """Tests the yaml loading functionality."""
+import os
+import shutil
+import tempfile
 import unittest
 from unittest import mock
 from minflux import yaml as yaml
 
 
 @mock.patch('minflux.yaml.os.path.isfile')
-@mock.patch('minflux.yaml.yaml.load')
+@mock.patch('yaml.load')
 class TestYamlLoad(unittest.TestCase):
     """Test load_yaml functionality."""
 
@@ -185,6 +188,31 @@ class TestYamlLoad(unittest.TestCase):
             validated_config = yaml.load_yaml('/tmp')
         self.assertTrue('sum' in validated_config['mint'])
 
+    def test_load_sum_periods_config(self, mock_yaml_load, mock_isfile):
+        """Tests loading of configuration with sum periods defined."""
+        config = {
+            'influxdb': {
+                'host': 'foo',
+                'port': 1234,
+                'user': 'bar',
+                'password': 'foobar',
+                'dbname': 'foodb'
+            },
+            'mint': {
+                'file': 'foo.csv',
+                'sum': {
+                    'periods': 'week'
+                }
+            }
+        }
+        mock_isfile.return_value = True
+        mock_yaml_load.return_value = config
+        mock_fh = mock.mock_open()
+        with mock.patch('builtins.open', mock_fh, create=False):
+            validated_config = yaml.load_yaml('/tmp')
+        self.assertEqual(validated_config['mint']['sum']['periods'],
+                         ['week'])
+
     def test_file_not_exist(self, mock_yaml_load, mock_isfile):
         """Tests loading of configuration where mint file does not exist."""
         mock_isfile.return_value = False
@@ -265,3 +293,90 @@ class TestYamlLoad(unittest.TestCase):
         self.assertTrue('file' in x['mint'])
         self.assertTrue('archive' in x['mint'])
         self.assertEqual('/tmp', x['mint']['archive']['directory'])
+
+
+class TestYamlCache(unittest.TestCase):
+    """Test loading real files and the validated config cache."""
+
+    def setUp(self):
+        """Writes a config file."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.tmpdir, 'config.yaml')
+        self.write_config('foo.csv')
+
+    def tearDown(self):
+        """Removes the temporary directory."""
+        shutil.rmtree(self.tmpdir)
+
+    def write_config(self, csvfile):
+        """Writes a minimal config reading csvfile."""
+        with open(self.config_file, 'w') as outfile:
+            outfile.write('influxdb:\n  host: foo\n  port: 1234\n'
+                          '  user: bar\n  password: foobar\n'
+                          '  dbname: foodb\n'
+                          'mint:\n  file: {}\n'.format(csvfile))
+
+    def test_schema_alias(self):
+        """Tests SCHEMA still validates configs like get_schema."""
+        config = {
+            'influxdb': {'host': 'foo', 'port': 1234, 'user': 'bar',
+                         'password': 'foobar', 'dbname': 'foodb'},
+            'mint': {'file': 'foo.csv'}
+        }
+        self.assertEqual(yaml.SCHEMA(config), yaml.get_schema()(config))
+        self.assertEqual(yaml.SCHEMA.schema, yaml.get_schema().schema)
+
+    def test_safe_loader(self):
+        """Tests the config is parsed with a safe loader."""
+        with mock.patch('yaml.load') as mock_load:
+            mock_load.return_value = {
+                'influxdb': {'host': 'foo', 'port': 1234, 'user': 'bar',
+                             'password': 'foobar', 'dbname': 'foodb'},
+                'mint': {'file': 'foo.csv'}
+            }
+            yaml.load_yaml(self.tmpdir)
+        loader = mock_load.call_args[1]['Loader']
+        self.assertTrue(loader.__name__ in ['CSafeLoader', 'SafeLoader'])
+
+    def test_no_cache(self):
+        """Tests no cache is written by default."""
+        config = yaml.load_yaml(self.tmpdir)
+        self.assertEqual(config['mint']['file'], 'foo.csv')
+        self.assertEqual(config['influxdb']['batch_size'], 5000)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tmpdir, '.config.yaml.cache')))
+
+    def test_cache_reused(self):
+        """Tests the cached config is used while the file is unchanged."""
+        config = yaml.load_yaml(self.tmpdir, cache=True)
+        with mock.patch('minflux.yaml.validate') as mock_validate:
+            cached = yaml.load_yaml(self.tmpdir, cache=True)
+        self.assertEqual(mock_validate.call_count, 0)
+        self.assertEqual(cached, config)
+
+    def test_cache_private(self):
+        """Tests only the owner can read the cached password."""
+        os.chmod(self.config_file, 0o644)
+        yaml.load_yaml(self.tmpdir, cache=True)
+        mode = os.stat(os.path.join(self.tmpdir, '.config.yaml.cache'))
+        self.assertEqual(mode.st_mode & 0o777, 0o600)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['.config.yaml.cache', 'config.yaml'])
+
+    def test_cache_invalidated(self):
+        """Tests a changed config file is parsed again."""
+        yaml.load_yaml(self.tmpdir, cache=True)
+        self.write_config('bar.csv')
+        stat = os.stat(self.config_file)
+        os.utime(self.config_file, ns=(stat.st_atime_ns,
+                                       stat.st_mtime_ns + 10 ** 9))
+        config = yaml.load_yaml(self.tmpdir, cache=True)
+        self.assertEqual(config['mint']['file'], 'bar.csv')
+
+    def test_cache_unreadable(self):
+        """Tests a corrupt cache is ignored."""
+        with open(os.path.join(self.tmpdir, '.config.yaml.cache'),
+                  'w') as outfile:
+            outfile.write('{not json')
+        config = yaml.load_yaml(self.tmpdir, cache=True)
+        self.assertEqual(config['mint']['file'], 'foo.csv')